@@ -1,9 +1,15 @@
 import time
+import uuid
+import hmac
 import requests
 import json
 import os
+import sys
+import signal
+import multiprocessing
+from multiprocessing.connection import wait
 from concurrent import futures
-from threading import Lock
+from threading import Event, Lock
 from collections import defaultdict
 from datetime import datetime  # 新增：用于格式化时间
 from loguru import logger
@@ -11,6 +17,12 @@ import grpc
 
 import modelpool_pb2
 import modelpool_pb2_grpc
+from modelpool_history import ProbeHistory
+from modelpool_usage import UsageRegistry
+from modelpool_shm import SharedModelTable
+from modelpool_trace import TraceRecorder
+from modelpool_capacity import ThroughputEstimator
+from modelpool_assignment import AssignmentLeases, pick_two
 
 #-----------------------------------------------------------------
 #      配置日志处理，设置为 20M每个文件，一共5个。循环覆盖
@@ -26,88 +38,431 @@ if 0:
     # 配置日志文件
     logger.add(log_path, rotation="20 MB", retention=5)
 #-----------------------------------------------------------------
+# 状态字符串到枚举的映射，以及 field_mask 可以选择的 Model 字段
+STATUS_CODES = {
+    "unknown": modelpool_pb2.STATUS_UNKNOWN,
+    "available": modelpool_pb2.STATUS_AVAILABLE,
+    "unavailable": modelpool_pb2.STATUS_UNAVAILABLE,
+}
+MODEL_FIELDS = {field.name for field in modelpool_pb2.Model.DESCRIPTOR.fields}
+LOG_CLIENTS_LIMIT = 200  # 登记的客户端超过这么多的时候，周期日志只打印客户端数量
+
 # 定义模型类
 class Model:
-    def __init__(self, name, model_type, model, base_url):
+    def __init__(self, name, model_type, model, base_url, max_concurrency=0, history_size=720, tier=0, zone="",
+                 draining=False, traffic_weight=100, interactive_only=False):
         self.name = name
         self.model_type = model_type
         self.model = model
         self.base_url = base_url
+        self.tier = tier      # 网络层级，越小越近
+        self.zone = zone      # 所在区域
+        # 管理员设置（SetEndpointState 或者配置文件）：摘流量中的端点不参与新的选择，流量权重用于灰度
+        self.draining = draining
+        self.traffic_weight = traffic_weight
+        self.interactive_only = interactive_only  # 只给交互式客户端用，批量客户端看不到
         self.status = "unknown"
         self.load = 0
-        self.usage_count = 0  # 新增：记录使用该模型的客户端数量
+        self.usage = None        # 客户端使用信息登记表（UsageRegistry），由服务端绑定
+        self.usage_index = None  # 在登记表中的模型下标
+        self.assignments = None  # PickEndpoint 分配出去还没到期的租约（AssignmentLeases），由模型池绑定
+        self.assignment_index = None
+        self.max_concurrency = max_concurrency  # 最大并发槽位数，0 表示不限制
+        self.slots = {}       # 已分配的槽位 {slot_id: (client_id, 到期时间)}
+        self.history = ProbeHistory(history_size)  # 固定大小的探测历史
+        # 探测状态（连续成功/失败次数、status、recovered_at）：健康检查线程和客户端上报失败触发的重新探测都会改，要加锁
+        self.probe_lock = Lock()
+        self.consecutive_ok = 0    # 连续探测成功次数
+        self.consecutive_fail = 0  # 连续探测失败次数
+        self.recovered_at = 0.0    # 从不可用恢复成可用的时间，用于慢启动
+        # 多 worker 模式下的共享内存表和本模型在表中的下标，槽位计数放在共享内存里
+        self.shared = None
+        self.shared_index = None
+        # 多 worker 模式下其他 worker 进程的使用客户端数和在途请求数（定时从共享内存同步）
+        self.peer_usage_count = 0
+        self.peer_inflight = 0
+        self.peer_assigned = 0
+        # 客户端上报的 token 吞吐和学到的容量
+        self.throughput = ThroughputEstimator()
+        self.peer_tokens_per_sec = 0
+        # 客户端上报调用失败之后的立即重新探测，同一个端点同时只排一次
+        self.reprobe_lock = Lock()
+        self.reprobe_pending = False
+        self.last_reprobe = 0.0
+        self.latency_rising = False  # 上一个周期探测耗时是否在持续上升，只在变化的时候打印
+
+    @property
+    def usage_count(self):
+        """使用该模型的客户端数量，各个分片（以及其他 worker）的计数合并"""
+        local = self.usage.usage_count(self.usage_index) if self.usage is not None else 0
+        return local + self.peer_usage_count
+
+    @property
+    def inflight(self):
+        """所有客户端上报的在途请求数之和，各个分片（以及其他 worker）的计数合并"""
+        local = self.usage.inflight(self.usage_index) if self.usage is not None else 0
+        return local + self.peer_inflight
+
+    @property
+    def assigned(self):
+        """PickEndpoint 分配出去、租期还没到的数量（还没有体现在在途请求数里），包括其他 worker 分配的"""
+        local = self.assignments.count(self.assignment_index) if self.assignments is not None else 0
+        return local + self.peer_assigned
+
+    @property
+    def tokens_per_sec(self):
+        """最近的 token 吞吐，包括其他 worker 收到的上报"""
+        return self.throughput.rate() + self.peer_tokens_per_sec
+
+    @property
+    def active_slots(self):
+        """已分配的槽位数，包括其他 worker 分配的"""
+        if self.shared is not None:
+            return self.shared.slot_count(self.shared_index)
+        return len(self.slots)
+
+    def has_free_slot(self):
+        return self.max_concurrency <= 0 or self.active_slots < self.max_concurrency
+
+    def take_slot(self, slot_id, client_id, expire_at, limit=None):
+        """分配一个槽位，没有空闲的返回 False；多 worker 模式下在共享内存里加锁计数
+        limit 是这次分配可以用到的槽位数（批量请求不能用预留的槽位），默认 max_concurrency，0 表示不限制"""
+        limit = self.max_concurrency if limit is None else limit
+        if self.shared is not None:
+            if not self.shared.try_acquire_slot(self.shared_index, limit):
+                return False
+        elif limit > 0 and self.active_slots >= limit:
+            return False
+        self.slots[slot_id] = (client_id, expire_at)
+        return True
+
+    def drop_slot(self, slot_id):
+        """释放槽位，返回 (client_id, 到期时间)，不是本进程分配的返回 None"""
+        entry = self.slots.pop(slot_id, None)
+        if entry is not None and self.shared is not None:
+            self.shared.release_slot(self.shared_index)
+        return entry
+
+    def weight(self, slow_start_seconds):
+        """流量权重 1-100：刚恢复的端点在慢启动期间线性增加，再按管理员设置的流量权重折算"""
+        elapsed = time.time() - self.recovered_at
+        if slow_start_seconds <= 0 or elapsed >= slow_start_seconds:
+            return self.traffic_weight
+        return max(1, int(self.traffic_weight * elapsed / slow_start_seconds))
+
+    def slot_usage(self):
+        """槽位占用比例，不限制并发的按 0 计算"""
+        if self.max_concurrency <= 0:
+            return 0.0
+        return self.active_slots / self.max_concurrency
+
+    def utilization(self):
+        """端点的繁忙程度 0-1：槽位占用比例和吞吐占容量的比例（观察到饱和点之后才有）取大的，都没有按 0"""
+        usage = self.slot_usage()
+        if self.throughput.measured:
+            usage = max(usage, self.tokens_per_sec / self.throughput.capacity)
+        return min(1.0, usage)
+
+#---------------------------------------------------------
+# 模型池：一组模型和它自己的探测间隔、探测超时、使用信息、槽位锁和响应缓存。
+# 不同的池互不影响：实验池里有几十个挂掉的端点，也不会拖慢生产池的探测和 RPC。
+#---------------------------------------------------------
+DEFAULT_POOL = "default"  # 请求中不带 pool，或者配置文件只有顶层 models 的时候使用的池
+POOL_SETTINGS = ("health_check_interval", "probe_timeout", "rise", "fall", "slow_start_seconds",
+                 "usage_shards", "probe_concurrency", "response_cache_ms", "interactive_reserve")
+
+class Pool:
+    def __init__(self, name, models, health_check_interval=10, probe_timeout=5, rise=2, fall=2,
+                 slow_start_seconds=60, usage_shards=1, probe_concurrency=8, response_cache_ms=200,
+                 interactive_reserve=0.0):
+        self.name = name
+        self.models = models
+        self.health_check_interval = health_check_interval  # 探测间隔（秒）
+        self.probe_timeout = probe_timeout                  # 单个端点的探测超时（秒）
+        self.probe_concurrency = probe_concurrency          # 池内同时探测的端点数
+        #---------------------------------------------------------
+        # 抖动抑制和慢启动：连续 rise 次成功才从不可用变成可用，连续 fall 次失败才从可用变成不可用；
+        # 恢复后的 slow_start_seconds 秒内权重从 1 逐渐增加到 100，避免所有 agent 一下子压上去
+        #---------------------------------------------------------
+        self.rise = rise
+        self.fall = fall
+        self.slow_start_seconds = slow_start_seconds
+        #---------------------------------------------------------
+        # 1：客户端使用信息（client_id 用了哪些模型、最后活跃时间、在途请求数），
+        # 按 client_id 分片加锁（默认 1 个分片），模型的 usage_count / inflight 读的时候合并各个分片
+        #---------------------------------------------------------
+        self.usage = UsageRegistry([(m.base_url, m.model) for m in models], num_shards=usage_shards)
+        for m in models:
+            m.usage = self.usage
+            m.usage_index = self.usage.model_index[(m.base_url, m.model)]
+
+        # PickEndpoint 的分配租约，按端点在池内的位置计数
+        self.assignments = AssignmentLeases(len(models))
+        for i, m in enumerate(models):
+            m.assignments, m.assignment_index = self.assignments, i
+
+        # (base_url, model) 到模型的索引
+        self.model_index = {}
+        for m in models:
+            self.model_index.setdefault((m.base_url, m.model), m)
+
+        # 模型列表版本，状态有变化的时候递增，客户端用它判断缓存是否需要更新
+        self.models_version = int(time.time() * 1000)
+
+        self.slot_lock = Lock()   # 保护并发槽位的分配和释放
+        #---------------------------------------------------------
+        # 2：响应缓存：排好序的模型和完整的 protobuf，response_cache_ms 内的请求直接复用，
+        # 版本变化的时候作废；usage_count / inflight 最多延迟 response_cache_ms，0 表示不缓存
+        #---------------------------------------------------------
+        self.response_cache_seconds = response_cache_ms / 1000
+        self.response_cache = {}  # {(只要可用的, 优先级): (到期时间, 版本, [(Model, protobuf Model), ...])}
+        #---------------------------------------------------------
+        # 3：优先级：每个端点的 interactive_reserve（0-1）留给交互式客户端，端点的繁忙程度（utilization）
+        # 达到 1 - interactive_reserve 之后不再返回给批量客户端，也不再给批量请求分配槽位；
+        # 没到之前批量客户端看到的权重随繁忙程度线性降低。0 表示不预留（默认）
+        #---------------------------------------------------------
+        self.interactive_reserve = interactive_reserve
+
+    def batch_share(self, m):
+        """批量客户端可以用到的端点容量比例"""
+        return 0.0 if m.interactive_only else 1.0 - self.interactive_reserve
+
+    def admits_batch(self, m):
+        """端点现在是否可以给批量客户端用"""
+        share = self.batch_share(m)
+        if share >= 1:
+            return True
+        if share <= 0 or (m.max_concurrency > 0 and int(m.max_concurrency * share) < 1):
+            return False
+        return m.utilization() < share
+
+    def batch_slot_limit(self, m):
+        """批量请求可以用到的槽位数，0 表示不限制"""
+        if m.max_concurrency <= 0:
+            return 0
+        return int(m.max_concurrency * self.batch_share(m))
+
+    def batch_weight(self, m):
+        """批量客户端看到的权重：越忙越小，留出余量给交互式请求"""
+        weight = m.weight(self.slow_start_seconds)
+        share = self.batch_share(m)
+        if share >= 1:
+            return weight
+        return max(1, int(weight * (1 - m.utilization() / share)))
+
+    def bump_version(self, version=None):
+        """模型状态有变化，更新列表版本（多 worker 模式下直接使用 0 号 worker 发布的版本）"""
+        self.models_version = version or max(self.models_version + 1, int(time.time() * 1000))
+        self.response_cache = {}
+        logger.info(f"Pool [{self.name}] model list version updated to {self.models_version}")
 
 # 模型池服务器，主要负责提供模型列表和健康检查，给agent提供可用的模型列表
 class ModelPoolServiceServicer(modelpool_pb2_grpc.ModelPoolServiceServicer):
-    def __init__(self, config_file="modelserver.json"): # 默认配置在本目录下
+    SHARED_SYNC_INTERVAL = 0.2  # 多 worker 模式下和共享内存同步的间隔（秒）
+
+    def __init__(self, config_file="modelserver.json", shared=None, worker_id=0): # 默认配置在本目录下
         self.config = self._load_config(config_file) # 加载配置
-        self.models = self.config.get("models", [])
-        logger.info(f"加载了 {len(self.models)} 个模型配置， models: {self.models}")
-        self.health_check_interval = self.config.get("health_check_interval", 10)  # 默认 60 秒
+        self.pools = self.config["pools"]  # {池名称: Pool}
+        # 所有池的模型按配置顺序展开，共享内存表的下标就是这里的下标
+        self.models = [m for pool in self.pools.values() for m in pool.models]
+        for pool in self.pools.values():
+            logger.info(f"模型池 [{pool.name}] 加载了 {len(pool.models)} 个模型配置， models: {pool.models}")
         #---------------------------------------------------------
-        # 1：跟踪 client_id 到多个 (base_url, model) 的映射
-        # agent的 client 用了哪些模型
+        # 多 worker 模式：shared 是 fork 之前创建的共享内存表，只有 0 号 worker 做健康检查
         #---------------------------------------------------------
-        self.client_usage = defaultdict(set) # {client_id1: set([(base_url, model), client_id2: set([(base_url, model)，(base_url, model)...])}
-        
+        self.shared = shared
+        self.worker_id = worker_id
+        self.probing = shared is None or worker_id == 0
+        self.publish_lock = Lock()  # 每个池一个探测线程，发布到共享内存的时候要串行
         #---------------------------------------------------------
-        # 2：反向映射，记录每个模型被哪些 client_id 使用 ，模型对应的有多少client
+        # 就绪：所有池都完成了第一轮探测（非 0 号 worker 是读到了 0 号 worker 发布的结果），
+        # serve() 等到就绪之后才监听端口，新进程不会把还没探测过的空列表返回给 agent
         #---------------------------------------------------------
-        self.model_clients = defaultdict(set)  # {(base_url, model): set([client_id1, client_id2,...])}
-        
+        self.ready = Event()
+        self.probed_pools = set()
+        self.admin_seq = 0  # 多 worker 模式下已经应用的管理员设置的序号
+        if shared is not None:
+            if shared.num_models != len(self.models):
+                raise ValueError(f"共享内存表有 {shared.num_models} 个模型，配置文件有 {len(self.models)} 个")
+            for i, m in enumerate(self.models):
+                m.shared, m.shared_index = shared, i
+                m.history = shared.history(i)
+        # 探测结果和状态变化的轨迹，给 modelpool_simulator.py 重放（只有做健康检查的 worker 记录）
+        trace_file = self.config.get("trace_file")
+        self.trace = TraceRecorder(trace_file) if trace_file and self.probing else None
         #---------------------------------------------------------
-        # 3：记录每个 client_id 的最后活跃时间
+        # 启动健康检查：每个池一个线程，按自己的间隔和超时探测
         #---------------------------------------------------------
-        self.client_last_active = {}  # {client_id: timestamp}
+        for pool in self.pools.values():
+            self._start_health_check(pool)
+        if shared is not None:
+            self._start_shared_sync()
 
-        self.usage_lock = Lock()  # 保护并发更新
-        #---------------------------------------------------------
-        # 4：启动健康检查
-        #---------------------------------------------------------
-        self._start_health_check() 
+    @staticmethod
+    def _check_setting(key, value, where=""):
+        """校验池的设置项"""
+        if key in ("health_check_interval", "rise", "fall", "usage_shards", "probe_concurrency"):
+            if not isinstance(value, int) or value <= 0:
+                raise ValueError(f"'{key}' 必须是正整数{where}")
+        elif key == "probe_timeout":
+            if not isinstance(value, (int, float)) or value <= 0:
+                raise ValueError(f"'{key}' 必须是正数{where}")
+        elif key in ("slow_start_seconds", "response_cache_ms"):
+            if not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"'{key}' 必须是非负数{where}")
+        elif key == "interactive_reserve":
+            if not isinstance(value, (int, float)) or not 0 <= value <= 1:
+                raise ValueError(f"'{key}' 必须是 0-1 之间的数{where}")
+
+    @staticmethod
+    def _load_models(items, history_size):
+        """解析一个池的 models 数组"""
+        if not isinstance(items, list):
+            raise ValueError("'models' 必须是数组")
+        models = []
+        for item in items:
+            if not all(key in item for key in ["name", "model_type", "model", "base_url"]):
+                raise ValueError(f"模型配置项缺失必要字段: {item}")
+            max_concurrency = item.get("max_concurrency", 0)
+            if not isinstance(max_concurrency, int) or max_concurrency < 0:
+                raise ValueError(f"'max_concurrency' 必须是非负整数: {item}")
+            tier = item.get("tier", 0)
+            if not isinstance(tier, int) or tier < 0:
+                raise ValueError(f"'tier' 必须是非负整数: {item}")
+            zone = item.get("zone", "")
+            if not isinstance(zone, str):
+                raise ValueError(f"'zone' 必须是字符串: {item}")
+            draining = item.get("draining", False)
+            if not isinstance(draining, bool):
+                raise ValueError(f"'draining' 必须是 true 或 false: {item}")
+            weight = item.get("weight", 100)
+            if not isinstance(weight, int) or not 1 <= weight <= 100:
+                raise ValueError(f"'weight' 必须是 1-100 的整数: {item}")
+            interactive_only = item.get("interactive_only", False)
+            if not isinstance(interactive_only, bool):
+                raise ValueError(f"'interactive_only' 必须是 true 或 false: {item}")
+            models.append(Model(
+                name=item["name"],
+                model_type=item["model_type"],
+                model=item["model"],
+                base_url=item["base_url"],
+                max_concurrency=max_concurrency,
+                history_size=history_size,
+                tier=tier,
+                zone=zone,
+                draining=draining,
+                traffic_weight=weight,
+                interactive_only=interactive_only
+            ))
+        return models
 
-    def _load_config(self, config_file):
-        """从 JSON 文件加载配置"""
+    @staticmethod
+    def _load_config(config_file):
+        """从 JSON 文件加载配置
+        顶层的 models 是 default 池；"pools": {"名称": {"models": [...], 其他设置}} 配置多个池，
+        池里没有配置的设置项使用顶层的值"""
         try:
             with open(config_file, "r", encoding="utf-8") as f:
                 config = json.load(f)
-            
+
             # 检查必要字段
-            if "models" not in config:
-                raise ValueError("配置文件中缺少 'models' 字段")
-            if not isinstance(config["models"], list):
-                raise ValueError("'models' 必须是数组")
-            if "health_check_interval" in config and not isinstance(config["health_check_interval"], int):
-                raise ValueError("'health_check_interval' 必须是整数")
-
-            models = []
-            for item in config["models"]:
-                if not all(key in item for key in ["name", "model_type", "model", "base_url"]):
-                    raise ValueError(f"模型配置项缺失必要字段: {item}")
-                models.append(Model(
-                    name=item["name"],
-                    model_type=item["model_type"],
-                    model=item["model"],
-                    base_url=item["base_url"]
-                ))
-            logger.info(f"从 {config_file} 加载了 {len(models)} 个模型配置，健康检查间隔: {config.get('health_check_interval', 10)} 秒")
-            return {"models": models, "health_check_interval": config.get("health_check_interval", 10)}
+            if "models" not in config and "pools" not in config:
+                raise ValueError("配置文件中缺少 'models' 或 'pools' 字段")
+            if "pools" in config and not isinstance(config["pools"], dict):
+                raise ValueError("'pools' 必须是对象")
+            history_size = config.get("history_size", 720)  # 默认保存 720 次探测，10 秒间隔就是 2 小时
+            if not isinstance(history_size, int) or history_size <= 0:
+                raise ValueError("'history_size' 必须是正整数")
+            for key in POOL_SETTINGS:
+                if key in config:
+                    ModelPoolServiceServicer._check_setting(key, config[key])
+            defaults = {key: config[key] for key in POOL_SETTINGS if key in config}
+
+            pool_configs = dict(config.get("pools", {}))
+            if "models" in config:
+                if DEFAULT_POOL in pool_configs:
+                    raise ValueError(f"顶层 'models' 就是 '{DEFAULT_POOL}' 池，不能再在 'pools' 中配置")
+                pool_configs = {DEFAULT_POOL: {"models": config["models"]}, **pool_configs}
+
+            pools = {}
+            for name, pool_config in pool_configs.items():
+                if not isinstance(pool_config, dict) or "models" not in pool_config:
+                    raise ValueError(f"池 '{name}' 缺少 'models' 字段")
+                settings = dict(defaults)
+                for key in POOL_SETTINGS:
+                    if key in pool_config:
+                        ModelPoolServiceServicer._check_setting(key, pool_config[key], f"（池 '{name}'）")
+                        settings[key] = pool_config[key]
+                pools[name] = Pool(name, ModelPoolServiceServicer._load_models(pool_config["models"], history_size), **settings)
+                logger.info(f"从 {config_file} 加载了池 [{name}] 的 {len(pools[name].models)} 个模型配置，健康检查间隔: {pools[name].health_check_interval} 秒")
+
+            if "workers" in config and (not isinstance(config["workers"], int) or config["workers"] <= 0):
+                raise ValueError("'workers' 必须是正整数")
+            grace = config.get("shutdown_grace_seconds", 10)
+            if not isinstance(grace, (int, float)) or grace < 0:
+                raise ValueError("'shutdown_grace_seconds' 必须是非负数")
+            admin_token = config.get("admin_token", "")
+            if not isinstance(admin_token, str):
+                raise ValueError("'admin_token' 必须是字符串")
+            return {
+                "pools": pools,
+                "workers": config.get("workers", 1),
+                "history_size": history_size,
+                "trace_file": config.get("trace_file"),
+                "shutdown_grace_seconds": grace,
+                "admin_token": admin_token,
+            }
         except FileNotFoundError:
             logger.info(f"配置文件 {config_file} 不存在")
-            return {"models": [], "health_check_interval": 10}
         except json.JSONDecodeError:
             logger.info(f"配置文件 {config_file} 格式错误")
-            return {"models": [], "health_check_interval": 10}
         except Exception as e:
             logger.info(f"加载配置失败: {e}")
-            return {"models": [], "health_check_interval": 10}
+        return {"pools": {DEFAULT_POOL: Pool(DEFAULT_POOL, [])}}
 
     # 进行健康检查，采用openAI格式的http请求
-    def _check_health(self, model):
-        """使用 base_url + '/models' 检查模型服务状态"""
+    def _check_health(self, pool, model):
+        """检查模型服务状态，并把探测结果和耗时记录到探测历史，返回探测是否成功"""
+        start = time.perf_counter()
+        ok = self._probe(model, pool.probe_timeout)
+        latency_ms = (time.perf_counter() - start) * 1000
+        model.load = 0
+        model.history.record(time.time(), ok, latency_ms, model.load)
+        with model.probe_lock:
+            self._update_status(pool, model, ok, latency_ms)
+        return ok
+
+    def _update_status(self, pool, model, ok, latency_ms):
+        """按探测结果更新连续成功/失败次数和状态，调用的时候要持有 model.probe_lock"""
+        old_status = model.status
+        if ok:
+            model.consecutive_ok += 1
+            model.consecutive_fail = 0
+        else:
+            model.consecutive_fail += 1
+            model.consecutive_ok = 0
+
+        if model.status == "unknown":
+            # 启动后的第一次探测直接生效，这时候还没有 agent 在用，不需要慢启动
+            model.status = "available" if ok else "unavailable"
+        elif model.status != "available" and model.consecutive_ok >= pool.rise:
+            model.status = "available"
+            model.recovered_at = time.time()
+            logger.info(f"model [{model.name}] {model.base_url} recovered after {model.consecutive_ok} successful probes, slow start {pool.slow_start_seconds}s")
+        elif model.status == "available" and model.consecutive_fail >= pool.fall:
+            model.status = "unavailable"
+            logger.info(f"model [{model.name}] {model.base_url} marked unavailable after {model.consecutive_fail} failed probes")
+
+        if self.trace is not None:
+            self.trace.record("probe", u=model.base_url, m=model.model, ok=int(ok), ms=round(latency_ms, 1))
+            if model.status != old_status:
+                self.trace.record("status", u=model.base_url, m=model.model, s=model.status)
+
+    def _probe(self, model, timeout=5):
+        """使用 base_url + '/models' 探测模型服务，返回是否正常"""
         try:
             # 调用 vLLM 的 /models 接口作为心跳请求
-            response = requests.get(f"{model.base_url}/models", timeout=5)
+            response = requests.get(f"{model.base_url}/models", timeout=timeout)
             logger.info(f"====_check_health: {model.base_url}，rsp: {response.status_code} text: {response.text}")
             if response.status_code == 200:
                 data = response.json()
@@ -125,147 +480,637 @@ class ModelPoolServiceServicer(modelpool_pb2_grpc.ModelPoolServiceServicer):
 
                 # 检查模型名称是否匹配
                 if actual_model_name == expected_model_path:
-                    model.status = "available"
-                    model.load = 0
-                else:
-                    logger.error(f"模型名称不匹配！预期: {expected_model_path}, 实际: {actual_model_name}")
-                    model.status = "unavailable"
-                    model.load = 0
-            else:
-                model.status = "unavailable"
-                model.load = 0
+                    return True
+                logger.error(f"模型名称不匹配！预期: {expected_model_path}, 实际: {actual_model_name}")
+            return False
         except requests.RequestException:
             # 请求超时或连接失败，认为服务不可用
-            model.status = "unavailable"
-            model.load = 0
+            return False
 
-    def _cleanup_inactive_clients(self):
+    def _cleanup_inactive_clients(self, pool):
         """清理超过 3 个探测周期未活跃的客户端"""
-        with self.usage_lock:
-            current_time = time.time()
-            timeout = 3 * self.health_check_interval  # 3 个周期
-            inactive_clients = [
-                client_id for client_id, last_active in self.client_last_active.items()
-                if current_time - last_active > timeout
-            ]
-
-            for client_id in inactive_clients:
-                if client_id in self.client_usage:
-                    models_used = self.client_usage[client_id]
-                    for model_key in models_used:
-                        if client_id in self.model_clients[model_key]:
-                            self.model_clients[model_key].remove(client_id)
-                            # 更新对应模型的 usage_count
-                            for m in self.models:
-                                if (m.base_url, m.model) == model_key:
-                                    m.usage_count = len(self.model_clients[model_key])
-                                    logger.info(f"Client {client_id} has timed out and has been removed from model {model_key[0]},{model_key[1]} . usage_count has been updated to:  {m.usage_count}")
-                                    break
-                    del self.client_usage[client_id]
-                    del self.client_last_active[client_id]
-                    logger.info(f"Cleaned up timed-out client {client_id}")
-
-    def _start_health_check(self):
+        pool.usage.cleanup(3 * pool.health_check_interval)  # 3 个周期
+
+    def _observe_throughput(self, pool):
+        """每个周期记录一次端点的吞吐和在途请求数，用来发现饱和点"""
+        for m in pool.models:
+            m.throughput.observe(m.tokens_per_sec, m.inflight)
+
+    def _check_latency_trends(self, pool):
+        """/models 探测耗时开始持续上升的端点打印告警，一直在上升的不再每个周期重复打印"""
+        for m in pool.models:
+            slope, rising = m.history.latency_trend()
+            if rising and not m.latency_rising:
+                logger.warning(f"model [{m.name}] {m.base_url} probe latency is rising steadily: +{slope:.1f} ms/min")
+            elif m.latency_rising and not rising:
+                logger.info(f"model [{m.name}] {m.base_url} probe latency is no longer rising")
+            m.latency_rising = rising
+
+    def _publish_models(self):
+        """把所有池的版本和探测结果发布给其他 worker"""
+        with self.publish_lock:
+            self.shared.publish_models([pool.models_version for pool in self.pools.values()], self.models)
+
+    def _mark_probed(self, pool):
+        """池完成了第一轮探测，所有池都完成了就是就绪"""
+        with self.publish_lock:
+            self.probed_pools.add(pool.name)
+            if len(self.probed_pools) < len(self.pools):
+                return
+        logger.info(f"All {len(self.pools)} pools probed, servicer is ready")
+        self.ready.set()
+
+    def _start_health_check(self, pool):
+        # 池内的端点并发探测，挂掉的端点每个周期最多拖慢本池一个 probe_timeout；
+        # 客户端上报失败触发的重新探测也在这里执行，不占 gRPC 的处理线程
+        pool.probe_executor = futures.ThreadPoolExecutor(max_workers=pool.probe_concurrency,
+                                                         thread_name_prefix=f"probe-{pool.name}")
+
         def run():
+            executor = pool.probe_executor
             while True:
-                # 逐个对每个模型进行健康检查
-                for model in self.models:
-                    self._check_health(model)# 进行健康检查
-                self._cleanup_inactive_clients()  # 在健康检查时清理超时客户端
-                time.sleep(self.health_check_interval)  # 使用配置的间隔
-
-                # 新增：打印 client_usage、model_clients 和 client_last_active
-                with self.usage_lock:
-                    logger.info("\n\n==>##current client and model usage info:")
-                    logger.info(f"client_usage: {dict(self.client_usage)}")  # 转为 dict 以便日志可读
-                    logger.info(f"model_clients: {dict(self.model_clients)}")
+                if self.probing:
+                    # 对池内的每个模型进行健康检查
+                    old_status = [m.status for m in pool.models]
+                    list(executor.map(lambda model: self._check_health(pool, model), pool.models))
+                    if old_status != [m.status for m in pool.models]:
+                        pool.bump_version()
+                    self._check_latency_trends(pool)
+                    if pool.name not in self.probed_pools:
+                        self._mark_probed(pool)
+                    if self.shared is not None and self.ready.is_set():
+                        self._publish_models()
+                self._cleanup_inactive_clients(pool)  # 在健康检查时清理超时客户端
+                self._observe_throughput(pool)  # 用 (吞吐, 在途请求数) 学习端点的容量
+                self._expire_slots(pool)  # 回收租期到了还没有释放的槽位
+                with pool.assignments.lock:
+                    pool.assignments.expire()
+                time.sleep(pool.health_check_interval)  # 使用配置的间隔
+
+                # 新增：打印 client_usage、model_clients 和 client_last_active（复制之后在锁外打印）
+                # 客户端太多的时候只打印数量，不再每个周期复制整张表
+                client_count = pool.usage.client_count()
+                if client_count > LOG_CLIENTS_LIMIT:
+                    logger.info(f"\n\n==>##[{pool.name}] {client_count} clients registered, details omitted")
+                else:
+                    client_usage, client_last_active, client_inflight = pool.usage.snapshot()
+                    model_clients = defaultdict(set)
+                    for client_id, model_keys in client_usage.items():
+                        for model_key in model_keys:
+                            model_clients[model_key].add(client_id)
+                    logger.info(f"\n\n==>##[{pool.name}] current client and model usage info:")
+                    logger.info(f"client_usage: {client_usage}")
+                    logger.info(f"model_clients: {dict(model_clients)}")
                     # 格式化时间戳为日期时间
                     active_times = {
                         client_id: datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-                        for client_id, ts in self.client_last_active.items()
+                        for client_id, ts in client_last_active.items()
                     }
                     logger.info(f"client_last_active: {active_times}")
+                    logger.info(f"client_inflight: {client_inflight}")
 
                 # 改为逐行打印模型状态
-                logger.info("==>##cur model status:")
-                for m in self.models:
-                    logger.info(f" model [{m.name}] status: {{'status': '{m.status}','usage_count':{m.usage_count},'model_type': '{m.model_type}', 'model': '{m.model}','base_url': '{m.base_url}','load': {m.load}}}")
+                logger.info(f"==>##[{pool.name}] cur model status:")
+                for m in pool.models:
+                    logger.info(f" model [{m.name}] status: {{'status': '{m.status}','usage_count':{m.usage_count},'inflight':{m.inflight},'slots':{m.active_slots}/{m.max_concurrency},'assigned':{m.assigned},'weight':{m.weight(pool.slow_start_seconds)},'tokens_per_sec':{m.tokens_per_sec:.0f},'capacity':{m.throughput.capacity:.0f},'model_type': '{m.model_type}', 'model': '{m.model}','base_url': '{m.base_url}','load': {m.load}}}")
                 logger.info("\n")
 
+        import threading
+        thread = threading.Thread(target=run, name=f"health-check-{pool.name}")
+        thread.daemon = True
+        thread.start()
+
+    def _start_shared_sync(self):
+        """多 worker 模式：定时发布本 worker 的使用信息，读取其他 worker 的使用信息和 0 号 worker 的探测结果"""
+        def run():
+            while True:
+                for pool in self.pools.values():
+                    with pool.assignments.lock:
+                        pool.assignments.expire()
+                self.shared.publish_usage(self.worker_id, [
+                    (m.usage.usage_count(m.usage_index), m.usage.inflight(m.usage_index), round(m.throughput.rate()),
+                     m.assignments.count(m.assignment_index))
+                    for m in self.models
+                ])
+                for m, (usage_count, inflight, tokens_per_sec, assigned) in zip(self.models, self.shared.peer_usage(self.worker_id)):
+                    m.peer_usage_count, m.peer_inflight, m.peer_tokens_per_sec = usage_count, inflight, tokens_per_sec
+                    m.peer_assigned = assigned
+                self._release_forwarded()
+                # 管理员设置（SetEndpointState 可能落在任何一个 worker 上）
+                admin_seq, admin_states = self.shared.read_admin()
+                if admin_states and admin_seq != self.admin_seq:
+                    self.admin_seq = admin_seq
+                    for pool in self.pools.values():
+                        self._apply_admin_state(pool, {m: admin_states[m.shared_index] for m in pool.models})
+                if not self.probing:
+                    versions, states = self.shared.read_models()
+                    if versions:
+                        self.ready.set()
+                    offset = 0
+                    for pool, version in zip(self.pools.values(), versions):
+                        if version != pool.models_version:
+                            for m, (status, load, recovered_at) in zip(pool.models, states[offset:offset + len(pool.models)]):
+                                m.status, m.load, m.recovered_at = status, load, recovered_at
+                            pool.bump_version(version)
+                        offset += len(pool.models)
+                time.sleep(self.SHARED_SYNC_INTERVAL)
+
         import threading
         thread = threading.Thread(target=run)
         thread.daemon = True
         thread.start()
-    
-    def _update_usage_count(self, client_id, model_usages):
-        """更新模型的 usage_count，支持一个 client_id 使用多个模型"""
-        # 加锁以确保并发安全
-        with self.usage_lock:
-            # 更新最后活跃时间
-            self.client_last_active[client_id] = time.time()
-           
-            if not model_usages:
-                logger.info(f"Client {client_id} sent an empty model_usages list, skipping update.")
-                return
 
-            # 初始化 client_id 的模型集合
-            client_models = self.client_usage[client_id] # 获取这个agent 下面使用了模型的集合
-
-            # 遍历请求中的所有 model_usages
-            for usage in model_usages:
-                base_url = usage.base_url
-                model_path = usage.model
-                model_key = (base_url, model_path) # base_url 和 model_path组成一个key，通过这个key可以找到 客户端的client_id
-                
-                # 如果该 client_id 尚未使用这个模型
-                if model_key not in client_models:
-                    client_models.add(model_key)
-
-                    # 更新 model_clients 映射
-                    # model_clients 的内容 {(base_url, model): set([client_id1, ...]), (base_url, model): set([client_id2,...]),....}
-                    self.model_clients[model_key].add(client_id)
-
-                    for m in self.models:
-                        if m.base_url == base_url and m.model == model_path:
-                            m.usage_count = len(self.model_clients[model_key])
-                            logger.info(f"===>agent client_id: {client_id} add new model: {base_url}{model_path}")
-                            logger.info(f"===>model: {base_url}{model_path} usage_count update to: {m.usage_count}")
-                            break
-                    else:
-                        # 如果循环未找到匹配的模型，记录警告
-                        logger.warning(f"Client {client_id} is using an unregistered model: base_url={base_url}, model={model_path}")
+    def _get_pool(self, request, context):
+        """按请求中的 pool 找到模型池，不存在的返回 NOT_FOUND"""
+        pool = self.pools.get(request.pool or DEFAULT_POOL)
+        if pool is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Unknown pool: {request.pool or DEFAULT_POOL}")
+        return pool
+
+    def _report_usages(self, pool, request):
+        """处理请求中携带的模型使用信息，返回是否需要客户端全量重传"""
+        if not request.client_id:
+            return False
+        if request.usage_seq:
+            return pool.usage.apply_report(request)
+
+        # 老客户端：只上报 model_usages，只增不减
+        if request.model_usages:
+            pool.usage.update_usage(request.client_id, request.model_usages)
+        return False
+
+    def _to_proto(self, pool, m, priority=modelpool_pb2.PRIORITY_INTERACTIVE):
+        """内部 Model 转换成 protobuf 的 Model，批量客户端看到的是降权之后的 weight"""
+        tokens_per_sec = m.tokens_per_sec
+        return modelpool_pb2.Model(
+            name=m.name, model_type=m.model_type, model=m.model, base_url=m.base_url,
+            status=m.status, load=m.load, usage_count=m.usage_count, inflight=m.inflight,
+            max_concurrency=m.max_concurrency, active_slots=m.active_slots,
+            weight=pool.batch_weight(m) if priority == modelpool_pb2.PRIORITY_BATCH else m.weight(pool.slow_start_seconds),
+            status_code=STATUS_CODES.get(m.status, modelpool_pb2.STATUS_UNKNOWN),
+            tokens_per_sec=tokens_per_sec, capacity_tokens_per_sec=m.throughput.capacity,
+            headroom_tokens_per_sec=m.throughput.headroom(tokens_per_sec),
+            capacity_measured=m.throughput.measured, tier=m.tier, zone=m.zone,
+            draining=m.draining, traffic_weight=m.traffic_weight, interactive_only=m.interactive_only,
+        )
+
+    @staticmethod
+    def _apply_mask(proto, fields):
+        """fields 不为空时只保留这些字段（status_code 始终保留）"""
+        if not fields:
+            return proto
+        return modelpool_pb2.Model(status_code=proto.status_code,
+                                   **{key: getattr(proto, key) for key in fields if key != "status_code"})
+
+    def _pool_models(self, pool, available_only, priority=modelpool_pb2.PRIORITY_INTERACTIVE):
+        """池内的模型（available_only 时只要可用的并且排好序）和它们的 protobuf，在 response_cache_ms 内复用
+        批量客户端（priority 为 PRIORITY_BATCH）的可用列表去掉了现在不能给它用的端点，权重也是降过的"""
+        now = time.time()
+        key = (available_only, priority if available_only else modelpool_pb2.PRIORITY_INTERACTIVE)
+        cached = pool.response_cache.get(key)
+        if cached is not None and cached[0] > now and cached[1] == pool.models_version:
+            return cached[2]
+        version = pool.models_version
+        if available_only:
+            batch = priority == modelpool_pb2.PRIORITY_BATCH
+            models = [m for m in pool.models if m.status == "available" and (not batch or pool.admits_batch(m))]
+            weight = pool.batch_weight if batch else lambda m: m.weight(pool.slow_start_seconds)
+            # 摘流量中的端点还在列表里（已经在用的 agent 可以继续用），排在最后；
+            # 负载相同的时候，槽位已满的排在后面，其次按权重折算后的实时并发（在途请求数）少的排在前面，
+            # 慢启动中的端点权重小，折算后的并发大，只会分到少量流量
+            models.sort(key=lambda x: (x.draining, x.load, not x.has_free_slot(), (x.inflight + 1) * 100 / weight(x)))
+        else:
+            models = list(pool.models)
+        entries = [(m, self._to_proto(pool, m, key[1])) for m in models]
+        pool.response_cache[key] = (now + pool.response_cache_seconds, version, entries)
+        return entries
+
+    def _query_fields(self, request, context):
+        """校验请求中的 field_mask，返回需要的字段集合，为空表示全部字段"""
+        fields = set(request.field_mask.paths)
+        unknown = fields - MODEL_FIELDS
+        if unknown:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, f"Unknown Model fields in field_mask: {sorted(unknown)}")
+        return fields
+
+    @staticmethod
+    def _match_query(m, request):
+        """按请求中的 model_types / names 过滤"""
+        return (not request.model_types or m.model_type in request.model_types) \
+            and (not request.names or m.name in request.names)
 
     def GetModelList(self, request, context):
+        pool = self._get_pool(request, context)
         # 更新 usage_count
-        if request.client_id and request.model_usages:
-            self._update_usage_count(request.client_id, request.model_usages)
+        resync_required = self._report_usages(pool, request)
 
-        models = [modelpool_pb2.Model(
-            name=m.name, model_type=m.model_type, model=m.model, base_url=m.base_url,
-            status=m.status, load=m.load, usage_count=m.usage_count
-        ) for m in self.models]
-        return modelpool_pb2.ModelListResponse(models=models)
+        fields = self._query_fields(request, context)
+        models = [self._apply_mask(proto, fields) for m, proto in self._pool_models(pool, False) if self._match_query(m, request)]
+        return modelpool_pb2.ModelListResponse(models=models, resync_required=resync_required,
+                                               version=pool.models_version)
 
     def GetAvailableModels(self, request, context):
+        pool = self._get_pool(request, context)
         # 更新 usage_count
-        if request.client_id and request.model_usages:
-            self._update_usage_count(request.client_id, request.model_usages)
+        resync_required = self._report_usages(pool, request)
 
-        available = [m for m in self.models if m.status == "available"]
-        available.sort(key=lambda x: x.load)
-        models = [modelpool_pb2.Model(
-            name=m.name, model_type=m.model_type, model=m.model, base_url=m.base_url,
-            status=m.status, load=m.load, usage_count=m.usage_count
-        ) for m in available]
-        return modelpool_pb2.ModelListResponse(models=models)
+        fields = self._query_fields(request, context)
+        models = [self._apply_mask(proto, fields) for m, proto in self._pool_models(pool, True, request.priority)
+                  if self._match_query(m, request)]
+        return modelpool_pb2.ModelListResponse(models=models, resync_required=resync_required,
+                                               version=pool.models_version)
+
+    def ReportLoad(self, request, context):
+        """客户端心跳：上报当前的在途请求数"""
+        pool = self._get_pool(request, context)
+        if not request.client_id:
+            return modelpool_pb2.LoadReportAck(accepted=False)
+        inflight = {
+            (c.base_url, c.model): c.count
+            for c in request.inflight if c.count > 0
+        }
+        pool.usage.report_inflight(request.client_id, inflight)
+        for c in request.tokens:
+            m = pool.model_index.get((c.base_url, c.model))
+            if m is not None:
+                m.throughput.add(c.prompt_tokens + c.completion_tokens)
+        # 带上列表版本，客户端发现有变化（例如摘流量）马上刷新，不用等下一次轮询
+        return modelpool_pb2.LoadReportAck(accepted=True, version=pool.models_version)
+
+    def GetModelHistory(self, request, context):
+        """返回端点降采样后的探测历史和耗时趋势"""
+        pool = self._get_pool(request, context)
+        max_points = request.max_points or 60
+        response = modelpool_pb2.ModelHistoryResponse()
+        for m in pool.models:
+            if request.names and m.name not in request.names:
+                continue
+            slope, rising = m.history.latency_trend()
+            history = response.histories.add(
+                name=m.name, base_url=m.base_url, model=m.model,
+                latency_slope_ms_per_min=slope, latency_rising=rising
+            )
+            for ts, availability, latency, max_latency, load, samples, flips in m.history.downsample(max_points, request.since):
+                history.timestamps.append(ts)
+                history.availability.append(availability)
+                history.latency_ms.append(latency)
+                history.max_latency_ms.append(max_latency)
+                history.load.append(load)
+                history.samples.append(samples)
+                history.flips.append(flips)
+        return response
 
-def serve(port="50052"):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    modelpool_pb2_grpc.add_ModelPoolServiceServicer_to_server(ModelPoolServiceServicer(), server)
+    #---------------------------------------------------------
+    # 客户端上报的调用失败：立即重新探测，不用等下一个探测周期；重新探测也失败说明端点真的挂了，
+    # 直接标记为不可用（不等 fall 次），列表版本变化之后客户端下一次心跳就会刷新。
+    # 重新探测交给池的探测线程池异步执行，马上应答：gRPC 只有 10 个处理线程，
+    # 一批针对挂掉端点的上报不能把它们都卡在 probe_timeout 上
+    #---------------------------------------------------------
+    REPROBE_MIN_INTERVAL = 1.0
+
+    def ReportEndpointFailure(self, request, context):
+        pool = self._get_pool(request, context)
+        m = pool.model_index.get((request.base_url, request.model))
+        if m is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Unknown endpoint: {request.base_url} {request.model}")
+        logger.warning(f"Client {request.client_id} reported a failure on [{m.name}] {m.base_url}: {request.error}")
+        reprobed = False
+        # 多 worker 模式下只有做健康检查的 worker 能改状态；同一个端点还没探测完或者 1 秒内探测过的不再排
+        if self.probing:
+            with m.reprobe_lock:
+                if not m.reprobe_pending and time.time() - m.last_reprobe >= self.REPROBE_MIN_INTERVAL:
+                    m.reprobe_pending = True
+                    reprobed = True
+            if reprobed:
+                pool.probe_executor.submit(self._reprobe, pool, m)
+        return modelpool_pb2.EndpointFailureAck(reprobed=reprobed, model=self._to_proto(pool, m))
+
+    def _reprobe(self, pool, m):
+        """在探测线程池里执行"""
+        try:
+            old_status = m.status
+            ok = self._check_health(pool, m)
+            with m.probe_lock:
+                if not ok and m.status == "available":
+                    m.status = "unavailable"
+                    logger.info(f"model [{m.name}] {m.base_url} marked unavailable: client reported a failure and the re-probe failed")
+                    if self.trace is not None:
+                        self.trace.record("status", u=m.base_url, m=m.model, s=m.status)
+                changed = m.status != old_status
+            if changed:
+                pool.bump_version()
+                if self.shared is not None and self.ready.is_set():
+                    self._publish_models()
+        except Exception as e:
+            logger.error(f"Re-probe of [{m.name}] {m.base_url} failed: {e}")
+        finally:
+            with m.reprobe_lock:
+                m.reprobe_pending = False
+                m.last_reprobe = time.time()
+
+    #---------------------------------------------------------
+    # 管理接口：摘流量和调整流量权重。摘流量的端点留在列表里并且标记 draining，已经在用它的 agent
+    # 可以继续用，新的选择和槽位分配不再选它，在途请求数降到 0 之后就可以维护；状态变化马上更新列表版本，
+    # 客户端下一次心跳发现版本变了就刷新。通过接口设置的状态只在内存里，重启之后以 modelserver.json 为准。
+    #---------------------------------------------------------
+    def SetEndpointState(self, request, context):
+        admin_token = self.config.get("admin_token", "")
+        if admin_token and not hmac.compare_digest(request.admin_token, admin_token):
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Invalid admin token")
+        pool = self._get_pool(request, context)
+        if not request.names and not request.base_url:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "names or base_url is required")
+        if request.HasField("weight") and not 1 <= request.weight <= 100:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, f"weight must be in 1-100, got {request.weight}")
+        targets = [m for m in pool.models if m.name in request.names or m.base_url == request.base_url]
+        if not targets:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"No endpoint matches names={list(request.names)} base_url={request.base_url}")
+        changes = {
+            m: (request.draining if request.HasField("draining") else m.draining,
+                request.weight if request.HasField("weight") else m.traffic_weight)
+            for m in targets
+        }
+        self._apply_admin_state(pool, changes)
+        if self.shared is not None:
+            # 其他 worker 在下一次同步的时候应用
+            self.shared.update_admin({m.shared_index: state for m, state in changes.items()})
+        return modelpool_pb2.EndpointStateResponse(models=[self._to_proto(pool, m) for m in targets],
+                                                   version=pool.models_version)
+
+    def _apply_admin_state(self, pool, changes):
+        """changes: {Model: (draining, traffic_weight)}，有变化就更新列表版本"""
+        changed = False
+        for m, (draining, weight) in changes.items():
+            if (m.draining, m.traffic_weight) == (draining, weight):
+                continue
+            logger.info(f"model [{m.name}] {m.base_url} draining: {m.draining} -> {draining}, traffic weight: {m.traffic_weight} -> {weight}")
+            m.draining, m.traffic_weight = draining, weight
+            changed = True
+        if changed:
+            pool.bump_version()
+            if self.probing and self.shared is not None and self.ready.is_set():
+                self._publish_models()
+
+    #---------------------------------------------------------
+    # 并发槽位（准入控制）：每个端点最多分配 max_concurrency 个槽位，
+    # 客户端调用模型前申请，结束后释放；租期到了没有释放的由健康检查线程回收
+    #---------------------------------------------------------
+    DEFAULT_LEASE_SECONDS = 300
+    MAX_LEASE_SECONDS = 3600
+    SLOT_RETRY_AFTER_MS = 200
+
+    def _expire_slots(self, pool):
+        """回收租期已到的槽位"""
+        now = time.time()
+        with pool.slot_lock:
+            for m in pool.models:
+                expired = [slot_id for slot_id, (_, expire_at) in m.slots.items() if expire_at <= now]
+                for slot_id in expired:
+                    client_id, _ = m.drop_slot(slot_id)
+                    logger.warning(f"Slot {slot_id} of client {client_id} on {m.base_url} lease expired, reclaimed")
+
+    def AcquireSlot(self, request, context):
+        """申请并发槽位，指定的端点满了就分配同一模型的其他端点"""
+        pool = self._get_pool(request, context)
+        # 摘流量中的端点只分配给明确指定它的请求（已经在用它的 agent）
+        candidates = [
+            m for m in pool.models
+            if m.status == "available"
+            and (not m.draining or m.base_url == request.base_url)
+            and (not request.model_type or m.model_type == request.model_type)
+            and (not request.model or m.model == request.model)
+        ]
+        if not candidates:
+            # 没有可用的端点，等下一次健康检查之后再试
+            return modelpool_pb2.AcquireSlotResponse(granted=False, retry_after_ms=pool.health_check_interval * 1000)
+        # 批量请求只能用没有预留给交互式请求的端点和槽位
+        batch = request.priority == modelpool_pb2.PRIORITY_BATCH
+        if batch:
+            candidates = [m for m in candidates if pool.admits_batch(m)]
+
+        lease_seconds = request.lease_seconds or self.DEFAULT_LEASE_SECONDS
+        lease_seconds = min(lease_seconds, self.MAX_LEASE_SECONDS)
+        # 优先请求中指定的端点，满了的话优先和它同一个 zone、同一个 tier 的（不轻易溢出到远端），
+        # 其次槽位占用比例低、负载低、按权重折算的实时并发低的
+        preferred = next((m for m in candidates if m.base_url == request.base_url), None)
+        candidates.sort(key=lambda m: (
+            m.base_url != request.base_url,
+            (m.zone != preferred.zone, abs(m.tier - preferred.tier)) if preferred is not None else (False, 0),
+            m.slot_usage(), m.load, (m.inflight + 1) * 100 / m.weight(pool.slow_start_seconds)))
+        with pool.slot_lock:
+            for m in candidates:
+                slot_id = self._new_slot_id()
+                limit = pool.batch_slot_limit(m) if batch else None
+                if m.take_slot(slot_id, request.client_id, time.time() + lease_seconds, limit):
+                    if request.base_url and m.base_url != request.base_url:
+                        logger.info(f"Slot for client {request.client_id} redirected from {request.base_url} to {m.base_url}")
+                    return modelpool_pb2.AcquireSlotResponse(granted=True, slot_id=slot_id,
+                                                             model=self._to_proto(pool, m, request.priority))
+        return modelpool_pb2.AcquireSlotResponse(granted=False, retry_after_ms=self.SLOT_RETRY_AFTER_MS)
+
+    def ReleaseSlot(self, request, context):
+        """释放并发槽位，多 worker 模式下其他 worker 分配的槽位转发给它释放"""
+        pool = self._get_pool(request, context)
+        m = pool.model_index.get((request.base_url, request.model))
+        models = [m] if m is not None else pool.models
+        with pool.slot_lock:
+            for m in models:
+                if m.drop_slot(request.slot_id) is not None:
+                    return modelpool_pb2.ReleaseSlotResponse(released=True)
+        owner = self._slot_owner(request.slot_id)
+        if owner is not None and owner[0] != self.worker_id:
+            if self.shared.forward_release(*owner):
+                return modelpool_pb2.ReleaseSlotResponse(released=True)
+            logger.warning(f"Release queue of worker {owner[0]} is full, slot {request.slot_id} is reclaimed when its lease expires")
+        return modelpool_pb2.ReleaseSlotResponse(released=False)
+
+    #---------------------------------------------------------
+    # 多 worker 模式下槽位只记在分配它的 worker 进程里（共享内存里只有计数），slot_id 带上 worker 编号：
+    # "<worker_id>:<uuid>"。客户端重连之后 ReleaseSlot 可能落到其他 worker，转发给分配它的 worker 释放，
+    # 否则共享的槽位计数要等租期到了才减回来，端点一直显示是满的
+    #---------------------------------------------------------
+    def _new_slot_id(self):
+        slot_id = uuid.uuid4().hex
+        return slot_id if self.shared is None else f"{self.worker_id}:{slot_id}"
+
+    def _slot_owner(self, slot_id):
+        """多 worker 模式下解析 slot_id，返回 (分配它的 worker, uuid 的 16 字节)，格式不对返回 None"""
+        if self.shared is None:
+            return None
+        worker, _, token = slot_id.partition(":")
+        try:
+            worker, token = int(worker), bytes.fromhex(token)
+        except ValueError:
+            return None
+        if not 0 <= worker < self.shared.num_workers or len(token) != self.shared.RELEASE_TOKEN:
+            return None
+        return worker, token
+
+    def _release_forwarded(self):
+        """释放其他 worker 转发过来的槽位，已经过期回收的忽略"""
+        for token in self.shared.take_releases(self.worker_id):
+            slot_id = f"{self.worker_id}:{token.hex()}"
+            for pool in self.pools.values():
+                with pool.slot_lock:
+                    if any(m.drop_slot(slot_id) is not None for m in pool.models):
+                        break
+
+    #---------------------------------------------------------
+    # 服务端分配端点（PickEndpoint，见 modelpool_assignment.py）：每个分配按 power of two choices 选择，
+    # 马上记一个短租约计入端点的负载，同时到达的请求和同一个请求里预取的后续分配都能看到；
+    # 租期覆盖客户端开始使用到下一次心跳上报在途请求数之间的空档
+    #---------------------------------------------------------
+    DEFAULT_ASSIGNMENT_LEASE_MS = 5000
+    MAX_ASSIGNMENT_LEASE_MS = 60000
+    MAX_PICK_COUNT = 32
+
+    def PickEndpoint(self, request, context):
+        pool = self._get_pool(request, context)
+        batch = request.priority == modelpool_pb2.PRIORITY_BATCH
+        candidates = [
+            m for m in pool.models
+            if m.status == "available" and not m.draining
+            and (not request.model_type or m.model_type == request.model_type)
+            and (not request.model or m.model == request.model)
+            and (not batch or pool.admits_batch(m))
+        ]
+        if not candidates:
+            return modelpool_pb2.PickEndpointResponse(retry_after_ms=pool.health_check_interval * 1000,
+                                                      version=pool.models_version)
+        # 有空闲槽位的同 zone 端点优先，其次是有空闲槽位的，全部满了才在所有端点里选
+        free = [m for m in candidates if m.has_free_slot()]
+        nearby = [m for m in free if request.zone and m.zone == request.zone]
+        candidates = nearby or free or candidates
+        weight = pool.batch_weight if batch else lambda m: m.weight(pool.slow_start_seconds)
+        weights = [weight(m) for m in candidates]
+        inflight = [m.inflight for m in candidates]
+        slots = [m.active_slots for m in candidates]
+
+        def cost(i):
+            m = candidates[i]
+            pending = inflight[i] + m.assigned
+            return (m.load, m.max_concurrency > 0 and slots[i] + m.assigned >= m.max_concurrency,
+                    (pending + 1) * 100 / weights[i])
+
+        lease_ms = min(request.lease_ms or self.DEFAULT_ASSIGNMENT_LEASE_MS, self.MAX_ASSIGNMENT_LEASE_MS)
+        count = min(max(request.count, 1), self.MAX_PICK_COUNT)
+        picked = []
+        with pool.assignments.lock:
+            now = time.time()
+            pool.assignments.expire(now)
+            for _ in range(count):
+                m = candidates[pick_two(weights, cost)]
+                pool.assignments.add(m.assignment_index, now + lease_ms / 1000)
+                picked.append(m)
+        protos = {}
+        for m in picked:
+            if m.assignment_index not in protos:
+                protos[m.assignment_index] = self._to_proto(pool, m, request.priority)
+        return modelpool_pb2.PickEndpointResponse(models=[protos[m.assignment_index] for m in picked],
+                                                  lease_ms=lease_ms, version=pool.models_version)
+
+#---------------------------------------------------------
+# 优雅停止和零停机重启：所有模式都用 SO_REUSEPORT 监听，新进程等到所有池完成第一轮探测之后
+# 才监听端口，然后通过 ready_fd（管道）通知 modelpool_supervisor.py；收到 SIGTERM 的进程
+# 先停止监听、给客户端发 GOAWAY（客户端重连到新进程），在处理的请求最多再等 shutdown_grace_seconds 秒。
+#---------------------------------------------------------
+def _create_server(port, servicer):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=[("grpc.so_reuseport", 1)])
+    modelpool_pb2_grpc.add_ModelPoolServiceServicer_to_server(servicer, server)
     server.add_insecure_port(f"[::]:{port}")
+    return server
+
+def _wait_for_shutdown(server, grace):
+    """阻塞到收到 SIGTERM / SIGINT，然后优雅停止 gRPC 服务"""
+    stop_requested = Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stop_requested.set())
+    while not stop_requested.wait(1):
+        pass
+    logger.info(f"Shutting down modelpool server (pid {os.getpid()}), grace {grace}s")
+    server.stop(grace).wait()
+    logger.info(f"Modelpool server (pid {os.getpid()}) stopped")
+
+def _notify_ready(ready_fd):
+    """通知 supervisor：已经在监听端口，可以停掉旧进程了"""
+    if ready_fd is not None:
+        os.write(ready_fd, b"1")
+        os.close(ready_fd)
+
+#---------------------------------------------------------
+# 多 worker 模式：modelserver.json 中配置 "workers" 大于 1 的时候，fork 出多个 worker 进程，
+# 用 SO_REUSEPORT 监听同一个端口，由内核把连接分给各个 worker，请求处理可以用上多个 CPU。
+# 注意 gRPC 要求在创建任何 gRPC 对象之前 fork，所以父进程只读配置、创建共享内存。
+#---------------------------------------------------------
+def _serve_worker(port, config_file, shared, worker_id, ready, grace):
+    servicer = ModelPoolServiceServicer(config_file, shared=shared, worker_id=worker_id)
+    servicer.ready.wait()
+    server = _create_server(port, servicer)
     server.start()
-    logger.info(f"<<<<<<<<<<<<<<ModelPoolServiceServicer load from localhost:{port} success!!!>>>>>>>>>>>>>>>")
-    server.wait_for_termination()
+    ready.set()
+    logger.info(f"<<<<<<<<<<<<<<ModelPoolServiceServicer worker {worker_id} (pid {os.getpid()}) load from localhost:{port} success!!!>>>>>>>>>>>>>>>")
+    _wait_for_shutdown(server, grace)
+
+def serve(port="50052", config_file="modelserver.json", ready_fd=None):
+    config = ModelPoolServiceServicer._load_config(config_file)
+    workers = config.get("workers", 1)
+    grace = config.get("shutdown_grace_seconds", 10)
+    if ready_fd is not None and not any(pool.models for pool in config["pools"].values()):
+        # 配置文件有错的时候不要替换掉正在服务的旧进程
+        logger.error(f"No models loaded from {config_file}, refusing to start under supervisor")
+        sys.exit(1)
+    if workers <= 1:
+        servicer = ModelPoolServiceServicer(config_file)
+        servicer.ready.wait()
+        server = _create_server(port, servicer)
+        server.start()
+        logger.info(f"<<<<<<<<<<<<<<ModelPoolServiceServicer load from localhost:{port} success!!!>>>>>>>>>>>>>>>")
+        _notify_ready(ready_fd)
+        _wait_for_shutdown(server, grace)
+        return
+
+    num_models = sum(len(pool.models) for pool in config["pools"].values())
+    shared = SharedModelTable(num_models, workers, config["history_size"], num_pools=len(config["pools"]))
+    # 管理员设置的初始值是配置文件里的 draining / weight
+    models = [m for pool in config["pools"].values() for m in pool.models]
+    shared.update_admin({i: (m.draining, m.traffic_weight) for i, m in enumerate(models)})
+    context = multiprocessing.get_context("fork")
+    ready_events = [context.Event() for _ in range(workers)]
+    processes = [
+        context.Process(target=_serve_worker, args=(port, config_file, shared, worker_id, ready_events[worker_id], grace), daemon=True)
+        for worker_id in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {workers} modelpool workers on port {port}: {[p.pid for p in processes]}")
+    # 父进程收到 SIGTERM 的时候把 SIGTERM 转给所有 worker，worker 各自优雅停止（fork 之后再设置）
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        sentinels = [p.sentinel for p in processes]
+        # 所有 worker 都在监听之后才通知 supervisor，等待期间有 worker 退出就不通知
+        while not all(event.is_set() for event in ready_events):
+            if wait(sentinels, timeout=0.2):
+                break
+        else:
+            _notify_ready(ready_fd)
+        # 任何一个 worker 退出都停掉整个服务，由 supervisor 或者外面的监控脚本重新拉起
+        wait(sentinels)
+        logger.error(f"modelpool worker exited, exit codes: {[p.exitcode for p in processes]}")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
 
 if __name__ == "__main__":
-    serve()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="modelpool server")
+    parser.add_argument("--port", help="监听端口")
+    parser.add_argument("--config", default="modelserver.json", help="配置文件")
+    parser.add_argument("--ready-fd", type=int, help="就绪之后写入 1 的文件描述符（modelpool_supervisor.py 使用）")
+    args = parser.parse_args()
+    kwargs = {"config_file": args.config, "ready_fd": args.ready_fd}
+    if args.port:
+        kwargs["port"] = args.port
+    serve(**kwargs)
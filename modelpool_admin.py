@@ -0,0 +1,90 @@
+import sys
+import time
+import argparse
+import grpc
+from loguru import logger
+
+import modelpool_pb2
+import modelpool_pb2_grpc
+
+#--------------------------------------------------------------------------
+# modelpool server 的管理命令：摘流量、恢复、调整流量权重
+# 说明：GPU 机器轮流维护的时候，先摘掉这台机器的流量，等它上面的在途请求数和槽位降到 0
+# （已经在用它的 agent 跑完手上的请求），再停 vLLM；维护完恢复：
+#     python modelpool_admin.py --server localhost:50051,localhost:50052 drain --base-url http://172.21.30.231:8987/v1 --wait 600
+#     python modelpool_admin.py --server localhost:50051,localhost:50052 undrain --base-url http://172.21.30.231:8987/v1
+# 主备部署的多个 modelpool server 各自维护状态，--server 要列出所有的地址（逗号分隔）。
+# 灰度新版本：新端点的流量权重设小（1-100），观察没有问题再调回 100：
+#     python modelpool_admin.py weight 10 --names gdfy_modelserver_canary
+#--------------------------------------------------------------------------
+def set_state(stubs, args, draining=None, weight=None):
+    request = modelpool_pb2.EndpointStateRequest(pool=args.pool, names=args.names, base_url=args.base_url,
+                                                 admin_token=args.admin_token)
+    if draining is not None:
+        request.draining = draining
+    if weight is not None:
+        request.weight = weight
+    for server, stub in stubs.items():
+        response = stub.SetEndpointState(request, timeout=5)
+        for m in response.models:
+            logger.info(f"{server} [{m.name}] {m.base_url} draining: {m.draining}, traffic weight: {m.traffic_weight}, inflight: {m.inflight}, slots: {m.active_slots}")
+
+
+def wait_drained(stubs, args, timeout: float) -> bool:
+    """等到选中的端点在所有 server 上的在途请求数和槽位都是 0，超时返回 False"""
+    deadline = time.time() + timeout
+    while True:
+        busy = [
+            m for stub in stubs.values()
+            for m in stub.GetModelList(modelpool_pb2.AvailableModelsRequest(pool=args.pool), timeout=5).models
+            if (m.name in args.names or m.base_url == args.base_url) and (m.inflight or m.active_slots)
+        ]
+        if not busy:
+            logger.info("All selected endpoints are drained")
+            return True
+        if time.time() >= deadline:
+            logger.error(f"Still busy after {timeout}s: {[(m.name, m.inflight, m.active_slots) for m in busy]}")
+            return False
+        logger.info(f"Waiting for {[(m.name, m.inflight, m.active_slots) for m in busy]} (name, inflight, slots)")
+        time.sleep(2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="modelpool endpoint administration")
+    parser.add_argument("--server", default="localhost:50051", help="modelpool server 地址，多个用逗号分隔")
+    parser.add_argument("--pool", default="", help="模型池名称，为空表示 default 池")
+    parser.add_argument("--admin-token", default="", help="modelserver.json 中配置的 admin_token")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    drain = subparsers.add_parser("drain", help="摘流量：新的选择不再选这些端点")
+    drain.add_argument("--wait", type=float, default=0, help="等待在途请求数和槽位降到 0 的最长时间（秒）")
+    subparsers.add_parser("undrain", help="恢复流量")
+    weight = subparsers.add_parser("weight", help="设置流量权重")
+    weight.add_argument("value", type=int, help="1-100")
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--names", nargs="+", default=[], help="按模型名称选择")
+        subparser.add_argument("--base-url", default="", help="按地址选择（这个地址上的所有模型）")
+    args = parser.parse_args()
+    if not args.names and not args.base_url:
+        parser.error("--names 或 --base-url 至少指定一个")
+
+    channels = {server: grpc.insecure_channel(server) for server in args.server.split(",")}
+    stubs = {server: modelpool_pb2_grpc.ModelPoolServiceStub(channel) for server, channel in channels.items()}
+    try:
+        if args.command == "drain":
+            set_state(stubs, args, draining=True)
+            if args.wait > 0 and not wait_drained(stubs, args, args.wait):
+                sys.exit(1)
+        elif args.command == "undrain":
+            set_state(stubs, args, draining=False)
+        else:
+            set_state(stubs, args, weight=args.value)
+    except grpc.RpcError as e:
+        logger.error(f"{args.command} failed: {e.code().name} {e.details()}")
+        sys.exit(1)
+    finally:
+        for channel in channels.values():
+            channel.close()
+
+
+if __name__ == "__main__":
+    main()
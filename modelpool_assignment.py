@@ -0,0 +1,47 @@
+import heapq
+import random
+import time
+from threading import Lock
+
+#--------------------------------------------------------------------------
+# 服务端分配端点（PickEndpoint）
+# 说明：所有 agent 拿到的是同一份按负载排好序的列表，同一时刻都选最空闲的那个，就会一起压到
+# 同一个端点上，直到下一次轮询才散开。PickEndpoint 由服务端用全局的数据分配：
+#   1：power of two choices：按流量权重随机抽两个候选端点，选 (在途请求数 + 未到期的分配数)
+#      按权重折算之后小的那个。不直接选最小的：多 worker 之间的计数最多延迟 0.2 秒，
+#      直接选最小的各个 worker 还是会同时选中同一个端点，随机抽两个在旧数据下也是均匀的；
+#   2：短租约：刚分配出去的端点要等 agent 的下一次心跳，在途请求数才会增加，这段时间用租约补上，
+#      每次分配给端点记一个租期到了自动去掉的计数，后面的选择（包括同一个请求里预取的）马上能看到。
+#--------------------------------------------------------------------------
+class AssignmentLeases:
+    """一个模型池里每个端点未到期的分配数，下标是端点在池内的位置"""
+
+    def __init__(self, num_models: int):
+        self.counts = [0] * num_models
+        self.expiry = []   # 小根堆 [(到期时间, 下标)]
+        self.lock = Lock() # 选择和记录分配要在同一把锁里，同时到达的请求才能看到彼此的分配
+
+    def expire(self, now: float = None) -> None:
+        """去掉租期已到的分配"""
+        now = now or time.time()
+        while self.expiry and self.expiry[0][0] <= now:
+            _, index = heapq.heappop(self.expiry)
+            self.counts[index] -= 1
+
+    def add(self, index: int, expire_at: float) -> None:
+        self.counts[index] += 1
+        heapq.heappush(self.expiry, (expire_at, index))
+
+    def count(self, index: int) -> int:
+        return self.counts[index]
+
+
+def pick_two(weights, cost, rng=random) -> int:
+    """power of two choices：按 weights 随机抽两个不同的下标，返回 cost(下标) 小的那个"""
+    if len(weights) == 1:
+        return 0
+    first, second = rng.choices(range(len(weights)), weights, k=2)
+    if first == second:
+        second = rng.randrange(len(weights) - 1)
+        second += second >= first
+    return first if cost(first) <= cost(second) else second
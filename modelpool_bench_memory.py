@@ -0,0 +1,94 @@
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from loguru import logger
+
+import modelpool_pb2
+from modelpool_usage import UsageRegistry
+
+#--------------------------------------------------------------------------
+# 客户端使用信息登记表的内存测试
+# 说明：模拟大量短生命周期的 agent 注册（全量上报，每个 agent 用 1-3 个模型，一部分带心跳的
+# 在途请求数），用 tracemalloc 统计登记表占用的内存，算出每个客户端多少字节。
+# legacy 是原来的结构：client_usage（defaultdict(set)，键是 client_id 字符串，值是
+# (base_url, model) 元组）、client_last_active、client_usage_seq、client_inflight，
+# compact 是现在的 UsageRegistry（整数句柄 + 位图 + 平铺数组）。
+#     python modelpool_bench_memory.py --clients 100000 1000000
+#--------------------------------------------------------------------------
+class LegacyRegistry:
+    """原来的登记表结构，只保留全量上报和心跳用到的部分"""
+
+    def __init__(self, model_keys):
+        self.model_index = {model_key: index for index, model_key in enumerate(model_keys)}
+        self.usage_counts = [0] * len(model_keys)
+        self.client_usage = defaultdict(set)
+        self.client_last_active = {}
+        self.client_usage_seq = {}
+        self.client_inflight = {}
+
+    def apply_report(self, request):
+        client_id = request.client_id
+        self.client_last_active[client_id] = time.time()
+        self.client_usage_seq[client_id] = request.usage_seq
+        for u in request.model_usages:
+            model_key = (u.base_url, u.model)
+            if model_key not in self.client_usage[client_id]:
+                self.client_usage[client_id].add(model_key)
+                self.usage_counts[self.model_index[model_key]] += 1
+        return False
+
+    def report_inflight(self, client_id, inflight):
+        self.client_last_active[client_id] = time.time()
+        self.client_inflight[client_id] = inflight
+
+
+def measure(layout, num_clients, num_models, heartbeat_ratio, seed=0):
+    """注册 num_clients 个客户端，返回 (每个客户端的字节数, 耗时)"""
+    rng = random.Random(seed)
+    model_keys = [(f"http://10.0.0.{i}:8000/v1", f"/models/M{i}") for i in range(num_models)]
+    usages = [modelpool_pb2.ModelUsage(base_url=base_url, model=model) for base_url, model in model_keys]
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    registry = LegacyRegistry(model_keys) if layout == "legacy" else UsageRegistry(model_keys)
+    for _ in range(num_clients):
+        request = modelpool_pb2.AvailableModelsRequest(client_id=str(uuid.UUID(int=rng.getrandbits(128))),
+                                                       usage_seq=1, full_sync=True)
+        request.model_usages.extend(rng.sample(usages, rng.randint(1, 3)))
+        registry.apply_report(request)
+        if rng.random() < heartbeat_ratio:
+            # 心跳上报的键也是从 protobuf 里读出来的新字符串
+            usage = request.model_usages[0]
+            registry.report_inflight(request.client_id, {(usage.base_url, usage.model): 1})
+    elapsed = time.perf_counter() - start
+    del request, usage
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del registry
+    return size / num_clients, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UsageRegistry memory benchmark (bytes per registered client)")
+    parser.add_argument("--clients", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--layouts", nargs="+", default=["legacy", "compact"], choices=["legacy", "compact"])
+    parser.add_argument("--models", type=int, default=50)
+    parser.add_argument("--heartbeat-ratio", type=float, default=0.2, help="有在途请求（发过心跳）的客户端比例")
+    args = parser.parse_args()
+
+    logger.remove()  # 不测日志输出的开销
+    print(f"{'clients':>10} {'layout':>8} {'bytes/client':>13} {'total MB':>9} {'seconds':>8}")
+    for num_clients in args.clients:
+        for layout in args.layouts:
+            per_client, elapsed = measure(layout, num_clients, args.models, args.heartbeat_ratio)
+            print(f"{num_clients:>10} {layout:>8} {per_client:>13.1f} {per_client * num_clients / 2**20:>9.1f} {elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import random
+import threading
+import time
+import uuid
+from loguru import logger
+
+import modelpool_pb2
+from modelpool_usage import UsageRegistry
+
+#--------------------------------------------------------------------------
+# 客户端使用信息登记表的锁竞争测试
+# 说明：多个线程模拟 GetAvailableModels 的增量上报和 ReportLoad 心跳，同时有一个线程
+# 不停地读所有模型的 usage_count / inflight（相当于构造响应），一个线程模拟健康检查
+# 线程的超时清理和日志打印。分别用 1 个分片（相当于原来的一把 usage_lock）和多个
+# 分片运行，对比吞吐量和单次操作的 p99 耗时。有 GIL 的时候多个分片在 8 个以上线程反而更慢，
+# 所以默认是 1 个分片，见 modelpool_usage.py 的说明。
+#     python modelpool_bench_usage.py --threads 1 2 4 8 16 --shards 1 16
+#--------------------------------------------------------------------------
+def _usage(model_key):
+    return modelpool_pb2.ModelUsage(base_url=model_key[0], model=model_key[1])
+
+
+def run_once(num_shards, num_threads, duration, num_models, clients_per_thread):
+    model_keys = [(f"http://10.0.0.{i}:8000/v1", f"/models/M{i}") for i in range(num_models)]
+    registry = UsageRegistry(model_keys, num_shards=num_shards)
+    stop = threading.Event()
+    start_barrier = threading.Barrier(num_threads + 1)
+    deadline = [0.0]
+    op_counts = [0] * num_threads
+    latencies = [[] for _ in range(num_threads)]
+
+    def writer(worker):
+        rng = random.Random(worker)
+        clients = [str(uuid.uuid4()) for _ in range(clients_per_thread)]
+        seqs = dict.fromkeys(clients, 0)
+        usages = {client_id: set() for client_id in clients}
+        start_barrier.wait()
+        # 按截止时间统计，不依赖主线程什么时候拿到 GIL 去设置 stop
+        while time.perf_counter() < deadline[0]:
+            client_id = rng.choice(clients)
+            model_key = rng.choice(model_keys)
+            seqs[client_id] += 1
+            request = modelpool_pb2.AvailableModelsRequest(client_id=client_id, usage_seq=seqs[client_id])
+            if seqs[client_id] == 1:
+                request.full_sync = True
+            elif model_key in usages[client_id]:
+                usages[client_id].discard(model_key)
+                request.removed_usages.append(_usage(model_key))
+            else:
+                usages[client_id].add(model_key)
+                request.added_usages.append(_usage(model_key))
+            start = time.perf_counter()
+            registry.apply_report(request)
+            registry.report_inflight(client_id, {model_key: rng.randint(0, 4)})
+            latencies[worker].append(time.perf_counter() - start)
+            op_counts[worker] += 1
+
+    def reader():
+        while not stop.is_set():
+            for index in range(num_models):
+                registry.usage_count(index)
+                registry.inflight(index)
+
+    def reaper():
+        while not stop.is_set():
+            registry.cleanup(3600)
+            registry.snapshot()
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(num_threads)]
+    threads += [threading.Thread(target=reader), threading.Thread(target=reaper)]
+    for thread in threads:
+        thread.start()
+    # 先定截止时间再放行，写线程过了 barrier 才会读到它
+    deadline[0] = time.perf_counter() + duration
+    start_barrier.wait()
+    for thread in threads[:num_threads]:
+        thread.join()
+    stop.set()
+    for thread in threads[num_threads:]:
+        thread.join()
+
+    all_latencies = sorted(latency for worker_latencies in latencies for latency in worker_latencies)
+    p99 = all_latencies[int(len(all_latencies) * 0.99)] if all_latencies else 0.0
+    return sum(op_counts) / duration, p99 * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UsageRegistry lock contention benchmark")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 16], help="1 相当于原来的一把 usage_lock")
+    parser.add_argument("--duration", type=float, default=2.0)
+    parser.add_argument("--models", type=int, default=50)
+    parser.add_argument("--clients-per-thread", type=int, default=200)
+    args = parser.parse_args()
+
+    logger.remove()  # 不测日志输出的开销
+    print(f"{'threads':>8} {'shards':>7} {'ops/s':>12} {'p99 us':>10}")
+    for num_threads in args.threads:
+        for num_shards in args.shards:
+            ops, p99 = run_once(num_shards, num_threads, args.duration, args.models, args.clients_per_thread)
+            print(f"{num_threads:>8} {num_shards:>7} {ops:>12.0f} {p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import time
+from collections import deque
+from threading import Lock
+
+#--------------------------------------------------------------------------
+# 端点的 token 吞吐和剩余容量估计
+# 说明：load 和 usage_count 都看不出一个 vLLM 端点还能接多少活：同样 8 个在途请求，
+# 32k 的长 prompt 和短对话的压力差了几十倍。客户端在心跳里上报每个端点上完成的请求
+# 消耗的 token 数（OpenAI 响应的 usage），服务端按秒分桶，算出最近 window 秒的 tokens/sec。
+#    容量（端点最多能跑多少 tokens/sec）从观察到的饱和点学习：每个健康检查周期记录一次
+# (吞吐, 在途请求数)，在途请求数比吞吐峰值时多了 25% 以上、吞吐却没有超过峰值，说明端点
+# 已经饱和，这时候的吞吐就是容量（多次观察取指数平均）。还没有观察到饱和的端点，容量
+# 用观察到的峰值吞吐，只是一个下限。峰值和容量都会缓慢衰减，换了更慢的卡也能跟上。
+#    剩余容量 headroom = 容量 - 当前吞吐，长上下文的任务优先放到 headroom 大的端点上。
+#--------------------------------------------------------------------------
+class ThroughputEstimator:
+    SATURATION_CONCURRENCY = 1.25  # 在途请求数比峰值时多这么多倍，吞吐却没有增长，认为已经饱和
+    PEAK_GROWTH = 1.05             # 吞吐超过峰值这么多倍才算新的峰值（记录新的峰值并发）
+    SATURATION_SMOOTHING = 0.3     # 饱和吞吐的指数平均系数
+    DECAY_HALF_LIFE = 3600         # 峰值和容量的衰减半衰期（秒）
+
+    def __init__(self, window: int = 30):
+        self.window = window
+        self.buckets = deque()     # [(秒, tokens)]，最多 window 个
+        self.lock = Lock()
+
+        self.peak_rate = 0.0       # 观察到的峰值吞吐
+        self.peak_inflight = 0     # 峰值吞吐时的在途请求数
+        self.saturated_rate = 0.0  # 饱和时的吞吐（指数平均），0 表示还没有观察到饱和
+        self.observed_at = None
+
+    def add(self, tokens: int, now: float = None) -> None:
+        """记录完成的请求消耗的 token 数"""
+        if tokens <= 0:
+            return
+        now = now or time.time()
+        second = int(now)
+        with self.lock:
+            if self.buckets and self.buckets[-1][0] == second:
+                self.buckets[-1][1] += tokens
+            else:
+                self.buckets.append([second, tokens])
+            self._expire(second)
+
+    def _expire(self, second: int) -> None:
+        while self.buckets and self.buckets[0][0] <= second - self.window:
+            self.buckets.popleft()
+
+    def rate(self, now: float = None) -> float:
+        """最近 window 秒的 tokens/sec（刚开始上报的时候偏小，不会高估峰值）"""
+        now = now or time.time()
+        with self.lock:
+            self._expire(int(now))
+            return sum(tokens for _, tokens in self.buckets) / self.window
+
+    def observe(self, rate: float, inflight: int, now: float = None) -> None:
+        """每个健康检查周期调用一次，rate 和 inflight 是整个服务（所有 worker）的汇总"""
+        now = now or time.time()
+        with self.lock:
+            if self.observed_at is not None:
+                decay = 0.5 ** ((now - self.observed_at) / self.DECAY_HALF_LIFE)
+                self.peak_rate *= decay
+                self.saturated_rate *= decay
+            self.observed_at = now
+            if rate <= 0:
+                return
+            if rate > self.peak_rate * self.PEAK_GROWTH:
+                self.peak_rate, self.peak_inflight = rate, inflight
+                # 超过了之前估计的容量，说明估计偏小
+                self.saturated_rate = rate if self.saturated_rate else 0.0
+            elif inflight >= max(self.peak_inflight * self.SATURATION_CONCURRENCY, self.peak_inflight + 1):
+                # 并发增加了，吞吐没有明显增加：到了饱和点
+                if self.saturated_rate:
+                    self.saturated_rate += self.SATURATION_SMOOTHING * (rate - self.saturated_rate)
+                else:
+                    self.saturated_rate = rate
+            self.peak_rate = max(self.peak_rate, rate)
+
+    @property
+    def measured(self) -> bool:
+        """容量是不是从饱和点学到的（否则只是峰值吞吐，是一个下限）"""
+        return self.saturated_rate > 0
+
+    @property
+    def capacity(self) -> float:
+        return self.saturated_rate or self.peak_rate
+
+    def headroom(self, rate: float) -> float:
+        return max(0.0, self.capacity - rate)
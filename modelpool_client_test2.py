@@ -2,12 +2,94 @@ import grpc
 import time
 import uuid
 import asyncio
+import json
+import os
+import tempfile
+import urllib.request
+from urllib.parse import urlsplit
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
 from grpc.aio import insecure_channel
-from typing import List
+from typing import List, Optional
 from loguru import logger
 
 import modelpool_pb2
 import modelpool_pb2_grpc
+from modelpool_trace import TraceRecorder
+
+# 客户端选择端点、申请槽位用到的字段，不需要 status 字符串和 usage_count 的客户端可以用它作为 fields
+COMPACT_FIELDS = ["name", "model_type", "model", "base_url", "load", "inflight", "max_concurrency", "active_slots", "weight",
+                  "capacity_tokens_per_sec", "headroom_tokens_per_sec", "capacity_measured", "tier", "zone", "draining"]
+# 预计 token 数（prompt + completion）达到这个值的请求算长上下文任务，按剩余吞吐选择端点
+LONG_CONTEXT_TOKENS = 8192
+# 客户端的优先级：交互式 agent 用 interactive（默认），评测、离线批量任务用 batch
+PRIORITIES = {"interactive": modelpool_pb2.PRIORITY_INTERACTIVE, "batch": modelpool_pb2.PRIORITY_BATCH}
+
+def rtt_class(rtt: Optional[float]) -> int:
+    """客户端到端点的 RTT（秒）分档：没有测过按 0，10ms 以内 0，100ms 以内 1，更慢的（包括连不上的）2"""
+    if rtt is None:
+        return 0
+    return 0 if rtt < 0.01 else 1 if rtt < 0.1 else 2
+
+def is_saturated(m) -> bool:
+    """端点是否已经饱和：槽位满了，或者观察到饱和点之后已经没有剩余吞吐"""
+    return (m.max_concurrency > 0 and m.active_slots >= m.max_concurrency) \
+        or (m.capacity_measured and m.headroom_tokens_per_sec <= 0)
+
+def pick_model(models, model_type: Optional[str] = None, model: Optional[str] = None, tokens: int = 0, distance=None):
+    """从 models 中按 model_type / model 过滤后选择最空闲的模型，没有可用的返回 None，规则见 rank_models"""
+    ranked = rank_models(models, model_type, model, tokens, distance)
+    return ranked[0] if ranked else None
+
+def rank_models(models, model_type: Optional[str] = None, model: Optional[str] = None, tokens: int = 0, distance=None):
+    """从 models 中按 model_type / model 过滤，按空闲程度排序（最空闲的在前面），没有可用的返回空列表
+    tokens 是预计的 prompt + completion token 数，长上下文任务优先剩余吞吐（headroom）大的端点
+    distance(m) 返回端点的远近（越小越近），只在最近的、还有没饱和端点的一组里面选，都饱和了才溢出到远的
+    摘流量中（draining）的端点不参与新的选择，已经在用它的 agent 直接用自己记住的 base_url"""
+    candidates = [
+        m for m in models
+        if (model_type is None or m.model_type == model_type) and (model is None or m.model == model)
+        and not m.draining
+    ]
+    if not candidates:
+        return []
+    if distance is not None:
+        nearest = min((distance(m) for m in candidates if not is_saturated(m)), default=None)
+        if nearest is not None:
+            candidates = [m for m in candidates if not is_saturated(m) and distance(m) == nearest]
+    known_capacity = max(m.capacity_tokens_per_sec for m in candidates)
+    if tokens >= LONG_CONTEXT_TOKENS and known_capacity > 0:
+        # 最近没有吞吐数据的端点（没有完成的请求，是空闲的）按同类端点的最大容量估计剩余吞吐
+        return sorted(candidates, key=lambda m: (
+            m.load, m.max_concurrency > 0 and m.active_slots >= m.max_concurrency,
+            -(m.headroom_tokens_per_sec if m.capacity_tokens_per_sec > 0 else known_capacity),
+            (m.inflight + 1) * 100 / (m.weight or 100)))
+    # 槽位已满的端点排在后面，在途请求数按权重折算（慢启动中的端点权重小），weight 为 0 表示未设置
+    return sorted(candidates, key=lambda m: (
+        m.load, m.max_concurrency > 0 and m.active_slots >= m.max_concurrency,
+        (m.inflight + 1) * 100 / (m.weight or 100)))
+
+#--------------------------------------------------------------------------
+# 通道选项：modelpool server 零停机重启（modelpool_supervisor.py）的时候旧进程会发 GOAWAY，
+# 刚好在这之前发出的请求会被旧进程以 CANCELLED / UNAVAILABLE 拒绝。幂等的 RPC 由 gRPC
+# 自动重试（重连到新进程），不用走切换地址、重建通道的流程；AcquireSlot 重试可能多分配槽位，不自动重试
+# （PickEndpoint 重试多出来的分配只是租期内多算一点负载，可以重试）
+#--------------------------------------------------------------------------
+RETRY_SERVICE_CONFIG = json.dumps({
+    "methodConfig": [{
+        "name": [{"service": "modelpool.ModelPoolService", "method": method}
+                 for method in ("GetModelList", "GetAvailableModels", "ReportLoad", "ReleaseSlot", "GetModelHistory",
+                                "PickEndpoint")],
+        "retryPolicy": {
+            "maxAttempts": 3,
+            "initialBackoff": "0.05s",
+            "maxBackoff": "0.5s",
+            "backoffMultiplier": 2,
+            "retryableStatusCodes": ["UNAVAILABLE", "CANCELLED"],
+        },
+    }]
+})
+CHANNEL_OPTIONS = [("grpc.enable_retries", 1), ("grpc.service_config", RETRY_SERVICE_CONFIG)]
 
 #--------------------------------------------------------------------------
 # 模型服务池客户端
@@ -23,8 +105,22 @@ import modelpool_pb2_grpc
 #--------------------------------------------------------------------------
 class ModelPoolClient:
     # 初始化，默认设置主备地址（是模型服务池管理器的地址，2个，以防1个挂掉了）
-    def __init__(self, addresses: list[str] = ["localhost:50051", "localhost:50052"]):
+    def __init__(self, addresses: list[str] = ["localhost:50051", "localhost:50052"], full_sync_interval: int = 30,
+                 degraded_probe_after: float = 30.0, degraded_probe_budget: int = 4, degraded_probe_timeout: float = 2.0,
+                 cache_file: Optional[str] = None, cache_max_age: float = 24 * 3600,
+                 model_types: Optional[List[str]] = None, names: Optional[List[str]] = None,
+                 fields: Optional[List[str]] = None,
+                 hedge: bool = False, hedge_percentile: float = 95.0,
+                 hedge_min_delay: float = 0.05, hedge_max_delay: float = 0.5,
+                 trace_file: Optional[str] = None, pool: str = "",
+                 zone: Optional[str] = None, prefer_nearby: bool = True, rtt_interval: float = 30.0,
+                 priority: str = "interactive"):
         self.addresses = addresses # modelpool service server的地址池，可以配置多个 server确保不会单点故障
+        self.pool = pool # 模型池名称，为空表示服务端的 default 池
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority 必须是 {list(PRIORITIES)} 之一: {priority}")
+        # 优先级：批量客户端拿到的列表不包括忙到需要给交互式请求留余量的端点，申请槽位也不能用预留的槽位
+        self.priority = priority
         self.models = [] # 存放所有的可用的模型的信息
         self.client_id = str(uuid.uuid4()) # 客户端的uuid，唯一标识，每个agent使用一个模型池客户端都有一个唯一的客户端
 
@@ -33,6 +129,93 @@ class ModelPoolClient:
         #--------------------------------------------------------------------------
         self.used_model_usages = set()  # 使用 set 存储 (base_url, model) 元组，避免重复
 
+        #--------------------------------------------------------------------------
+        # 增量上报：只上报上次之后新增/删除的模型，每 full_sync_interval 次上报做一次全量同步，
+        # 上报失败或者服务端要求（resync_required）的时候下一次也做全量同步
+        #--------------------------------------------------------------------------
+        self.added_model_usages = set()    # 上次上报之后新增的 (base_url, model)
+        self.removed_model_usages = set()  # 上次上报之后删除的 (base_url, model)
+        self.full_sync_interval = full_sync_interval
+        self.usage_seq = 0                 # 上报序号，服务端用来检查增量是否连续
+        self.need_full_sync = True         # 第一次上报是全量
+        self.reports_since_full_sync = 0
+
+        #--------------------------------------------------------------------------
+        # 在途请求数：agent 每次调用模型前 acquire，结束后 release，通过心跳上报给服务端
+        #--------------------------------------------------------------------------
+        self.inflight = defaultdict(int)  # {(base_url, model): count}
+        self.inflight_dirty = False       # 上次心跳之后是否有变化
+        self.last_heartbeat = 0.0
+        self.heartbeat_version = 0        # 上一次心跳应答中的列表版本，变了就马上刷新列表（例如端点开始摘流量）
+        # 刷新列表（轮询、心跳发现版本变了、agent 主动刷新）串行执行：并发的刷新各自取一个 usage_seq，
+        # 到达服务端的顺序可能反过来，后到的旧序号被拒绝、增量丢失；旧的响应也可能覆盖新的列表
+        self.refresh_lock = asyncio.Lock()
+
+        #--------------------------------------------------------------------------
+        # 就近选择：端点按 (客户端是否连不上, zone 是否和客户端不同, 配置的 tier, 客户端测的 RTT 档位) 分组，优先最近的一组，
+        # 这一组都饱和了或者都不可用才溢出到远的一组（例如内网的 GPU 空着的时候不走公网）
+        #--------------------------------------------------------------------------
+        self.zone = zone                  # 客户端所在的 zone，为空不比较
+        self.prefer_nearby = prefer_nearby
+        self.rtt_interval = rtt_interval  # 多久测一次到各个端点的 RTT（秒），0 表示不测
+        self.rtt = {}                     # {base_url: TCP 建连耗时的指数平均（秒），连不上是 inf}
+        self.executor = None              # chat_completion 默认使用的 CompletionExecutor，用到的时候才创建
+        # pick_endpoint 预取的服务端分配 {(model_type, model): deque[(租期到期时间, Model)]}，列表版本变了就作废
+        self.assignments = {}
+        # 完成的请求消耗的 token 数，随心跳上报之后清零，服务端用来估计端点的吞吐和剩余容量
+        self.tokens = defaultdict(lambda: [0, 0, 0])  # {(base_url, model): [prompt, completion, 请求数]}
+
+        #--------------------------------------------------------------------------
+        # 降级模式：所有 modelpool server 都不可达的时候保留最后一次正常的列表并标记为 stale，
+        # 持续 degraded_probe_after 秒以后，客户端自己轻量探测已知的 base_url，
+        # 每个轮询周期最多探测 degraded_probe_budget 个端点，直到 modelpool server 恢复
+        #--------------------------------------------------------------------------
+        self.stale = False                # 当前缓存的列表是否是过期的（modelpool server 不可达）
+        self.outage_since = None          # modelpool server 不可达的开始时间
+        self.known_models = {}            # 见过的所有端点 {(base_url, model): Model}
+        self.direct_probe_status = {}     # 降级模式下直接探测的结果 {(base_url, model): bool}
+        self.direct_probe_cursor = 0      # 轮流探测的位置
+        self.degraded_probe_after = degraded_probe_after
+        self.degraded_probe_budget = degraded_probe_budget
+        self.degraded_probe_timeout = degraded_probe_timeout
+
+        #--------------------------------------------------------------------------
+        # 服务端过滤：只要这些类型/名称的模型，只要 Model 的这些字段（例如 COMPACT_FIELDS），
+        # 不设置就和原来一样返回所有模型的所有字段
+        #--------------------------------------------------------------------------
+        self.model_types = list(model_types or [])
+        self.names = list(names or [])
+        self.fields = list(fields or [])
+
+        #--------------------------------------------------------------------------
+        # 对冲请求：主地址在最近 hedge_percentile 分位的耗时内没有应答，同样的请求再发给
+        # 下一个地址，先回来的结果生效，其余的取消。这样一个 server 卡住（而不是挂掉）
+        # 的时候，查询耗时也是有上限的。对冲模式下不再做每次调用前的 GetModelList 探测
+        #--------------------------------------------------------------------------
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.call_latencies = deque(maxlen=100)  # 最近成功调用的耗时（秒）
+
+        #--------------------------------------------------------------------------
+        # 模型列表（或者 stale 标记）有变化时的回调 callback(client)，在更新列表的事件循环里调用
+        #--------------------------------------------------------------------------
+        self.listeners = []
+
+        # 请求轨迹（track_request 的每个请求），给 modelpool_simulator.py 重放
+        self.trace = TraceRecorder(trace_file) if trace_file else None
+
+        #--------------------------------------------------------------------------
+        # 本地缓存：把最后一次正常的响应（带版本号）原子替换写到 cache_file，
+        # 新进程启动的时候先加载它，马上就可以选择端点，再由后台轮询重新校验
+        #--------------------------------------------------------------------------
+        self.models_version = 0
+        self.cache_file = cache_file
+        self.cache_max_age = cache_max_age
+        if self.cache_file:
+            self._load_cache()
+
         logger.info(f"=======>ModelPoolClient client_id:{self.client_id}")
         # 预创建所有通道和存根
         self.channels = {} # 都是以 primary 和 secondary的字符串为 key，值是 channel
@@ -40,7 +223,7 @@ class ModelPoolClient:
 
         # 初始化通道和存根, 遍历主备建立通道和stub
         for addr in self.addresses:
-            channel = insecure_channel(addr)
+            channel = insecure_channel(addr, options=CHANNEL_OPTIONS)
             stub = modelpool_pb2_grpc.ModelPoolServiceStub(channel)
             self.channels[addr] = channel
             self.stubs[addr] = stub
@@ -57,6 +240,18 @@ class ModelPoolClient:
         """设置当前可用模型信息，用于测试"""
         self.models = new_models
         logger.info(f"Set available models: {self.models}")
+        self._notify_listeners()
+
+    def add_listener(self, callback) -> None:
+        """注册模型列表变化的回调 callback(client)"""
+        self.listeners.append(callback)
+
+    def _notify_listeners(self) -> None:
+        for callback in self.listeners:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"Model list listener {callback} failed: {e}")
 
     #--------------------------------------------------------------------------
     # 用于动态添加使用的模型信息，这个函数是给使用这个 ModelPoolClient 的agent调用的
@@ -68,8 +263,220 @@ class ModelPoolClient:
         model_usage = (base_url, model)
         if model_usage not in self.used_model_usages:
             self.used_model_usages.add(model_usage)
+            self.added_model_usages.add(model_usage)
+            self.removed_model_usages.discard(model_usage)
             logger.info(f"Added model usage for client {self.client_id}: base_url={base_url}, model={model}")
 
+    # agent 不再使用某个模型服务器的时候调用，下次上报时服务端会减少对应的 usage_count
+    def remove_model_usage(self, base_url: str, model: str):
+        """删除客户端使用的模型信息"""
+        model_usage = (base_url, model)
+        if model_usage in self.used_model_usages:
+            self.used_model_usages.discard(model_usage)
+            self.removed_model_usages.add(model_usage)
+            self.added_model_usages.discard(model_usage)
+            logger.info(f"Removed model usage for client {self.client_id}: base_url={base_url}, model={model}")
+
+    #--------------------------------------------------------------------------
+    # 在途请求计数，包在每次 chat completion 调用外面：
+    #     with client.track_request(base_url, model):
+    #         response = await openai_client.chat.completions.create(...)
+    #--------------------------------------------------------------------------
+    def acquire_request(self, base_url: str, model: str) -> None:
+        """开始一个请求，在途请求数加1"""
+        self.inflight[(base_url, model)] += 1
+        self.inflight_dirty = True
+
+    def release_request(self, base_url: str, model: str) -> None:
+        """结束一个请求，在途请求数减1"""
+        key = (base_url, model)
+        count = self.inflight.get(key, 0) - 1
+        if count > 0:
+            self.inflight[key] = count
+        else:
+            self.inflight.pop(key, None)
+        self.inflight_dirty = True
+
+    @contextmanager
+    def track_request(self, base_url: str, model: str):
+        """acquire/release 的上下文管理器，异常退出也会 release"""
+        self.acquire_request(base_url, model)
+        start = time.time()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.release_request(base_url, model)
+            self.record_request(base_url, model, start, time.time() - start, ok)
+
+    def record_tokens(self, base_url: str, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """记录一个完成的请求消耗的 token 数，一般就是 OpenAI 响应的 usage：
+            client.record_tokens(m.base_url, m.model, response.usage.prompt_tokens, response.usage.completion_tokens)"""
+        counts = self.tokens[(base_url, model)]
+        counts[0] += prompt_tokens
+        counts[1] += completion_tokens
+        counts[2] += 1
+        self.inflight_dirty = True
+
+    def record_request(self, base_url: str, model: str, start: float, duration: float, ok: bool) -> None:
+        """记录一个请求到轨迹文件（没有配置 trace_file 的时候什么都不做）"""
+        if self.trace is not None:
+            self.trace.record("req", timestamp=start, c=self.client_id, u=base_url, m=model,
+                              d=round(duration, 4), ok=int(ok))
+
+    #--------------------------------------------------------------------------
+    # 从缓存的可用模型中选择一个：负载低的优先，其次是实时并发（在途请求数）低的
+    #--------------------------------------------------------------------------
+    def select_model(self, model_type: Optional[str] = None, model: Optional[str] = None, tokens: int = 0,
+                     exclude=()):
+        """根据 model_type / model 过滤后选择最空闲的模型，没有可用的返回 None；tokens 见 pick_model，
+        exclude 是不要选的 (base_url, model)，例如已经失败过的端点"""
+        models = [m for m in self.models if (m.base_url, m.model) not in exclude] if exclude else self.models
+        return pick_model(models, model_type, model, tokens, self.distance if self.prefer_nearby else None)
+
+    async def chat_completion(self, messages, model_type: Optional[str] = None, model: Optional[str] = None, **kwargs):
+        """在模型池上执行 chat completion，失败自动换端点重试，见 modelpool_executor.CompletionExecutor：
+            response = await client.chat_completion(messages, model_type="deepseek", max_tokens=2048)"""
+        if self.executor is None:
+            from modelpool_executor import CompletionExecutor
+            self.executor = CompletionExecutor(self)
+        return await self.executor.chat_completion(messages, model_type, model, **kwargs)
+
+    def distance(self, m) -> tuple:
+        """端点离这个客户端的远近，越小越近：(客户端连不上, zone 不同, 配置的 tier, RTT 档位)"""
+        rtt = self.rtt.get(m.base_url)
+        return (rtt == float("inf"), bool(self.zone and m.zone and m.zone != self.zone), m.tier, rtt_class(rtt))
+
+    async def _measure_rtt(self, base_url: str, timeout: float = 2.0) -> None:
+        """用 TCP 建连的耗时作为 RTT"""
+        parts = urlsplit(base_url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            self.rtt[base_url] = float("inf")
+            return
+        rtt = time.perf_counter() - start
+        writer.close()
+        previous = self.rtt.get(base_url)
+        self.rtt[base_url] = rtt if previous is None or previous == float("inf") else previous + 0.3 * (rtt - previous)
+
+    async def measure_rtt(self, interval: float = 30.0):
+        """定时测量到所有可用端点的 RTT"""
+        while True:
+            base_urls = {m.base_url for m in self.models}
+            if base_urls:
+                await asyncio.gather(*(self._measure_rtt(base_url) for base_url in base_urls))
+            await asyncio.sleep(interval if base_urls else 1)
+
+    #--------------------------------------------------------------------------
+    # 服务端分配端点：服务端按全局的在途请求数和刚分配出去的数量选择（power of two choices），
+    # 成千上万个 agent 同时选择也不会一起挤到列表里最空闲的那个端点上。prefetch 大于 1 的时候
+    # 一次要多个分配缓存起来，后面的调用直接用（租期到了的丢掉）；modelpool server 不可达的时候退回本地选择
+    #--------------------------------------------------------------------------
+    async def pick_endpoint(self, model_type: Optional[str] = None, model: Optional[str] = None, prefetch: int = 1):
+        """返回服务端分配的 Model，没有可用的端点返回 None；拿到之后在租期（默认 5 秒）内开始使用：
+            m = await client.pick_endpoint(model_type="deepseek", prefetch=4)
+            with client.track_request(m.base_url, m.model):
+                response = await openai_client.chat.completions.create(model=m.model, ...)"""
+        key = (model_type, model)
+        cached = self.assignments.get(key)
+        now = time.time()
+        while cached:
+            expire_at, m = cached.popleft()
+            if expire_at > now:
+                return m
+        stub = self.stubs.get(self.current_address) or await self._get_available_stub()
+        if stub is None:
+            return self.select_model(model_type, model)
+        request = modelpool_pb2.PickEndpointRequest(
+            client_id=self.client_id, pool=self.pool, model_type=model_type or "", model=model or "",
+            count=prefetch, priority=PRIORITIES[self.priority], zone=self.zone or ""
+        )
+        try:
+            response = await stub.PickEndpoint(request, timeout=5)
+        except grpc.RpcError as e:
+            logger.warning(f"Endpoint assignment unavailable, falling back to local selection: {e}")
+            return self.select_model(model_type, model)
+        if not response.models:
+            return None
+        if len(response.models) > 1:
+            # 留一点余量，不用快到期的分配
+            expire_at = time.time() + response.lease_ms / 1000 * 0.8
+            self.assignments[key] = deque((expire_at, m) for m in response.models[1:])
+        return response.models[0]
+
+    #--------------------------------------------------------------------------
+    # 并发槽位（准入控制）：端点满了服务端会分配同一模型的其他端点，
+    # 全部满了就按服务端建议的时间排队重试，直到 wait_timeout
+    #--------------------------------------------------------------------------
+    async def acquire_slot(self, model_type: Optional[str] = None, model: Optional[str] = None,
+                           base_url: Optional[str] = None, wait_timeout: float = 30.0, lease_seconds: int = 0):
+        """申请槽位，返回 (Model, slot_id)；等待超时抛出 TimeoutError"""
+        if base_url is None and self.prefer_nearby:
+            # 没有指定端点的时候先就近选一个，服务端优先分配它，满了再分配同 zone、同 tier 的
+            preferred = self.select_model(model_type, model)
+            base_url = preferred.base_url if preferred is not None else None
+        request = modelpool_pb2.AcquireSlotRequest(
+            client_id=self.client_id, model_type=model_type or "", model=model or "",
+            base_url=base_url or "", lease_seconds=lease_seconds, pool=self.pool,
+            priority=PRIORITIES[self.priority]
+        )
+        deadline = time.time() + wait_timeout
+        while True:
+            stub = self.stubs.get(self.current_address)
+            if stub is None:
+                stub = await self._get_available_stub()
+                if stub is None:
+                    raise grpc.RpcError("No available model pool server")
+            response = await stub.AcquireSlot(request, timeout=5)
+            if response.granted:
+                return response.model, response.slot_id
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError(f"No free slot for model_type={model_type}, model={model} within {wait_timeout}s")
+            await asyncio.sleep(min(response.retry_after_ms / 1000, remaining))
+
+    async def release_slot(self, model, slot_id: str) -> None:
+        """释放槽位，失败的话由服务端在租期到了之后回收"""
+        stub = self.stubs.get(self.current_address)
+        if stub is None:
+            return
+        try:
+            await stub.ReleaseSlot(
+                modelpool_pb2.ReleaseSlotRequest(
+                    client_id=self.client_id, slot_id=slot_id, base_url=model.base_url, model=model.model,
+                    pool=self.pool
+                ),
+                timeout=2
+            )
+        except Exception as e:
+            logger.warning(f"Failed to release slot {slot_id} on {model.base_url}: {e}")
+
+    @asynccontextmanager
+    async def slot(self, model_type: Optional[str] = None, model: Optional[str] = None,
+                   base_url: Optional[str] = None, wait_timeout: float = 30.0, lease_seconds: int = 0):
+        """申请槽位并统计在途请求，yield 分配到的 Model：
+            async with client.slot(model_type="deepseek") as m:
+                response = await openai_client.chat.completions.create(model=m.model, ...)
+        modelpool server 不可达的时候不做准入控制，直接从缓存中选择（保证可用性优先）"""
+        slot_id = None
+        try:
+            selected, slot_id = await self.acquire_slot(model_type, model, base_url, wait_timeout, lease_seconds)
+        except grpc.RpcError as e:
+            logger.warning(f"Slot admission unavailable, falling back to local selection: {e}")
+            selected = self.select_model(model_type, model)
+            if selected is None:
+                raise
+        try:
+            with self.track_request(selected.base_url, selected.model):
+                yield selected
+        finally:
+            if slot_id:
+                await self.release_slot(selected, slot_id)
+
     #----------------------------------------------------
     # 一次性重建所有通道,这个当两个都异常了才会重建
     #----------------------------------------------------
@@ -88,10 +495,10 @@ class ModelPoolClient:
         rebuilt_stubs = {}
         for addr in self.addresses:
             try:
-                channel = insecure_channel(addr)
+                channel = insecure_channel(addr, options=CHANNEL_OPTIONS)
                 stub = modelpool_pb2_grpc.ModelPoolServiceStub(channel)
                 await stub.GetAvailableModels(
-                    modelpool_pb2.AvailableModelsRequest(client_id=self.client_id),
+                    modelpool_pb2.AvailableModelsRequest(client_id=self.client_id, pool=self.pool),
                     timeout=5
                 )
                 self.channels[addr] = channel
@@ -122,7 +529,7 @@ class ModelPoolClient:
             try:
                 # 快速健康检查
                 await current_stub.GetModelList(
-                    modelpool_pb2.AvailableModelsRequest(client_id=self.client_id),
+                    modelpool_pb2.AvailableModelsRequest(client_id=self.client_id, pool=self.pool),
                     timeout=2
                 )
                 return current_stub
@@ -137,7 +544,7 @@ class ModelPoolClient:
             if stub is not None:
                 try:
                     await stub.GetModelList(
-                        modelpool_pb2.AvailableModelsRequest(client_id=self.client_id),
+                        modelpool_pb2.AvailableModelsRequest(client_id=self.client_id, pool=self.pool),
                         timeout=2
                     )
                     self.current_address = addr
@@ -150,44 +557,371 @@ class ModelPoolClient:
         logger.error("All pre-created channels are unavailable, performing a unified rebuild")
         return await self._rebuild_all_channels()
     
+    #--------------------------------------------------------------------------
+    # 构造获取模型列表的请求，子类（例如进程内共享客户端）可以重载这个函数上报更多信息
+    #--------------------------------------------------------------------------
+    def _build_models_request(self):
+        """构造 AvailableModelsRequest，取走待上报的增量"""
+        # 构造grpc请求，消息的内容是当前客户端使用 base_url 和 model ，id是客户端唯一标识用来给服务端区分客户端的
+        # 这个是当前客户端的请求， client_id 是自己的id
+        self.usage_seq += 1
+        request = modelpool_pb2.AvailableModelsRequest(
+            client_id=self.client_id, usage_seq=self.usage_seq, pool=self.pool,
+            model_types=self.model_types, names=self.names, priority=PRIORITIES[self.priority]
+        )
+        if self.fields:
+            request.field_mask.paths.extend(self.fields)
+        if self.need_full_sync or self.reports_since_full_sync >= self.full_sync_interval:
+            # 全量：将使用这个modelpool 客户端的agent下使用的所有的模型服务器的信息上报给服务端
+            request.full_sync = True
+            request.model_usages.extend(
+                modelpool_pb2.ModelUsage(base_url=base_url, model=model)
+                for base_url, model in self.used_model_usages
+            )
+            self.need_full_sync = False
+            self.reports_since_full_sync = 0
+        else:
+            # 增量：只上报变化的部分，没有变化的时候请求里面只有 client_id 和序号
+            request.added_usages.extend(
+                modelpool_pb2.ModelUsage(base_url=base_url, model=model)
+                for base_url, model in self.added_model_usages
+            )
+            request.removed_usages.extend(
+                modelpool_pb2.ModelUsage(base_url=base_url, model=model)
+                for base_url, model in self.removed_model_usages
+            )
+            self.reports_since_full_sync += 1
+        self.added_model_usages.clear()
+        self.removed_model_usages.clear()
+        return request
+
+    #--------------------------------------------------------------------------
+    # 对冲调用：按 current_address 开始的顺序，每隔一个对冲延迟多发一个，第一个成功的结果生效
+    #--------------------------------------------------------------------------
+    def _hedge_delay(self) -> float:
+        """最近成功调用耗时的 hedge_percentile 分位，限制在 [hedge_min_delay, hedge_max_delay]"""
+        if len(self.call_latencies) < 10:
+            return self.hedge_max_delay
+        samples = sorted(self.call_latencies)
+        index = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, samples[index]))
+
+    def _ensure_stub(self, addr: str):
+        """对冲模式下重建失败的通道按需重新创建"""
+        stub = self.stubs.get(addr)
+        if stub is None:
+            channel = insecure_channel(addr, options=CHANNEL_OPTIONS)
+            stub = modelpool_pb2_grpc.ModelPoolServiceStub(channel)
+            self.channels[addr] = channel
+            self.stubs[addr] = stub
+        return stub
+
+    async def _hedged_call(self, method: str, request, timeout: float = 5):
+        """对冲调用 stub 的 method，返回第一个成功的响应，全部失败抛出最后一个异常"""
+        start = self.addresses.index(self.current_address) if self.current_address in self.addresses else 0
+        order = self.addresses[start:] + self.addresses[:start]
+        delay = self._hedge_delay()
+        tasks = {}  # {task: addr}
+        last_error = None
+        begin = time.time()
+        try:
+            for i, addr in enumerate(order):
+                call = getattr(self._ensure_stub(addr), method)(request, timeout=timeout)
+                tasks[asyncio.ensure_future(call)] = addr
+                is_last = i == len(order) - 1
+                # 等到有结果，或者到了对冲延迟（最后一个地址就一直等）
+                while tasks:
+                    done, _ = await asyncio.wait(tasks, timeout=None if is_last else delay,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        break  # 超过对冲延迟还没有结果，发给下一个地址
+                    for task in done:
+                        winner = tasks.pop(task)
+                        if task.exception() is None:
+                            if winner != self.current_address:
+                                logger.info(f"Hedged call {method} answered first by {winner}")
+                                self.current_address = winner
+                            self.call_latencies.append(time.time() - begin)
+                            return task.result()
+                        last_error = task.exception()
+                        logger.warning(f"Hedged call {method} to {winner} failed: {last_error}")
+                    if not is_last:
+                        break  # 有失败的，不用等对冲延迟，马上发给下一个地址
+            raise last_error or grpc.RpcError(f"Hedged call {method} failed on all addresses")
+        finally:
+            # 取消还没有完成的调用
+            for task in tasks:
+                task.cancel()
+
     #--------------------------------------------------------------------------
     # 从modelpoolservice server获取当前可用模型列表，同时上报当前使用这个客户端
     # 的grpc链路上的agent，所有使用的模型信息
     #--------------------------------------------------------------------------
     async def get_available_models(self):
-        """获取可用模型列表，复用通道"""
+        """获取可用模型列表，复用通道；同一时刻只有一个刷新在进行"""
+        async with self.refresh_lock:
+            return await self._fetch_available_models()
+
+    async def _fetch_available_models(self):
+        """获取可用模型列表，调用方需要持有 self.refresh_lock"""
+        if self.hedge:
+            return await self._get_available_models_hedged()
+
         stub = await self._get_available_stub()
         if stub is None:
-            logger.error("Failed to get an available stub, returning an empty list")
-            return []
+            logger.error("Failed to get an available stub, keeping the last known model list (stale)")
+            self._mark_stale()
+            return self.models
 
         try:
-            # 构造grpc请求，消息的内容是当前客户端使用 base_url 和 model ，id是客户端唯一标识用来给服务端区分客户端的
-            # 这个是当前客户端的请求， client_id 是自己的id
-            request = modelpool_pb2.AvailableModelsRequest(
-                # 将使用这个modelpool 客户端的agent下使用的所有的模型服务器的信息上报给服务端
-                model_usages=[
-                    modelpool_pb2.ModelUsage(base_url=base_url, model=model)
-                    for base_url, model in self.used_model_usages
-                ],
-                client_id=self.client_id
-            )
+            request = self._build_models_request()
             # 获取当前可用的模型列表
             response = await stub.GetAvailableModels(request, timeout=5)
-            self.models = response.models
+            if response.resync_required:
+                logger.warning(f"Server requested a full usage sync for client {self.client_id}")
+                self.need_full_sync = True
+            self._update_models(response)
             return self.models
         except Exception as e:
             logger.error(f"Failed to get the model list: {e}")
+            self._mark_stale()
+            self.need_full_sync = True  # 不确定服务端是否收到了这次增量，下次全量同步
             self.stub = None  # 标记 Stub 失效，下次重建
             raise
 
-    async def start_polling(self, interval: int = 10) -> None:
-        """启动后台轮询任务以更新模型状态"""
+    async def _get_available_models_hedged(self):
+        """对冲模式下获取可用模型列表"""
+        request = self._build_models_request()
+        try:
+            response = await self._hedged_call("GetAvailableModels", request)
+        except Exception as e:
+            logger.error(f"Failed to get the model list from all addresses: {e}")
+            self._mark_stale()
+            self.need_full_sync = True
+            raise
+        if response.resync_required:
+            logger.warning(f"Server requested a full usage sync for client {self.client_id}")
+            self.need_full_sync = True
+        self._update_models(response)
+        return self.models
+
+    async def report_failure(self, base_url: str, model: str, error: str = "") -> None:
+        """端点调用失败：先从本地列表中去掉（马上生效），再让服务端立即重新探测；
+        服务端异步探测，确认挂了之后列表版本会变，下一次心跳发现版本变了就刷新列表"""
+        self.models = [m for m in self.models if not (m.base_url == base_url and m.model == model)]
+        self._notify_listeners()
+        stub = self.stubs.get(self.current_address)
+        if stub is None:
+            return
+        try:
+            await stub.ReportEndpointFailure(
+                modelpool_pb2.EndpointFailureReport(
+                    client_id=self.client_id, pool=self.pool, base_url=base_url, model=model, error=error[:500]
+                ),
+                timeout=10
+            )
+        except Exception as e:
+            logger.warning(f"Failed to report endpoint failure of {base_url}: {e}")
+
+    async def set_endpoint_state(self, names: Optional[List[str]] = None, base_url: str = "",
+                                 draining: Optional[bool] = None, weight: Optional[int] = None, admin_token: str = ""):
+        """管理接口：按名称或者地址设置端点的摘流量状态和流量权重（1-100），None 表示不修改，返回修改之后的端点"""
+        stub = await self._get_available_stub()
+        if stub is None:
+            raise grpc.RpcError("No available model pool server")
+        request = modelpool_pb2.EndpointStateRequest(pool=self.pool, names=names or [], base_url=base_url,
+                                                     admin_token=admin_token)
+        if draining is not None:
+            request.draining = draining
+        if weight is not None:
+            request.weight = weight
+        response = await stub.SetEndpointState(request, timeout=5)
+        return response.models
+
+    async def get_model_history(self, names: Optional[List[str]] = None, max_points: int = 60, since: float = 0.0):
+        """查询端点的探测历史（降采样）和耗时趋势"""
+        stub = await self._get_available_stub()
+        if stub is None:
+            raise grpc.RpcError("No available model pool server")
+        request = modelpool_pb2.ModelHistoryRequest(names=names or [], max_points=max_points, since=since, pool=self.pool)
+        response = await stub.GetModelHistory(request, timeout=5)
+        return response.histories
+
+    #--------------------------------------------------------------------------
+    # 降级模式
+    #--------------------------------------------------------------------------
+    def _update_models(self, response) -> None:
+        """从 modelpool server 拿到了新的列表，退出降级模式"""
+        if self.stale:
+            logger.info(f"Model pool server is back after {time.time() - self.outage_since:.1f}s, leaving degraded mode")
+        self.stale = False
+        self.outage_since = None
+        self.direct_probe_status.clear()
+        self.models = response.models
+        for m in response.models:
+            self.known_models[(m.base_url, m.model)] = m
+        if response.version != self.models_version:
+            self.assignments.clear()  # 端点状态变了（例如开始摘流量），预取的分配不再用
+            if self.cache_file:
+                self._save_cache(response)
+        self.models_version = response.version
+        self._notify_listeners()
+
+    def _mark_stale(self) -> None:
+        """modelpool server 不可达，保留最后一次正常的列表"""
+        if not self.stale:
+            self.stale = True
+            self.outage_since = time.time()
+            logger.warning(f"Model pool servers unreachable, serving {len(self.models)} cached models as stale")
+            self._notify_listeners()
+
+    #--------------------------------------------------------------------------
+    # 本地缓存文件：内容就是序列化的 ModelListResponse
+    #--------------------------------------------------------------------------
+    def _load_cache(self) -> None:
+        """启动时加载本地缓存，加载成功的列表标记为 stale，等待后台轮询校验"""
+        try:
+            age = time.time() - os.path.getmtime(self.cache_file)
+            if age > self.cache_max_age:
+                logger.info(f"Model cache {self.cache_file} is {age:.0f}s old, ignored")
+                return
+            with open(self.cache_file, "rb") as f:
+                response = modelpool_pb2.ModelListResponse.FromString(f.read())
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Failed to load model cache {self.cache_file}: {e}")
+            return
+        self.models = response.models
+        self.models_version = response.version
+        for m in response.models:
+            self.known_models[(m.base_url, m.model)] = m
+        self.stale = True
+        self.outage_since = time.time()
+        logger.info(f"Loaded {len(self.models)} models (version {self.models_version}) from cache {self.cache_file}, age {age:.0f}s")
+
+    def _save_cache(self, response) -> None:
+        """写临时文件再 os.replace，其他进程读到的要么是旧文件要么是新文件"""
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".modelpool_cache_")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(response.SerializeToString())
+                os.replace(tmp_path, self.cache_file)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.warning(f"Failed to save model cache {self.cache_file}: {e}")
+
+    def _probe_endpoint(self, m) -> bool:
+        """直接请求 base_url + '/models'，和服务端的健康检查一样比较模型名称"""
+        try:
+            with urllib.request.urlopen(f"{m.base_url}/models", timeout=self.degraded_probe_timeout) as response:
+                data = json.loads(response.read())
+            ids = [item.get("id", "").rstrip("/") for item in data.get("data", [])] or [data.get("id", "").rstrip("/")]
+            return m.model.rstrip("/") in ids
+        except Exception:
+            return False
+
+    async def _degraded_probe(self) -> None:
+        """降级模式下轮流探测已知端点，每次最多 degraded_probe_budget 个"""
+        if not self.stale or time.time() - self.outage_since < self.degraded_probe_after:
+            return
+        endpoints = list(self.known_models.values())
+        if not endpoints:
+            return
+        budget = min(self.degraded_probe_budget, len(endpoints))
+        batch = [endpoints[(self.direct_probe_cursor + i) % len(endpoints)] for i in range(budget)]
+        self.direct_probe_cursor = (self.direct_probe_cursor + budget) % len(endpoints)
+
+        results = await asyncio.gather(*(asyncio.to_thread(self._probe_endpoint, m) for m in batch))
+        for m, ok in zip(batch, results):
+            self.direct_probe_status[(m.base_url, m.model)] = ok
+
+        # 没有探测过的端点，沿用进入降级模式时它是否在可用列表里
+        cached = {(m.base_url, m.model) for m in self.models}
+        models = []
+        for key, m in self.known_models.items():
+            if self.direct_probe_status.get(key, key in cached):
+                models.append(m)
+        self.models = models
+        logger.warning(f"Degraded mode: probed {budget} endpoints directly, {len(models)}/{len(endpoints)} usable")
+        self._notify_listeners()
+
+    async def start_polling(self, interval: int = 10, heartbeat_interval: float = 1.0) -> None:
+        """启动后台轮询任务以更新模型状态，heartbeat_interval > 0 时同时启动在途请求数心跳"""
+        # 已经在轮询就不重复启动（共享客户端会被多个 agent 调用）
+        if getattr(self, '_polling_task', None) is not None and not self._polling_task.done():
+            return
         self._polling_task = asyncio.create_task(
             self.poll_status(interval),
             name=f"ModelPoolClientPoll/{self.client_id}"
         )
-        logger.info(f"Started model pool polling for client {self.client_id} (interval: {interval}s)")
+        if heartbeat_interval > 0:
+            self._heartbeat_task = asyncio.create_task(
+                self.heartbeat(heartbeat_interval),
+                name=f"ModelPoolClientHeartbeat/{self.client_id}"
+            )
+        if self.prefer_nearby and self.rtt_interval > 0:
+            self._rtt_task = asyncio.create_task(
+                self.measure_rtt(self.rtt_interval),
+                name=f"ModelPoolClientRtt/{self.client_id}"
+            )
+        logger.info(f"Started model pool polling for client {self.client_id} (interval: {interval}s, heartbeat: {heartbeat_interval}s)")
+
+    #----------------------------------------------------
+    # 心跳：在途请求数有变化的时候上报，没有变化但是还有在途请求的，
+    # 每 keepalive 秒上报一次，避免服务端把这个客户端当成超时
+    #----------------------------------------------------
+    async def heartbeat(self, interval: float = 1.0, keepalive: float = 5.0):
+        while True:
+            await asyncio.sleep(interval)
+            now = time.time()
+            if not self.inflight_dirty and (not self.inflight or now - self.last_heartbeat < keepalive):
+                continue
+            stub = self.stubs.get(self.current_address)
+            if stub is None:
+                continue
+            self.inflight_dirty = False
+            tokens, self.tokens = self.tokens, defaultdict(lambda: [0, 0, 0])
+            request = modelpool_pb2.LoadReport(
+                client_id=self.client_id, pool=self.pool,
+                inflight=[
+                    modelpool_pb2.InflightCount(base_url=base_url, model=model, count=count)
+                    for (base_url, model), count in self.inflight.items()
+                ],
+                tokens=[
+                    modelpool_pb2.TokenCount(base_url=base_url, model=model, prompt_tokens=prompt,
+                                             completion_tokens=completion, requests=requests)
+                    for (base_url, model), (prompt, completion, requests) in tokens.items()
+                ]
+            )
+            try:
+                ack = await stub.ReportLoad(request, timeout=2)
+                self.last_heartbeat = now
+            except Exception as e:
+                # 心跳失败不切换地址，由轮询负责；下次继续上报（token 数合并到下一次）
+                self.inflight_dirty = True
+                for key, counts in tokens.items():
+                    pending = self.tokens[key]
+                    for i, value in enumerate(counts):
+                        pending[i] += value
+                logger.warning(f"Failed to report load to {self.current_address}: {e}")
+                continue
+            if ack.version and ack.version != self.heartbeat_version:
+                refresh = self.heartbeat_version != 0 and ack.version != self.models_version
+                self.heartbeat_version = ack.version
+                if refresh:
+                    logger.info(f"Model list version changed to {ack.version}, refreshing before the next poll")
+                    try:
+                        async with self.refresh_lock:
+                            # 等锁的时候轮询可能已经拿到了这个版本的列表
+                            if ack.version != self.models_version:
+                                await self._fetch_available_models()
+                    except Exception:
+                        pass
     #----------------------------------------------------
     # 定时从 modelpool service 获取 所有模型服务器的状态
     #----------------------------------------------------
@@ -203,7 +937,7 @@ class ModelPoolClient:
                     model_lines = []
                     for m in models:
                         model_info = (
-                            f"- name: \"{m.name}\",model_type: \"{m.model_type}\",model: \"{m.model}\",base_url: \"{m.base_url}\",status: \"{m.status}\",usage_count: {m.usage_count}\n\n"
+                            f"- name: \"{m.name}\",model_type: \"{m.model_type}\",model: \"{m.model}\",base_url: \"{m.base_url}\",status: \"{modelpool_pb2.ModelStatus.Name(m.status_code)}\",usage_count: {m.usage_count},inflight: {m.inflight}\n\n"
                         )
                         model_lines.append(model_info)
                     logger.info("Received model list:\n" + "\n".join(model_lines))
@@ -212,6 +946,10 @@ class ModelPoolClient:
 
             except Exception as e:
                 logger.error(f"Failed to query the model pool status: {e}")
+            try:
+                await self._degraded_probe()
+            except Exception as e:
+                logger.error(f"Degraded mode probing failed: {e}")
             await asyncio.sleep(interval)
 
     #----------------------------------------------------
@@ -219,14 +957,19 @@ class ModelPoolClient:
     #----------------------------------------------------
     async def close(self):
         """关闭所有通道并停止轮询"""
-        # 停止轮询
-        if hasattr(self, '_polling_task') and self._polling_task:
-            self._polling_task.cancel()
-            try:
-                await self._polling_task
-            except asyncio.CancelledError:
-                pass
+        # 停止轮询和心跳
+        for task_name in ('_polling_task', '_heartbeat_task', '_rtt_task'):
+            task = getattr(self, task_name, None)
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         
+        if self.trace is not None:
+            self.trace.close()
+
         # 关闭所有通道
         for addr, channel in self.channels.items():
             if channel is not None:
@@ -0,0 +1,215 @@
+import time
+import asyncio
+from collections import deque
+from typing import Optional
+from loguru import logger
+
+from modelpool_client import ModelPoolClient
+
+#--------------------------------------------------------------------------
+# 带故障转移和对冲的 chat completion 执行器
+# 说明：以前 agent 选中的端点在请求中途挂了，只能从异常里知道，然后要等下一次 poll_status
+# （最多 10 秒）才知道有哪些端点可以换。CompletionExecutor 直接在模型池上执行 OpenAI 兼容的
+# chat completion：
+#   1：连接失败、超时、429 和 5xx 换同一个模型的下一个可用端点重试（已经试过的不再选），
+#      最多 max_attempts 次；重试受重试预算限制，端点大面积故障的时候不会把流量放大几倍；
+#   2：连接失败、超时和 5xx 立即上报给 modelpool server（ReportEndpointFailure），本地列表马上
+#      去掉这个端点，服务端立即重新探测，探测也失败就标记为不可用，其他 agent 也能马上避开；
+#   3：非流式请求可以对冲：hedge_after 秒还没有返回，在另一个端点上再发一次，谁先成功用谁，
+#      另一个取消，尾延迟不再取决于最慢的端点（对冲也消耗重试预算）；
+#   4：在途请求数、token 数（响应的 usage）和请求轨迹都按端点记到 ModelPoolClient 上。
+# 默认用 openai.AsyncOpenAI 发请求（需要 pip install openai，用到的时候才导入），也可以传入
+# send(base_url, **kwargs) 换成其他 HTTP 客户端。
+#--------------------------------------------------------------------------
+class RetryBudget:
+    """重试预算：最近 ttl 秒内的重试次数不超过 min_retries_per_sec * ttl + ratio * 请求数"""
+
+    def __init__(self, ratio: float = 0.2, min_retries_per_sec: float = 1.0, ttl: float = 10.0):
+        self.ratio = ratio
+        self.min_retries_per_sec = min_retries_per_sec
+        self.ttl = ttl
+        self.requests = deque()  # 请求时间
+        self.retries = deque()   # 重试时间
+
+    def _expire(self, now: float) -> None:
+        for events in (self.requests, self.retries):
+            while events and events[0] <= now - self.ttl:
+                events.popleft()
+
+    def record_request(self) -> None:
+        now = time.time()
+        self._expire(now)
+        self.requests.append(now)
+
+    def try_retry(self) -> bool:
+        """还有预算就记一次重试并返回 True"""
+        now = time.time()
+        self._expire(now)
+        if len(self.retries) >= self.min_retries_per_sec * self.ttl + self.ratio * len(self.requests):
+            return False
+        self.retries.append(now)
+        return True
+
+
+def _field(obj, name):
+    """同时支持 openai 的响应对象和 dict"""
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _connection_errors() -> tuple:
+    errors = (OSError, asyncio.TimeoutError)
+    try:
+        import openai
+    except ImportError:
+        return errors
+    return errors + (openai.APIConnectionError,)  # 包括 APITimeoutError
+
+
+def is_retryable(error: Exception) -> bool:
+    """连接失败、超时、429 和 5xx 换一个端点重试，其他错误（例如 400 参数错误）直接抛出"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, _connection_errors())
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """连接失败、超时和 5xx 说明端点本身有问题，要上报；429 只是忙"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status >= 500
+    return isinstance(error, _connection_errors())
+
+
+class CompletionExecutor:
+    def __init__(self, client: ModelPoolClient, api_key: str = "EMPTY", max_attempts: int = 3,
+                 retry_budget: Optional[RetryBudget] = None, hedge_after: Optional[float] = None,
+                 timeout: float = 600.0, send=None):
+        self.client = client
+        self.api_key = api_key
+        self.max_attempts = max_attempts
+        self.budget = retry_budget or RetryBudget()
+        self.hedge_after = hedge_after  # 非流式请求多少秒没有返回就对冲，None 表示不对冲
+        self.timeout = timeout
+        self.send = send or self._openai_send
+        self.openai_clients = {}        # {base_url: openai.AsyncOpenAI}
+        self.background = set()         # 上报失败的后台任务，保留引用避免被回收
+
+    async def _openai_send(self, base_url: str, **kwargs):
+        try:
+            import openai
+        except ImportError as e:
+            raise ImportError("CompletionExecutor 默认用 openai 发请求，请先 pip install openai，或者传入 send") from e
+        openai_client = self.openai_clients.get(base_url)
+        if openai_client is None:
+            # 重试由执行器换端点来做，不在同一个端点上重试
+            openai_client = openai.AsyncOpenAI(base_url=base_url, api_key=self.api_key,
+                                               timeout=self.timeout, max_retries=0)
+            self.openai_clients[base_url] = openai_client
+        return await openai_client.chat.completions.create(**kwargs)
+
+    #--------------------------------------------------------------------------
+    # 执行：选端点 -> 请求 -> 失败换端点重试
+    #--------------------------------------------------------------------------
+    async def chat_completion(self, messages, model_type: Optional[str] = None, model: Optional[str] = None,
+                              tokens: int = 0, **kwargs):
+        """执行 chat completion，kwargs 原样传给 chat.completions.create（model 用选中端点的）；
+        stream=True 的时候返回异步迭代器，只在拿到响应之前失败的才重试"""
+        self.budget.record_request()
+        tried = set()
+
+        def pick_next(retry: bool):
+            if retry and not self.budget.try_retry():
+                logger.warning("Retry budget exhausted, not retrying on another endpoint")
+                return None
+            m = self.client.select_model(model_type, model, tokens, exclude=tried)
+            if m is not None:
+                tried.add((m.base_url, m.model))
+            return m
+
+        hedge = self.hedge_after is not None and not kwargs.get("stream")
+        last_error = None
+        for attempt in range(self.max_attempts):
+            m = pick_next(retry=attempt > 0)
+            if m is None:
+                break
+            try:
+                if hedge:
+                    return await self._hedged(m, pick_next, messages, kwargs)
+                return await self._attempt(m, messages, kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                logger.warning(f"Completion on {m.base_url} failed (attempt {attempt + 1}/{self.max_attempts}): {e!r}")
+                last_error = e
+        if last_error is not None:
+            raise last_error
+        raise RuntimeError(f"No available endpoint for model_type={model_type}, model={model}")
+
+    async def _hedged(self, first, pick_next, messages, kwargs):
+        """先在 first 上请求，hedge_after 秒没有返回再在另一个端点上请求，用先成功的"""
+        pending = {asyncio.ensure_future(self._attempt(first, messages, kwargs))}
+        done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+        if not done:
+            second = pick_next(retry=True)
+            if second is not None:
+                logger.info(f"Hedging completion from {first.base_url} to {second.base_url} after {self.hedge_after}s")
+                pending.add(asyncio.ensure_future(self._attempt(second, messages, kwargs)))
+        error = None
+        try:
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _attempt(self, m, messages, kwargs):
+        """在一个端点上请求一次，记录在途请求数、token 数和轨迹，端点故障的立即上报"""
+        self.client.acquire_request(m.base_url, m.model)
+        start = time.time()
+        try:
+            response = await self.send(m.base_url, **{**kwargs, "model": m.model, "messages": messages})
+        except BaseException as e:
+            self._finish(m, start, False)
+            if isinstance(e, Exception) and is_endpoint_failure(e):
+                self._report_failure(m, e)
+            raise
+        if kwargs.get("stream"):
+            return self._tracked_stream(m, start, response)
+        self._record_usage(m, response)
+        self._finish(m, start, True)
+        return response
+
+    async def _tracked_stream(self, m, start, stream):
+        """流式响应：读完（或者中途出错、被关闭）才算请求结束"""
+        ok = False
+        try:
+            async for chunk in stream:
+                self._record_usage(m, chunk)  # stream_options={"include_usage": True} 时最后一个 chunk 带 usage
+                yield chunk
+            ok = True
+        finally:
+            self._finish(m, start, ok)
+
+    def _record_usage(self, m, response) -> None:
+        usage = _field(response, "usage")
+        if usage:
+            self.client.record_tokens(m.base_url, m.model, _field(usage, "prompt_tokens") or 0,
+                                      _field(usage, "completion_tokens") or 0)
+
+    def _finish(self, m, start: float, ok: bool) -> None:
+        self.client.release_request(m.base_url, m.model)
+        self.client.record_request(m.base_url, m.model, start, time.time() - start, ok)
+
+    def _report_failure(self, m, error: Exception) -> None:
+        task = asyncio.ensure_future(self.client.report_failure(m.base_url, m.model, repr(error)))
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
@@ -0,0 +1,160 @@
+import math
+import os
+import time
+from threading import Lock
+
+#--------------------------------------------------------------------------
+# 端点探测历史
+# 说明：每个端点一个固定大小的环形缓冲区，存储探测时间、结果、耗时和负载，
+# 不管服务跑多久内存都是固定的（capacity * 17 字节左右）。
+#    查询的时候按时间分桶降采样，返回每个桶的可用率、平均/最大耗时和平均负载；
+# 同时对最近成功探测的 /models 耗时做线性回归，耗时持续上升的端点会被标记出来，
+# 用于在真正故障之前发现慢慢变差的服务。
+#    缓冲区可以由外部传入（多进程模式下是共享内存，见 modelpool_shm.py），只有一个
+# 进程写；写的时候序号先变成奇数、写完变成偶数，其他进程读到序号变化就重读。
+#--------------------------------------------------------------------------
+SPIN_RETRIES = 3      # 写的一方正在写的时候，先让出 CPU 重试几次
+RETRY_SLEEP = 0.001   # 之后每次重试之前睡眠的时间（秒）
+
+
+def seqlock_backoff(attempt: int) -> None:
+    """seqlock 读到正在写或者被改写的数据之后等一下再重读：不要空转占着 CPU，
+    写的一方（可能是同一个核上的健康检查线程）需要时间写完"""
+    if attempt < SPIN_RETRIES:
+        os.sched_yield()
+    else:
+        time.sleep(RETRY_SLEEP)
+
+
+class ProbeHistory:
+    META_SIZE = 24  # 序号、下一个写入的位置、当前保存的条数，各 8 字节
+
+    @classmethod
+    def buffer_size(cls, capacity: int) -> int:
+        return cls.META_SIZE + capacity * 17
+
+    def __init__(self, capacity: int = 720, buffer=None):
+        self.capacity = capacity
+        if buffer is None:
+            buffer = bytearray(self.buffer_size(capacity))
+        view = memoryview(buffer)
+        offset = self.META_SIZE
+        self.meta = view[:offset].cast('q')
+        self.timestamps = view[offset:offset + 8 * capacity].cast('d')  # 探测时间（秒）
+        offset += 8 * capacity
+        self.latencies = view[offset:offset + 4 * capacity].cast('f')   # 探测耗时（毫秒）
+        offset += 4 * capacity
+        self.loads = view[offset:offset + 4 * capacity].cast('i')       # 探测时的负载
+        offset += 4 * capacity
+        self.outcomes = view[offset:offset + capacity].cast('b')        # 1 成功，0 失败
+        self.lock = Lock()
+
+    @property
+    def head(self):
+        """下一个写入的位置"""
+        return self.meta[1]
+
+    @property
+    def size(self):
+        """当前保存的条数"""
+        return self.meta[2]
+
+    def record(self, timestamp: float, ok: bool, latency_ms: float, load: int = 0) -> None:
+        """记录一次探测结果，满了覆盖最老的"""
+        with self.lock:
+            seq = self.meta[0]
+            self.meta[0] = seq + 1  # 奇数：正在写
+            i = self.head
+            self.timestamps[i] = timestamp
+            self.latencies[i] = latency_ms
+            self.outcomes[i] = 1 if ok else 0
+            self.loads[i] = load
+            self.meta[1] = (i + 1) % self.capacity
+            if self.size < self.capacity:
+                self.meta[2] = self.size + 1
+            self.meta[0] = seq + 2
+
+    def _read(self, collect, retries: int = 50):
+        """在一致的快照上执行 collect，其他进程正在写的时候等一下重读；
+        一直读不到一致的数据返回空列表（最多等 retries 毫秒左右），不返回可能读花了的数据"""
+        for attempt in range(retries):
+            # 只在读的时候持有本进程的锁，等待的时候不占着它
+            with self.lock:
+                seq = self.meta[0]
+                if not seq & 1:
+                    result = collect()
+                    if self.meta[0] == seq:
+                        return result
+            seqlock_backoff(attempt)
+        return []
+
+    def _indexes(self):
+        """按时间顺序返回有效数据的下标，在 _read 里面调用"""
+        start = (self.head - self.size) % self.capacity
+        return [(start + k) % self.capacity for k in range(self.size)]
+
+    def downsample(self, max_points: int = 60, since: float = 0.0):
+        """按时间等分成最多 max_points 个桶，返回每个桶的
+        (开始时间, 可用率, 平均耗时, 最大耗时, 平均负载, 样本数, 结果翻转次数)"""
+        samples = self._read(lambda: [
+            (self.timestamps[i], self.outcomes[i], self.latencies[i], self.loads[i])
+            for i in self._indexes() if self.timestamps[i] >= since
+        ])
+        if not samples:
+            return []
+        max_points = max(1, max_points)
+        begin, end = samples[0][0], samples[-1][0]
+        width = (end - begin) / max_points or 1.0
+
+        buckets = []
+        current = None
+        last_outcome = None
+        for ts, ok, latency, load in samples:
+            index = min(max_points - 1, int((ts - begin) / width))
+            if current is None or current[0] != index:
+                current = [index, 0, 0, 0.0, 0.0, 0.0, 0, 0]  # 下标, 样本数, 成功数, 耗时和, 最大耗时, 负载和, 成功样本数, 翻转次数
+                buckets.append(current)
+            current[1] += 1
+            current[2] += ok
+            if ok:
+                current[3] += latency
+                current[4] = max(current[4], latency)
+                current[6] += 1
+            current[5] += load
+            if last_outcome is not None and ok != last_outcome:
+                current[7] += 1
+            last_outcome = ok
+        return [
+            (begin + index * width, succeeded / count,
+             latency_sum / ok_count if ok_count else 0.0, max_latency, load_sum / count, count, flips)
+            for index, count, succeeded, latency_sum, max_latency, load_sum, ok_count, flips in buckets
+        ]
+
+    def latency_trend(self, window: int = 30, min_correlation: float = 0.7, min_increase: float = 0.3,
+                      min_increase_ms: float = 50.0):
+        """对最近 window 次成功探测的耗时做线性回归，返回 (每分钟增加的毫秒数, 是否持续上升)
+        持续上升：相关系数 >= min_correlation，且窗口内的增长超过平均耗时的 min_increase、
+        也超过 min_increase_ms 毫秒（耗时不到 1 毫秒的本机端点的抖动不算）"""
+        points = self._read(lambda: [
+            (self.timestamps[i], self.latencies[i])
+            for i in self._indexes() if self.outcomes[i]
+        ])[-window:]
+        n = len(points)
+        if n < max(5, window // 3):
+            return 0.0, False
+        t0 = points[0][0]
+        xs = [ts - t0 for ts, _ in points]
+        ys = [latency for _, latency in points]
+        mean_x = sum(xs) / n
+        mean_y = sum(ys) / n
+        sxx = sum((x - mean_x) ** 2 for x in xs)
+        syy = sum((y - mean_y) ** 2 for y in ys)
+        sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+        if sxx == 0 or syy == 0:
+            return 0.0, False
+        slope = sxy / sxx  # 毫秒/秒
+        correlation = sxy / math.sqrt(sxx * syy)
+        increase = slope * (xs[-1] - xs[0])
+        rising = (correlation >= min_correlation and increase >= min_increase_ms
+                  and mean_y > 0 and increase / mean_y >= min_increase)
+        return slope * 60, rising
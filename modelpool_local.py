@@ -0,0 +1,220 @@
+import os
+import mmap
+import time
+import random
+from bisect import bisect
+from itertools import accumulate
+import struct
+import asyncio
+import argparse
+from typing import List, Optional
+from loguru import logger
+from google.protobuf.message import DecodeError
+
+import modelpool_pb2
+from modelpool_client import ModelPoolClient, rank_models, LONG_CONTEXT_TOKENS
+from modelpool_shm import SeqlockBlob
+
+#--------------------------------------------------------------------------
+# 同一台机器上多个 agent 进程共用一份模型列表
+# 说明：推理网关机器上几十个 agent 进程各自跑一个 ModelPoolClient，各自建通道、各自轮询，
+# 拿到的是同一份列表。本地发布模式下每台机器只跑一个发布进程（LocalModelPublisher），
+# 它用一个 ModelPoolClient 订阅 modelpool server，把当前的列表写到一个内存映射文件里
+# （默认在 /dev/shm 下面），其他进程用 LocalModelReader 映射同一个文件直接读：
+#   1：文件布局：[magic 8 字节][发布进程的心跳时间 f64][SeqlockBlob：序号、长度、数据]，
+#      数据是 [stale 1 字节] + 序列化的 ModelListResponse；
+#   2：只有发布进程写，读的一方按 seqlock 检查一致性（序号是奇数或者读的过程中变了就重读）；
+#   3：读的一方先读序号，和上次一样就直接用已经解析好的列表和排名，序号变了才重新解析；
+#      每次选择在排名最前的几个端点里按权重随机选，不是都选第一名：同一台机器上几十个进程读的是
+#      同一份列表，都选第一名就会一起压到同一个端点上，直到发布进程下一次更新；
+#   4：发布进程每秒更新心跳时间，超过 max_age 秒没有更新（发布进程挂了）读到的列表标记为 stale；
+#   5：发布进程用更大的 capacity 重启之后文件会变大，读的一方发现数据比映射的长或者文件变大了就重新映射，
+#      解析不了的数据不用，继续用上一次的列表。
+# 注意：读的进程不向服务端上报使用信息和在途请求数，需要这些统计的 agent 还是用 ModelPoolClient。
+#     python modelpool_local.py --addresses 172.21.30.231:50051,172.21.30.231:50052
+#--------------------------------------------------------------------------
+DEFAULT_PATH = "/dev/shm/modelpool_default.bin"
+MAGIC = b"MPLOCAL1"
+HEARTBEAT = struct.Struct("<d")
+BLOB_OFFSET = len(MAGIC) + HEARTBEAT.size
+TOP_CHOICES = 3  # 每次选择在排名前几个、并且和第一名同一档（负载、槽位是否已满）的端点里随机选
+
+
+class LocalModelPublisher:
+    def __init__(self, client: ModelPoolClient, path: str = DEFAULT_PATH, capacity: int = 4 * 1024 * 1024):
+        self.client = client
+        self.path = path
+        # 读的进程映射的是同一个文件，发布进程重启也不能删掉重建，只能原地改写；
+        # 文件只能变大不能变小，截短正在被映射的文件，读的进程访问到截掉的部分会收到 SIGBUS
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            current = os.fstat(fd).st_size
+            size = max(BLOB_OFFSET + SeqlockBlob.HEADER_SIZE + capacity, current)
+            if current < size:
+                os.ftruncate(fd, size)
+            self.buffer = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.capacity = size - BLOB_OFFSET - SeqlockBlob.HEADER_SIZE  # 文件原来更大的话用整个文件
+        self.buffer[:len(MAGIC)] = MAGIC
+        self.blob = SeqlockBlob(self.buffer, BLOB_OFFSET, self.capacity)
+        if self.blob.meta[0] & 1:
+            # 上一个发布进程写到一半退出了，序号改回偶数，继续递增
+            self.blob.meta[0] += 1
+        self.last_payload = None
+        client.add_listener(self.publish)
+
+    def publish(self, client: ModelPoolClient) -> None:
+        """模型列表（或者 stale 标记）有变化的时候写入共享文件，内容没变不写"""
+        response = modelpool_pb2.ModelListResponse(models=client.models, version=client.models_version)
+        payload = bytes([client.stale]) + response.SerializeToString()
+        if payload == self.last_payload:
+            return
+        if len(payload) > self.capacity:
+            logger.error(f"Model table of {len(payload)} bytes exceeds local table capacity {self.capacity}, not published")
+            return
+        self.blob.write(payload)
+        self.last_payload = payload
+        self.touch()
+
+    def touch(self) -> None:
+        HEARTBEAT.pack_into(self.buffer, len(MAGIC), time.time())
+
+    async def run(self, interval: float = 2.0, heartbeat_interval: float = 1.0) -> None:
+        """轮询 modelpool server 并发布，每 heartbeat_interval 秒更新一次心跳时间"""
+        if self.client.models:
+            self.publish(self.client)  # 本地缓存加载的列表
+        await self.client.start_polling(interval, heartbeat_interval=0)
+        logger.info(f"Publishing model table of pool [{self.client.pool or 'default'}] to {self.path}")
+        try:
+            while True:
+                self.touch()
+                await asyncio.sleep(heartbeat_interval)
+        finally:
+            await self.client.close()
+
+
+class LocalModelReader:
+    def __init__(self, path: str = DEFAULT_PATH, max_age: float = 30.0):
+        self.path = path
+        self.max_age = max_age  # 发布进程的心跳超过这么多秒没有更新，列表算 stale
+        self.buffer = None
+        self.blob = None
+        self.seq = 0
+        self.models = ()      # 最后一次解析出来的列表，读之前要 _refresh
+        self.models_version = 0
+        self.published_stale = True
+        self.ranked = {}  # 当前序号下的候选 {(model_type, model, 长上下文): ([Model, ...], [累计权重, ...])}
+
+    def _open(self) -> bool:
+        """映射发布进程的文件，文件还没有创建（发布进程还没启动）返回 False"""
+        try:
+            with open(self.path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return False
+        if buffer[:len(MAGIC)] != MAGIC or len(buffer) <= BLOB_OFFSET + SeqlockBlob.HEADER_SIZE:
+            buffer.close()
+            return False
+        self.buffer = buffer
+        self.blob = SeqlockBlob(buffer, BLOB_OFFSET, len(buffer) - BLOB_OFFSET - SeqlockBlob.HEADER_SIZE)
+        return True
+
+    def _grown(self) -> bool:
+        """发布进程用更大的 capacity 重启过：数据比映射的容量长，或者文件比映射的大"""
+        if self.blob.meta[1] > self.blob.capacity:
+            return True
+        try:
+            return os.stat(self.path).st_size > len(self.buffer)
+        except FileNotFoundError:
+            return False
+
+    def _refresh(self) -> None:
+        """序号没变什么都不做；变了就读出一致的数据重新解析"""
+        if self.blob is None and not self._open():
+            return
+        if self.blob.meta[0] == self.seq:
+            return
+        if self._grown():
+            buffer = self.buffer
+            if self._open():
+                buffer.close()  # self.blob 已经换成新的映射，旧的映射没有引用了
+        result = self.blob.read()
+        if result is None or result[0] == 0:
+            return  # 正在写或者还没写过，继续用旧的
+        seq, payload = result
+        self.seq = seq
+        try:
+            response = modelpool_pb2.ModelListResponse.FromString(payload[1:])
+        except DecodeError as e:
+            # 这个序号不再重试，发布进程下一次写入之后再读
+            logger.warning(f"Failed to parse local model table {self.path} (seq {seq}), keeping the previous one: {e}")
+            return
+        self.models, self.models_version, self.published_stale = tuple(response.models), response.version, bool(payload[0])
+        self.ranked = {}
+
+    @property
+    def version(self) -> int:
+        """服务端的模型列表版本"""
+        self._refresh()
+        return self.models_version
+
+    @property
+    def stale(self) -> bool:
+        """发布进程报告 modelpool server 不可达，或者发布进程自己停了"""
+        self._refresh()
+        if self.buffer is None:
+            return True
+        published_at, = HEARTBEAT.unpack_from(self.buffer, len(MAGIC))
+        return self.published_stale or time.time() - published_at > self.max_age
+
+    def get_all_available_models(self) -> List:
+        self._refresh()
+        return list(self.models)
+
+    def select_model(self, model_type: Optional[str] = None, model: Optional[str] = None, tokens: int = 0):
+        """从共享的列表中选择空闲的模型，没有可用的返回 None；列表没变的时候直接用上次的排名，
+        在最空闲的几个端点（TOP_CHOICES）里按权重随机选一个"""
+        self._refresh()
+        key = (model_type, model, tokens >= LONG_CONTEXT_TOKENS)
+        best = self.ranked.get(key)
+        if best is None:
+            best = self.ranked[key] = self._best(rank_models(self.models, model_type, model, tokens))
+        candidates, cum_weights = best
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        return candidates[bisect(cum_weights, random.random() * cum_weights[-1])]
+
+    @staticmethod
+    def _best(ranked):
+        """排名前 TOP_CHOICES 个里面和第一名同一档的端点和它们的累计权重"""
+        def level(m):
+            return m.load, m.max_concurrency > 0 and m.active_slots >= m.max_concurrency
+        candidates = [m for m in ranked[:TOP_CHOICES] if level(m) == level(ranked[0])]
+        return candidates, list(accumulate(m.weight or 100 for m in candidates))
+
+    def close(self) -> None:
+        if self.buffer is not None:
+            self.blob = None
+            self.buffer.close()
+            self.buffer = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the model table to a local shared-memory file")
+    parser.add_argument("--addresses", default="localhost:50051,localhost:50052", help="modelpool server 地址，逗号分隔")
+    parser.add_argument("--pool", default="", help="模型池名称，为空表示 default 池")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="共享文件路径")
+    parser.add_argument("--interval", type=float, default=2.0, help="轮询间隔（秒）")
+    parser.add_argument("--cache-file", help="本地缓存文件，发布进程重启的时候先发布缓存的列表")
+    args = parser.parse_args()
+
+    async def run():
+        # grpc.aio 的 channel 要在事件循环里创建
+        client = ModelPoolClient(args.addresses.split(","), pool=args.pool, cache_file=args.cache_file, prefer_nearby=False)
+        await LocalModelPublisher(client, args.path).run(args.interval)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -12,23 +12,64 @@ from google.protobuf.internal import builder as _builder
 _sym_db = _symbol_database.Default()
 
 
+from google.protobuf import field_mask_pb2 as google_dot_protobuf_dot_field__mask__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0fmodelpool.proto\x12\tmodelpool\"}\n\x05Model\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x12\n\nmodel_type\x18\x02 \x01(\t\x12\r\n\x05model\x18\x03 \x01(\t\x12\x10\n\x08\x62\x61se_url\x18\x04 \x01(\t\x12\x0e\n\x06status\x18\x05 \x01(\t\x12\x0c\n\x04load\x18\x06 \x01(\x05\x12\x13\n\x0busage_count\x18\x07 \x01(\x05\"-\n\nModelUsage\x12\x10\n\x08\x62\x61se_url\x18\x01 \x01(\t\x12\r\n\x05model\x18\x02 \x01(\t\"X\n\x16\x41vailableModelsRequest\x12+\n\x0cmodel_usages\x18\x01 \x03(\x0b\x32\x15.modelpool.ModelUsage\x12\x11\n\tclient_id\x18\x02 \x01(\t\"5\n\x11ModelListResponse\x12 \n\x06models\x18\x01 \x03(\x0b\x32\x10.modelpool.Model2\xbe\x01\n\x10ModelPoolService\x12Q\n\x0cGetModelList\x12!.modelpool.AvailableModelsRequest\x1a\x1c.modelpool.ModelListResponse\"\x00\x12W\n\x12GetAvailableModels\x12!.modelpool.AvailableModelsRequest\x1a\x1c.modelpool.ModelListResponse\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0fmodelpool.proto\x12\tmodelpool\x1a google/protobuf/field_mask.proto\"\xd0\x03\n\x05Model\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x12\n\nmodel_type\x18\x02 \x01(\t\x12\r\n\x05model\x18\x03 \x01(\t\x12\x10\n\x08\x62\x61se_url\x18\x04 \x01(\t\x12\x0e\n\x06status\x18\x05 \x01(\t\x12\x0c\n\x04load\x18\x06 \x01(\x05\x12\x13\n\x0busage_count\x18\x07 \x01(\x05\x12\x10\n\x08inflight\x18\x08 \x01(\x05\x12\x17\n\x0fmax_concurrency\x18\t \x01(\x05\x12\x14\n\x0c\x61\x63tive_slots\x18\n \x01(\x05\x12+\n\x0bstatus_code\x18\x0b \x01(\x0e\x32\x16.modelpool.ModelStatus\x12\x0e\n\x06weight\x18\x0c \x01(\x05\x12\x16\n\x0etokens_per_sec\x18\r \x01(\x02\x12\x1f\n\x17\x63\x61pacity_tokens_per_sec\x18\x0e \x01(\x02\x12\x1f\n\x17headroom_tokens_per_sec\x18\x0f \x01(\x02\x12\x19\n\x11\x63\x61pacity_measured\x18\x10 \x01(\x08\x12\x0c\n\x04tier\x18\x11 \x01(\x05\x12\x0c\n\x04zone\x18\x12 \x01(\t\x12\x10\n\x08\x64raining\x18\x13 \x01(\x08\x12\x16\n\x0etraffic_weight\x18\x14 \x01(\x05\x12\x18\n\x10interactive_only\x18\x15 \x01(\x08\"-\n\nModelUsage\x12\x10\n\x08\x62\x61se_url\x18\x01 \x01(\t\x12\r\n\x05model\x18\x02 \x01(\t\"\xba\x01\n\nAgentUsage\x12\x10\n\x08\x61gent_id\x18\x01 \x01(\t\x12+\n\x0cmodel_usages\x18\x02 \x03(\x0b\x32\x15.modelpool.ModelUsage\x12+\n\x0c\x61\x64\x64\x65\x64_usages\x18\x03 \x03(\x0b\x32\x15.modelpool.ModelUsage\x12-\n\x0eremoved_usages\x18\x04 \x03(\x0b\x32\x15.modelpool.ModelUsage\x12\x11\n\tfull_sync\x18\x05 \x01(\x08\"\x90\x03\n\x16\x41vailableModelsRequest\x12+\n\x0cmodel_usages\x18\x01 \x03(\x0b\x32\x15.modelpool.ModelUsage\x12\x11\n\tclient_id\x18\x02 \x01(\t\x12+\n\x0c\x61gent_usages\x18\x03 \x03(\x0b\x32\x15.modelpool.AgentUsage\x12+\n\x0c\x61\x64\x64\x65\x64_usages\x18\x04 \x03(\x0b\x32\x15.modelpool.ModelUsage\x12-\n\x0eremoved_usages\x18\x05 \x03(\x0b\x32\x15.modelpool.ModelUsage\x12\x11\n\tfull_sync\x18\x06 \x01(\x08\x12\x11\n\tusage_seq\x18\x07 \x01(\x04\x12\x13\n\x0bmodel_types\x18\x08 \x03(\t\x12\r\n\x05names\x18\t \x03(\t\x12.\n\nfield_mask\x18\n \x01(\x0b\x32\x1a.google.protobuf.FieldMask\x12\x0c\n\x04pool\x18\x0b \x01(\t\x12%\n\x08priority\x18\x0c \x01(\x0e\x32\x13.modelpool.Priority\"_\n\x11ModelListResponse\x12 \n\x06models\x18\x01 \x03(\x0b\x32\x10.modelpool.Model\x12\x17\n\x0fresync_required\x18\x02 \x01(\x08\x12\x0f\n\x07version\x18\x03 \x01(\x04\"?\n\rInflightCount\x12\x10\n\x08\x62\x61se_url\x18\x01 \x01(\t\x12\r\n\x05model\x18\x02 \x01(\t\x12\r\n\x05\x63ount\x18\x03 \x01(\x05\"q\n\nTokenCount\x12\x10\n\x08\x62\x61se_url\x18\x01 \x01(\t\x12\r\n\x05model\x18\x02 \x01(\t\x12\x15\n\rprompt_tokens\x18\x03 \x01(\x03\x12\x19\n\x11\x63ompletion_tokens\x18\x04 \x01(\x03\x12\x10\n\x08requests\x18\x05 \x01(\x05\"\x80\x01\n\nLoadReport\x12\x11\n\tclient_id\x18\x01 \x01(\t\x12*\n\x08inflight\x18\x02 \x03(\x0b\x32\x18.modelpool.InflightCount\x12\x0c\n\x04pool\x18\x03 \x01(\t\x12%\n\x06tokens\x18\x04 \x03(\x0b\x32\x15.modelpool.TokenCount\"2\n\rLoadReportAck\x12\x10\n\x08\x61\x63\x63\x65pted\x18\x01 \x01(\x08\x12\x0f\n\x07version\x18\x02 \x01(\x04\"\xa8\x01\n\x12\x41\x63quireSlotRequest\x12\x11\n\tclient_id\x18\x01 \x01(\t\x12\x12\n\nmodel_type\x18\x02 \x01(\t\x12\r\n\x05model\x18\x03 \x01(\t\x12\x10\n\x08\x62\x61se_url\x18\x04 \x01(\t\x12\x15\n\rlease_seconds\x18\x05 \x01(\x05\x12\x0c\n\x04pool\x18\x06 \x01(\t\x12%\n\x08priority\x18\x07 \x01(\x0e\x32\x13.modelpool.Priority\"p\n\x13\x41\x63quireSlotResponse\x12\x0f\n\x07granted\x18\x01 \x01(\x08\x12\x0f\n\x07slot_id\x18\x02 \x01(\t\x12\x1f\n\x05model\x18\x03 \x01(\x0b\x32\x10.modelpool.Model\x12\x16\n\x0eretry_after_ms\x18\x04 \x01(\x05\"g\n\x12ReleaseSlotRequest\x12\x11\n\tclient_id\x18\x01 \x01(\t\x12\x0f\n\x07slot_id\x18\x02 \x01(\t\x12\x10\n\x08\x62\x61se_url\x18\x03 \x01(\t\x12\r\n\x05model\x18\x04 \x01(\t\x12\x0c\n\x04pool\x18\x05 \x01(\t\"\'\n\x13ReleaseSlotResponse\x12\x10\n\x08released\x18\x01 \x01(\x08\"U\n\x13ModelHistoryRequest\x12\r\n\x05names\x18\x01 \x03(\t\x12\x12\n\nmax_points\x18\x02 \x01(\x05\x12\r\n\x05since\x18\x03 \x01(\x01\x12\x0c\n\x04pool\x18\x04 \x01(\t\"\xfb\x01\n\x0cModelHistory\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x10\n\x08\x62\x61se_url\x18\x02 \x01(\t\x12\r\n\x05model\x18\x03 \x01(\t\x12\x12\n\ntimestamps\x18\x04 \x03(\x01\x12\x14\n\x0c\x61vailability\x18\x05 \x03(\x02\x12\x12\n\nlatency_ms\x18\x06 \x03(\x02\x12\x16\n\x0emax_latency_ms\x18\x07 \x03(\x02\x12\x0c\n\x04load\x18\x08 \x03(\x02\x12\x0f\n\x07samples\x18\t \x03(\x05\x12\r\n\x05\x66lips\x18\n \x03(\x05\x12 \n\x18latency_slope_ms_per_min\x18\x0b \x01(\x02\x12\x16\n\x0elatency_rising\x18\x0c \x01(\x08\"B\n\x14ModelHistoryResponse\x12*\n\thistories\x18\x01 \x03(\x0b\x32\x17.modelpool.ModelHistory\"h\n\x15\x45ndpointFailureReport\x12\x11\n\tclient_id\x18\x01 \x01(\t\x12\x0c\n\x04pool\x18\x02 \x01(\t\x12\x10\n\x08\x62\x61se_url\x18\x03 \x01(\t\x12\r\n\x05model\x18\x04 \x01(\t\x12\r\n\x05\x65rror\x18\x05 \x01(\t\"G\n\x12\x45ndpointFailureAck\x12\x10\n\x08reprobed\x18\x01 \x01(\x08\x12\x1f\n\x05model\x18\x02 \x01(\x0b\x32\x10.modelpool.Model\"\x9e\x01\n\x14\x45ndpointStateRequest\x12\x0c\n\x04pool\x18\x01 \x01(\t\x12\r\n\x05names\x18\x02 \x03(\t\x12\x10\n\x08\x62\x61se_url\x18\x03 \x01(\t\x12\x15\n\x08\x64raining\x18\x04 \x01(\x08H\x00\x88\x01\x01\x12\x13\n\x06weight\x18\x05 \x01(\x05H\x01\x88\x01\x01\x12\x13\n\x0b\x61\x64min_token\x18\x06 \x01(\tB\x0b\n\t_drainingB\t\n\x07_weight\"J\n\x15\x45ndpointStateResponse\x12 \n\x06models\x18\x01 \x03(\x0b\x32\x10.modelpool.Model\x12\x0f\n\x07version\x18\x02 \x01(\x04\"\xaf\x01\n\x13PickEndpointRequest\x12\x11\n\tclient_id\x18\x01 \x01(\t\x12\x0c\n\x04pool\x18\x02 \x01(\t\x12\x12\n\nmodel_type\x18\x03 \x01(\t\x12\r\n\x05model\x18\x04 \x01(\t\x12\r\n\x05\x63ount\x18\x05 \x01(\x05\x12\x10\n\x08lease_ms\x18\x06 \x01(\x05\x12%\n\x08priority\x18\x07 \x01(\x0e\x32\x13.modelpool.Priority\x12\x0c\n\x04zone\x18\x08 \x01(\t\"s\n\x14PickEndpointResponse\x12 \n\x06models\x18\x01 \x03(\x0b\x32\x10.modelpool.Model\x12\x10\n\x08lease_ms\x18\x02 \x01(\x05\x12\x0f\n\x07version\x18\x03 \x01(\x04\x12\x16\n\x0eretry_after_ms\x18\x04 \x01(\x05*O\n\x0bModelStatus\x12\x12\n\x0eSTATUS_UNKNOWN\x10\x00\x12\x14\n\x10STATUS_AVAILABLE\x10\x01\x12\x16\n\x12STATUS_UNAVAILABLE\x10\x02*8\n\x08Priority\x12\x18\n\x14PRIORITY_INTERACTIVE\x10\x00\x12\x12\n\x0ePRIORITY_BATCH\x10\x01\x32\xfd\x05\n\x10ModelPoolService\x12Q\n\x0cGetModelList\x12!.modelpool.AvailableModelsRequest\x1a\x1c.modelpool.ModelListResponse\"\x00\x12W\n\x12GetAvailableModels\x12!.modelpool.AvailableModelsRequest\x1a\x1c.modelpool.ModelListResponse\"\x00\x12?\n\nReportLoad\x12\x15.modelpool.LoadReport\x1a\x18.modelpool.LoadReportAck\"\x00\x12N\n\x0b\x41\x63quireSlot\x12\x1d.modelpool.AcquireSlotRequest\x1a\x1e.modelpool.AcquireSlotResponse\"\x00\x12N\n\x0bReleaseSlot\x12\x1d.modelpool.ReleaseSlotRequest\x1a\x1e.modelpool.ReleaseSlotResponse\"\x00\x12T\n\x0fGetModelHistory\x12\x1e.modelpool.ModelHistoryRequest\x1a\x1f.modelpool.ModelHistoryResponse\"\x00\x12Z\n\x15ReportEndpointFailure\x12 .modelpool.EndpointFailureReport\x1a\x1d.modelpool.EndpointFailureAck\"\x00\x12W\n\x10SetEndpointState\x12\x1f.modelpool.EndpointStateRequest\x1a .modelpool.EndpointStateResponse\"\x00\x12Q\n\x0cPickEndpoint\x12\x1e.modelpool.PickEndpointRequest\x1a\x1f.modelpool.PickEndpointResponse\"\x00\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'modelpool_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_MODEL']._serialized_start=30
-  _globals['_MODEL']._serialized_end=155
-  _globals['_MODELUSAGE']._serialized_start=157
-  _globals['_MODELUSAGE']._serialized_end=202
-  _globals['_AVAILABLEMODELSREQUEST']._serialized_start=204
-  _globals['_AVAILABLEMODELSREQUEST']._serialized_end=292
-  _globals['_MODELLISTRESPONSE']._serialized_start=294
-  _globals['_MODELLISTRESPONSE']._serialized_end=347
-  _globals['_MODELPOOLSERVICE']._serialized_start=350
-  _globals['_MODELPOOLSERVICE']._serialized_end=540
+  _globals['_MODELSTATUS']._serialized_start=3181
+  _globals['_MODELSTATUS']._serialized_end=3260
+  _globals['_PRIORITY']._serialized_start=3262
+  _globals['_PRIORITY']._serialized_end=3318
+  _globals['_MODEL']._serialized_start=65
+  _globals['_MODEL']._serialized_end=529
+  _globals['_MODELUSAGE']._serialized_start=531
+  _globals['_MODELUSAGE']._serialized_end=576
+  _globals['_AGENTUSAGE']._serialized_start=579
+  _globals['_AGENTUSAGE']._serialized_end=765
+  _globals['_AVAILABLEMODELSREQUEST']._serialized_start=768
+  _globals['_AVAILABLEMODELSREQUEST']._serialized_end=1168
+  _globals['_MODELLISTRESPONSE']._serialized_start=1170
+  _globals['_MODELLISTRESPONSE']._serialized_end=1265
+  _globals['_INFLIGHTCOUNT']._serialized_start=1267
+  _globals['_INFLIGHTCOUNT']._serialized_end=1330
+  _globals['_TOKENCOUNT']._serialized_start=1332
+  _globals['_TOKENCOUNT']._serialized_end=1445
+  _globals['_LOADREPORT']._serialized_start=1448
+  _globals['_LOADREPORT']._serialized_end=1576
+  _globals['_LOADREPORTACK']._serialized_start=1578
+  _globals['_LOADREPORTACK']._serialized_end=1628
+  _globals['_ACQUIRESLOTREQUEST']._serialized_start=1631
+  _globals['_ACQUIRESLOTREQUEST']._serialized_end=1799
+  _globals['_ACQUIRESLOTRESPONSE']._serialized_start=1801
+  _globals['_ACQUIRESLOTRESPONSE']._serialized_end=1913
+  _globals['_RELEASESLOTREQUEST']._serialized_start=1915
+  _globals['_RELEASESLOTREQUEST']._serialized_end=2018
+  _globals['_RELEASESLOTRESPONSE']._serialized_start=2020
+  _globals['_RELEASESLOTRESPONSE']._serialized_end=2059
+  _globals['_MODELHISTORYREQUEST']._serialized_start=2061
+  _globals['_MODELHISTORYREQUEST']._serialized_end=2146
+  _globals['_MODELHISTORY']._serialized_start=2149
+  _globals['_MODELHISTORY']._serialized_end=2400
+  _globals['_MODELHISTORYRESPONSE']._serialized_start=2402
+  _globals['_MODELHISTORYRESPONSE']._serialized_end=2468
+  _globals['_ENDPOINTFAILUREREPORT']._serialized_start=2470
+  _globals['_ENDPOINTFAILUREREPORT']._serialized_end=2574
+  _globals['_ENDPOINTFAILUREACK']._serialized_start=2576
+  _globals['_ENDPOINTFAILUREACK']._serialized_end=2647
+  _globals['_ENDPOINTSTATEREQUEST']._serialized_start=2650
+  _globals['_ENDPOINTSTATEREQUEST']._serialized_end=2808
+  _globals['_ENDPOINTSTATERESPONSE']._serialized_start=2810
+  _globals['_ENDPOINTSTATERESPONSE']._serialized_end=2884
+  _globals['_PICKENDPOINTREQUEST']._serialized_start=2887
+  _globals['_PICKENDPOINTREQUEST']._serialized_end=3062
+  _globals['_PICKENDPOINTRESPONSE']._serialized_start=3064
+  _globals['_PICKENDPOINTRESPONSE']._serialized_end=3179
+  _globals['_MODELPOOLSERVICE']._serialized_start=3321
+  _globals['_MODELPOOLSERVICE']._serialized_end=4086
 # @@protoc_insertion_point(module_scope)
@@ -50,6 +50,41 @@ class ModelPoolServiceStub(object):
                 request_serializer=modelpool__pb2.AvailableModelsRequest.SerializeToString,
                 response_deserializer=modelpool__pb2.ModelListResponse.FromString,
                 _registered_method=True)
+        self.ReportLoad = channel.unary_unary(
+                '/modelpool.ModelPoolService/ReportLoad',
+                request_serializer=modelpool__pb2.LoadReport.SerializeToString,
+                response_deserializer=modelpool__pb2.LoadReportAck.FromString,
+                _registered_method=True)
+        self.AcquireSlot = channel.unary_unary(
+                '/modelpool.ModelPoolService/AcquireSlot',
+                request_serializer=modelpool__pb2.AcquireSlotRequest.SerializeToString,
+                response_deserializer=modelpool__pb2.AcquireSlotResponse.FromString,
+                _registered_method=True)
+        self.ReleaseSlot = channel.unary_unary(
+                '/modelpool.ModelPoolService/ReleaseSlot',
+                request_serializer=modelpool__pb2.ReleaseSlotRequest.SerializeToString,
+                response_deserializer=modelpool__pb2.ReleaseSlotResponse.FromString,
+                _registered_method=True)
+        self.GetModelHistory = channel.unary_unary(
+                '/modelpool.ModelPoolService/GetModelHistory',
+                request_serializer=modelpool__pb2.ModelHistoryRequest.SerializeToString,
+                response_deserializer=modelpool__pb2.ModelHistoryResponse.FromString,
+                _registered_method=True)
+        self.ReportEndpointFailure = channel.unary_unary(
+                '/modelpool.ModelPoolService/ReportEndpointFailure',
+                request_serializer=modelpool__pb2.EndpointFailureReport.SerializeToString,
+                response_deserializer=modelpool__pb2.EndpointFailureAck.FromString,
+                _registered_method=True)
+        self.SetEndpointState = channel.unary_unary(
+                '/modelpool.ModelPoolService/SetEndpointState',
+                request_serializer=modelpool__pb2.EndpointStateRequest.SerializeToString,
+                response_deserializer=modelpool__pb2.EndpointStateResponse.FromString,
+                _registered_method=True)
+        self.PickEndpoint = channel.unary_unary(
+                '/modelpool.ModelPoolService/PickEndpoint',
+                request_serializer=modelpool__pb2.PickEndpointRequest.SerializeToString,
+                response_deserializer=modelpool__pb2.PickEndpointResponse.FromString,
+                _registered_method=True)
 
 
 class ModelPoolServiceServicer(object):
@@ -70,6 +105,54 @@ class ModelPoolServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def ReportLoad(self, request, context):
+        """心跳：上报在途请求数
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AcquireSlot(self, request, context):
+        """申请/释放端点的并发槽位（准入控制）
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReleaseSlot(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetModelHistory(self, request, context):
+        """查询端点的探测历史（降采样）和耗时趋势
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReportEndpointFailure(self, request, context):
+        """上报端点调用失败，触发立即重新探测
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SetEndpointState(self, request, context):
+        """管理接口：摘流量、调整流量权重
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def PickEndpoint(self, request, context):
+        """服务端分配端点（可以一次预取多个）
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ModelPoolServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -83,6 +166,41 @@ def add_ModelPoolServiceServicer_to_server(servicer, server):
                     request_deserializer=modelpool__pb2.AvailableModelsRequest.FromString,
                     response_serializer=modelpool__pb2.ModelListResponse.SerializeToString,
             ),
+            'ReportLoad': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReportLoad,
+                    request_deserializer=modelpool__pb2.LoadReport.FromString,
+                    response_serializer=modelpool__pb2.LoadReportAck.SerializeToString,
+            ),
+            'AcquireSlot': grpc.unary_unary_rpc_method_handler(
+                    servicer.AcquireSlot,
+                    request_deserializer=modelpool__pb2.AcquireSlotRequest.FromString,
+                    response_serializer=modelpool__pb2.AcquireSlotResponse.SerializeToString,
+            ),
+            'ReleaseSlot': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReleaseSlot,
+                    request_deserializer=modelpool__pb2.ReleaseSlotRequest.FromString,
+                    response_serializer=modelpool__pb2.ReleaseSlotResponse.SerializeToString,
+            ),
+            'GetModelHistory': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetModelHistory,
+                    request_deserializer=modelpool__pb2.ModelHistoryRequest.FromString,
+                    response_serializer=modelpool__pb2.ModelHistoryResponse.SerializeToString,
+            ),
+            'ReportEndpointFailure': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReportEndpointFailure,
+                    request_deserializer=modelpool__pb2.EndpointFailureReport.FromString,
+                    response_serializer=modelpool__pb2.EndpointFailureAck.SerializeToString,
+            ),
+            'SetEndpointState': grpc.unary_unary_rpc_method_handler(
+                    servicer.SetEndpointState,
+                    request_deserializer=modelpool__pb2.EndpointStateRequest.FromString,
+                    response_serializer=modelpool__pb2.EndpointStateResponse.SerializeToString,
+            ),
+            'PickEndpoint': grpc.unary_unary_rpc_method_handler(
+                    servicer.PickEndpoint,
+                    request_deserializer=modelpool__pb2.PickEndpointRequest.FromString,
+                    response_serializer=modelpool__pb2.PickEndpointResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'modelpool.ModelPoolService', rpc_method_handlers)
@@ -147,3 +265,192 @@ class ModelPoolService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def ReportLoad(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/modelpool.ModelPoolService/ReportLoad',
+            modelpool__pb2.LoadReport.SerializeToString,
+            modelpool__pb2.LoadReportAck.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def AcquireSlot(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/modelpool.ModelPoolService/AcquireSlot',
+            modelpool__pb2.AcquireSlotRequest.SerializeToString,
+            modelpool__pb2.AcquireSlotResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReleaseSlot(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/modelpool.ModelPoolService/ReleaseSlot',
+            modelpool__pb2.ReleaseSlotRequest.SerializeToString,
+            modelpool__pb2.ReleaseSlotResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetModelHistory(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/modelpool.ModelPoolService/GetModelHistory',
+            modelpool__pb2.ModelHistoryRequest.SerializeToString,
+            modelpool__pb2.ModelHistoryResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReportEndpointFailure(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/modelpool.ModelPoolService/ReportEndpointFailure',
+            modelpool__pb2.EndpointFailureReport.SerializeToString,
+            modelpool__pb2.EndpointFailureAck.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SetEndpointState(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/modelpool.ModelPoolService/SetEndpointState',
+            modelpool__pb2.EndpointStateRequest.SerializeToString,
+            modelpool__pb2.EndpointStateResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def PickEndpoint(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/modelpool.ModelPoolService/PickEndpoint',
+            modelpool__pb2.PickEndpointRequest.SerializeToString,
+            modelpool__pb2.PickEndpointResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
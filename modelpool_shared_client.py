@@ -0,0 +1,227 @@
+import asyncio
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+from loguru import logger
+
+import modelpool_pb2
+from modelpool_client import ModelPoolClient
+
+#--------------------------------------------------------------------------
+# 进程内共享的模型服务池客户端
+# 说明：原来每个 agent 都创建自己的 ModelPoolClient，每个都会对所有 modelpool server
+# 建立 channel，有自己的 client_id，自己跑一个 poll_status 任务。一个进程里面跑 500 个
+# agent 就有 1000 个 channel，每 10 秒发 500 个一模一样的轮询请求。
+#    SharedModelPoolClient 是进程级别共享的：对每个 server 只有一个 channel，只有一个
+# 轮询任务。agent 通过 register_agent 拿到一个轻量的 AgentModelPoolHandle，各自登记
+# 使用的模型，由共享客户端在一次请求里面批量上报（agent_usages），读取的都是共享的
+# 模型列表缓存。这样连接数和 RPC 数量只和进程数有关，和 agent 数量无关。
+#    注意：grpc.aio 的 channel 绑定在创建它的事件循环上，所以“进程共享”指的是同一个
+# 事件循环里面的 agent 共享。
+#--------------------------------------------------------------------------
+class SharedModelPoolClient(ModelPoolClient):
+    _instances: Dict[tuple, "SharedModelPoolClient"] = {}  # 以 (地址列表, 池名称, 优先级) 为 key 的进程内单例
+
+    def __init__(self, addresses: list[str] = ["localhost:50051", "localhost:50052"], **kwargs):
+        super().__init__(addresses, **kwargs)
+        #--------------------------------------------------------------------------
+        # 每个 agent 使用的模型服务器信息 {agent_id: set([(base_url, model), ...])}
+        #--------------------------------------------------------------------------
+        self.agent_usages: Dict[str, set] = {}
+
+        #--------------------------------------------------------------------------
+        # 每个 agent 待上报的增量，新注册的 agent 第一次做全量，注销的 agent 上报一个空的全量
+        #--------------------------------------------------------------------------
+        self.agent_added: Dict[str, set] = defaultdict(set)
+        self.agent_removed: Dict[str, set] = defaultdict(set)
+        self.new_agents: set = set()
+        self.unregistered_agents: set = set()
+
+    # 获取进程内共享的客户端实例，相同的地址列表只会创建一个
+    @classmethod
+    def get_instance(cls, addresses: list[str] = ["localhost:50051", "localhost:50052"], **kwargs) -> "SharedModelPoolClient":
+        """kwargs 只在第一次创建的时候生效"""
+        key = (tuple(addresses), kwargs.get("pool", ""), kwargs.get("priority", "interactive"))
+        instance = cls._instances.get(key)
+        if instance is None:
+            instance = cls(addresses=list(addresses), **kwargs)
+            cls._instances[key] = instance
+            logger.info(f"Created shared model pool client {instance.client_id} for {addresses}")
+        return instance
+
+    #--------------------------------------------------------------------------
+    # agent 注册和注销
+    #--------------------------------------------------------------------------
+    def register_agent(self, agent_id: Optional[str] = None) -> "AgentModelPoolHandle":
+        """注册一个 agent，返回该 agent 使用的句柄"""
+        agent_id = agent_id or str(uuid.uuid4())
+        if agent_id not in self.agent_usages:
+            self.agent_usages[agent_id] = set()
+            self.new_agents.add(agent_id)
+            self.unregistered_agents.discard(agent_id)
+        logger.info(f"Agent {agent_id} registered on shared client {self.client_id}, total agents: {len(self.agent_usages)}")
+        return AgentModelPoolHandle(self, agent_id)
+
+    def unregister_agent(self, agent_id: str) -> None:
+        """注销 agent，下次上报时通知服务端删除它的使用信息"""
+        if self.agent_usages.pop(agent_id, None) is not None:
+            self.agent_added.pop(agent_id, None)
+            self.agent_removed.pop(agent_id, None)
+            self.new_agents.discard(agent_id)
+            self.unregistered_agents.add(agent_id)
+            logger.info(f"Agent {agent_id} unregistered from shared client {self.client_id}, total agents: {len(self.agent_usages)}")
+
+    def add_agent_model_usage(self, agent_id: str, base_url: str, model: str) -> None:
+        """添加某个 agent 使用的模型信息"""
+        if agent_id not in self.agent_usages:
+            self.register_agent(agent_id)
+        usages = self.agent_usages[agent_id]
+        model_usage = (base_url, model)
+        if model_usage not in usages:
+            usages.add(model_usage)
+            self.agent_added[agent_id].add(model_usage)
+            self.agent_removed[agent_id].discard(model_usage)
+            logger.info(f"Added model usage for agent {agent_id}: base_url={base_url}, model={model}")
+
+    def remove_agent_model_usage(self, agent_id: str, base_url: str, model: str) -> None:
+        """删除某个 agent 使用的模型信息"""
+        usages = self.agent_usages.get(agent_id)
+        model_usage = (base_url, model)
+        if usages is not None and model_usage in usages:
+            usages.discard(model_usage)
+            self.agent_removed[agent_id].add(model_usage)
+            self.agent_added[agent_id].discard(model_usage)
+            logger.info(f"Removed model usage for agent {agent_id}: base_url={base_url}, model={model}")
+
+    #--------------------------------------------------------------------------
+    # 一次请求批量上报所有 agent 的使用信息
+    #--------------------------------------------------------------------------
+    @staticmethod
+    def _to_usages(usages):
+        return [modelpool_pb2.ModelUsage(base_url=base_url, model=model) for base_url, model in usages]
+
+    def _build_models_request(self):
+        request = super()._build_models_request()
+        if request.full_sync:
+            # 全量：所有 agent 都带上，服务端会删除没有带上来的 agent
+            for agent_id, usages in self.agent_usages.items():
+                request.agent_usages.add(agent_id=agent_id, full_sync=True, model_usages=self._to_usages(usages))
+        else:
+            for agent_id in self.new_agents:
+                request.agent_usages.add(agent_id=agent_id, full_sync=True,
+                                         model_usages=self._to_usages(self.agent_usages[agent_id]))
+            for agent_id in set(self.agent_added) | set(self.agent_removed):
+                if agent_id in self.new_agents:
+                    continue
+                added = self.agent_added.get(agent_id, ())
+                removed = self.agent_removed.get(agent_id, ())
+                if added or removed:
+                    request.agent_usages.add(agent_id=agent_id,
+                                             added_usages=self._to_usages(added),
+                                             removed_usages=self._to_usages(removed))
+            # 注销的 agent：空的全量
+            for agent_id in self.unregistered_agents:
+                request.agent_usages.add(agent_id=agent_id, full_sync=True)
+        self.agent_added.clear()
+        self.agent_removed.clear()
+        self.new_agents.clear()
+        self.unregistered_agents.clear()
+        return request
+
+    async def close(self):
+        """关闭共享客户端，并从进程内单例表中移除；还有没上报的注销先上报，服务端马上删除这些 agent 的使用信息"""
+        key = (tuple(self.addresses), self.pool, self.priority)
+        if self._instances.get(key) is self:
+            del self._instances[key]
+        if self.unregistered_agents:
+            try:
+                await self.get_available_models()
+            except Exception as e:
+                logger.warning(f"Failed to report unregistered agents before closing: {e}")
+        await super().close()
+
+
+#--------------------------------------------------------------------------
+# agent 使用的句柄，接口和 ModelPoolClient 保持一致，读的是共享客户端的缓存
+#--------------------------------------------------------------------------
+class AgentModelPoolHandle:
+    def __init__(self, shared: SharedModelPoolClient, agent_id: str):
+        self.shared = shared
+        self.agent_id = agent_id
+
+    @property
+    def client_id(self) -> str:
+        return f"{self.shared.client_id}/{self.agent_id}"
+
+    @property
+    def stale(self) -> bool:
+        """共享缓存是否过期（modelpool server 不可达，处于降级模式）"""
+        return self.shared.stale
+
+    # 获取当前缓存下来的所有可用的模型的信息（共享缓存）
+    def get_all_available_models(self) -> List:
+        return self.shared.get_all_available_models()
+
+    def add_model_usage(self, base_url: str, model: str):
+        """添加本 agent 使用的模型信息"""
+        self.shared.add_agent_model_usage(self.agent_id, base_url, model)
+
+    def remove_model_usage(self, base_url: str, model: str):
+        """删除本 agent 使用的模型信息"""
+        self.shared.remove_agent_model_usage(self.agent_id, base_url, model)
+
+    def select_model(self, model_type: Optional[str] = None, model: Optional[str] = None, tokens: int = 0):
+        """从共享缓存中选择最空闲的模型"""
+        return self.shared.select_model(model_type, model, tokens)
+
+    async def chat_completion(self, messages, model_type: Optional[str] = None, model: Optional[str] = None, **kwargs):
+        """在模型池上执行 chat completion，失败自动换端点重试，见 ModelPoolClient.chat_completion"""
+        return await self.shared.chat_completion(messages, model_type, model, **kwargs)
+
+    def track_request(self, base_url: str, model: str):
+        """在途请求计数，整个进程汇总后由共享客户端的心跳上报"""
+        return self.shared.track_request(base_url, model)
+
+    def record_tokens(self, base_url: str, model: str, prompt_tokens: int, completion_tokens: int):
+        """记录完成的请求消耗的 token 数，整个进程汇总后由共享客户端的心跳上报"""
+        self.shared.record_tokens(base_url, model, prompt_tokens, completion_tokens)
+
+    def slot(self, model_type: Optional[str] = None, model: Optional[str] = None,
+             base_url: Optional[str] = None, wait_timeout: float = 30.0, lease_seconds: int = 0):
+        """申请并发槽位，见 ModelPoolClient.slot"""
+        return self.shared.slot(model_type, model, base_url, wait_timeout, lease_seconds)
+
+    async def get_available_models(self):
+        """立即刷新共享缓存并返回"""
+        return await self.shared.get_available_models()
+
+    async def start_polling(self, interval: int = 10, heartbeat_interval: float = 1.0) -> None:
+        """共享客户端只会启动一个轮询任务"""
+        await self.shared.start_polling(interval, heartbeat_interval)
+
+    async def close(self):
+        """注销本 agent，最后一个 agent 退出的时候关闭共享客户端"""
+        self.shared.unregister_agent(self.agent_id)
+        if not self.shared.agent_usages:
+            await self.shared.close()
+
+
+# 测试代码
+async def main():
+    my_addresses = ["localhost:50051", "172.21.30.231:50052"]
+    shared = SharedModelPoolClient.get_instance(my_addresses)
+    agents = [shared.register_agent(f"agent-{i}") for i in range(3)]
+    agents[0].add_model_usage("http://172.21.30.231:8987/v1", "/models/DeepSeek-R1-Distill-Qwen-32B")
+    agents[1].add_model_usage("http://172.21.30.230:8985/v1", "/models/DeepSeek-R1-Distill-Qwen-32B")
+    agents[2].add_model_usage("http://172.21.30.230:8985/v1", "/models/DeepSeek-R1-Distill-Qwen-32B")
+    for agent in agents:
+        await agent.start_polling()  # 只会启动一个轮询任务
+    try:
+        await asyncio.Future()
+    except KeyboardInterrupt:
+        logger.info("Received shutdown signal, closing agents...")
+        for agent in agents:
+            await agent.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,217 @@
+import mmap
+import multiprocessing
+import struct
+
+from modelpool_history import ProbeHistory, seqlock_backoff
+
+#--------------------------------------------------------------------------
+# 多进程共享的模型状态表
+# 说明：多 worker 模式下所有 worker 进程用 SO_REUSEPORT 监听同一个端口，只有 0 号
+# worker 做健康检查。fork 之前在父进程里面创建一块匿名共享内存（mmap），分成四部分：
+#   1：模型状态（每个池的版本号、每个模型的 status / load / recovered_at），0 号 worker
+#      每个探测周期写一次，其他 worker 定时读；
+#   2：使用信息，每个 worker 一行，每个模型 4 个 int32（usage_count, inflight, tokens/sec, 未到期的分配数），
+#      每个 worker 只写自己那一行，读的时候把其他 worker 的行加起来；
+#   3：每个模型已分配的槽位数，所有 worker 共用一个计数，用跨进程的锁保护，
+#      保证 max_concurrency 是整个服务的上限而不是每个 worker 的上限；
+#   4：每个模型的探测历史（ProbeHistory 的环形缓冲区），任何 worker 都能直接查询；
+#   5：管理员设置的端点状态（draining、流量权重），SetEndpointState 落到哪个 worker 就由
+#      哪个 worker 写，写的时候加跨进程的锁，所有 worker 定时读；
+#   6：转发的槽位释放，每个 worker 一个队列：槽位记在分配它的 worker 进程里，客户端重连之后
+#      ReleaseSlot 可能落到其他 worker，由它把 slot_id 放进分配它的 worker 的队列，那个 worker
+#      同步的时候取出来释放，和槽位计数用同一把跨进程的锁。
+#    除了槽位计数、管理员设置和转发的释放，每块区域都只有一个进程写，不需要跨进程的锁：写的时候序号先变成
+# 奇数，写完变成偶数，读的一方发现序号是奇数或者读的过程中变了就重读（seqlock）。
+#--------------------------------------------------------------------------
+class SeqlockBlob:
+    """共享内存中的一段变长数据：[序号 u64][长度 u64][数据]，单写多读"""
+    HEADER_SIZE = 16
+
+    def __init__(self, buffer, offset: int, capacity: int):
+        view = memoryview(buffer)[offset:offset + self.HEADER_SIZE + capacity]
+        self.meta = view[:self.HEADER_SIZE].cast('Q')
+        self.data = view[self.HEADER_SIZE:]
+        self.capacity = capacity
+
+    def write(self, payload: bytes) -> None:
+        if len(payload) > self.capacity:
+            raise ValueError(f"payload of {len(payload)} bytes exceeds capacity {self.capacity}")
+        seq = self.meta[0]
+        self.meta[0] = seq + 1  # 奇数：正在写
+        self.data[:len(payload)] = payload
+        self.meta[1] = len(payload)
+        self.meta[0] = seq + 2
+
+    def read(self, retries: int = 50):
+        """返回 (序号, 数据)，序号为 0 表示还没有写过；一直读不到一致的数据返回 None（最多等 retries 毫秒左右）"""
+        for attempt in range(retries):
+            seq = self.meta[0]
+            if not seq & 1:
+                length = min(self.meta[1], self.capacity)
+                payload = bytes(self.data[:length])
+                if self.meta[0] == seq:
+                    return seq, payload
+            seqlock_backoff(attempt)
+        return None
+
+
+class SharedModelTable:
+    STATUSES = ("unknown", "available", "unavailable")
+    MODEL_STATE = struct.Struct("<Bid")  # status 下标, load, recovered_at
+    USAGE_FIELDS = 4                     # usage_count, inflight, tokens_per_sec, assigned
+    ADMIN_STATE = struct.Struct("<Bi")   # draining, traffic_weight
+    RELEASE_QUEUE = 256                  # 每个 worker 最多排多少个转发的释放，满了的等租期到了回收
+    RELEASE_TOKEN = 16                   # slot_id 里面的 uuid，16 字节
+
+    def __init__(self, num_models: int, num_workers: int, history_size: int = 720, num_pools: int = 1):
+        self.num_models = num_models
+        self.num_pools = num_pools
+        self.num_workers = num_workers
+        self.history_size = history_size
+
+        state_capacity = 8 * num_pools + num_models * self.MODEL_STATE.size
+        usage_size = num_workers * num_models * self.USAGE_FIELDS * 4
+        history_bytes = ProbeHistory.buffer_size(history_size)
+        history_stride = (history_bytes + 7) // 8 * 8  # 每个模型的历史按 8 字节对齐
+        self.state_offset = 0
+        self.usage_offset = (SeqlockBlob.HEADER_SIZE + state_capacity + 7) // 8 * 8
+        self.slot_offset = (self.usage_offset + usage_size + 7) // 8 * 8
+        self.history_offset = (self.slot_offset + num_models * 4 + 7) // 8 * 8
+        self.admin_offset = self.history_offset + num_models * history_stride
+        admin_capacity = num_models * self.ADMIN_STATE.size
+        self.release_offset = (self.admin_offset + SeqlockBlob.HEADER_SIZE + admin_capacity + 7) // 8 * 8
+        self.release_stride = 8 + self.RELEASE_QUEUE * self.RELEASE_TOKEN  # [个数 u32, 对齐][token, ...]
+        size = self.release_offset + num_workers * self.release_stride
+
+        # 匿名共享内存，fork 出来的子进程继承同一块内存
+        self.buffer = mmap.mmap(-1, max(size, 1))
+        self.states = SeqlockBlob(self.buffer, self.state_offset, state_capacity)
+        self.usage = memoryview(self.buffer)[self.usage_offset:self.usage_offset + usage_size].cast('i')
+        self.slots = memoryview(self.buffer)[self.slot_offset:self.slot_offset + num_models * 4].cast('i')
+        self.slot_lock = multiprocessing.get_context("fork").Lock()
+        self.history_views = [
+            memoryview(self.buffer)[self.history_offset + i * history_stride:
+                                    self.history_offset + i * history_stride + history_bytes]
+            for i in range(num_models)
+        ]
+        self.admin = SeqlockBlob(self.buffer, self.admin_offset, admin_capacity)
+        self.admin_lock = multiprocessing.get_context("fork").Lock()
+
+    #---------------------------------------------------------
+    # 1：模型状态，0 号 worker 写
+    #---------------------------------------------------------
+    def publish_models(self, versions, models) -> None:
+        """versions: 每个池的版本号；models: 所有池的模型，按池的顺序展开"""
+        payload = struct.pack(f"<{len(versions)}Q", *versions) + b"".join(
+            self.MODEL_STATE.pack(self.STATUSES.index(m.status), m.load, m.recovered_at)
+            for m in models
+        )
+        self.states.write(payload)
+
+    def read_models(self):
+        """返回 ([每个池的版本号], [(status, load, recovered_at), ...])，还没有发布过返回 ([], [])"""
+        result = self.states.read()
+        if result is None or result[0] == 0:
+            return [], []
+        payload = result[1]
+        versions = list(struct.unpack_from(f"<{self.num_pools}Q", payload))
+        states = [
+            (self.STATUSES[status], load, recovered_at)
+            for status, load, recovered_at in self.MODEL_STATE.iter_unpack(payload[8 * self.num_pools:])
+        ]
+        return versions, states
+
+    #---------------------------------------------------------
+    # 2：使用信息，每个 worker 只写自己的行
+    #---------------------------------------------------------
+    def publish_usage(self, worker_id: int, rows) -> None:
+        """rows: 每个模型一个 (usage_count, inflight, tokens_per_sec, assigned)"""
+        base = worker_id * self.num_models * self.USAGE_FIELDS
+        for i, row in enumerate(rows):
+            offset = base + i * self.USAGE_FIELDS
+            for field, value in enumerate(row):
+                self.usage[offset + field] = value
+
+    def peer_usage(self, worker_id: int):
+        """其他 worker 的使用信息之和，每个模型一个 [usage_count, inflight, tokens_per_sec, assigned]"""
+        totals = [[0] * self.USAGE_FIELDS for _ in range(self.num_models)]
+        for worker in range(self.num_workers):
+            if worker == worker_id:
+                continue
+            base = worker * self.num_models * self.USAGE_FIELDS
+            for i in range(self.num_models):
+                offset = base + i * self.USAGE_FIELDS
+                for field in range(self.USAGE_FIELDS):
+                    totals[i][field] += self.usage[offset + field]
+        return totals
+
+    #---------------------------------------------------------
+    # 3：槽位计数，所有 worker 共用
+    #---------------------------------------------------------
+    def slot_count(self, index: int) -> int:
+        return self.slots[index]
+
+    def try_acquire_slot(self, index: int, limit: int) -> bool:
+        """槽位数没有达到 limit（0 表示不限制）就加一，返回是否成功"""
+        with self.slot_lock:
+            if limit > 0 and self.slots[index] >= limit:
+                return False
+            self.slots[index] += 1
+            return True
+
+    def release_slot(self, index: int) -> None:
+        with self.slot_lock:
+            if self.slots[index] > 0:
+                self.slots[index] -= 1
+
+    #---------------------------------------------------------
+    # 4：探测历史
+    #---------------------------------------------------------
+    def history(self, index: int) -> ProbeHistory:
+        return ProbeHistory(self.history_size, buffer=self.history_views[index])
+
+    #---------------------------------------------------------
+    # 5：管理员设置的端点状态，任何 worker 都可以写（加锁），所有 worker 读
+    #---------------------------------------------------------
+    def update_admin(self, changes) -> None:
+        """changes: {模型下标: (draining, traffic_weight)}，读出整张表改完再写回"""
+        with self.admin_lock:
+            _, states = self.read_admin()
+            states = states or [(False, 100)] * self.num_models
+            for index, state in changes.items():
+                states[index] = state
+            self.admin.write(b"".join(self.ADMIN_STATE.pack(draining, weight) for draining, weight in states))
+
+    def read_admin(self):
+        """返回 (序号, [(draining, traffic_weight), ...])，还没有写过返回 (0, [])"""
+        result = self.admin.read()
+        if result is None or result[0] == 0:
+            return 0, []
+        return result[0], [(bool(draining), weight) for draining, weight in self.ADMIN_STATE.iter_unpack(result[1])]
+
+    #---------------------------------------------------------
+    # 6：转发的槽位释放，任何 worker 都可以放进去，只有分配槽位的 worker 取出来（加槽位计数的锁）
+    #---------------------------------------------------------
+    def forward_release(self, worker_id: int, token: bytes) -> bool:
+        """把 worker_id 分配的槽位放进它的释放队列，队列满了返回 False"""
+        base = self.release_offset + worker_id * self.release_stride
+        with self.slot_lock:
+            count = struct.unpack_from("<I", self.buffer, base)[0]
+            if count >= self.RELEASE_QUEUE:
+                return False
+            start = base + 8 + count * self.RELEASE_TOKEN
+            self.buffer[start:start + self.RELEASE_TOKEN] = token
+            struct.pack_into("<I", self.buffer, base, count + 1)
+            return True
+
+    def take_releases(self, worker_id: int):
+        """取出其他 worker 转发给 worker_id 的槽位释放，返回 [token, ...]"""
+        base = self.release_offset + worker_id * self.release_stride
+        if not struct.unpack_from("<I", self.buffer, base)[0]:
+            return []  # 大多数时候是空的，不用抢跨进程的锁
+        with self.slot_lock:
+            count = struct.unpack_from("<I", self.buffer, base)[0]
+            tokens = [bytes(self.buffer[base + 8 + i * self.RELEASE_TOKEN:base + 8 + (i + 1) * self.RELEASE_TOKEN])
+                      for i in range(count)]
+            struct.pack_into("<I", self.buffer, base, 0)
+        return tokens
@@ -0,0 +1,309 @@
+import argparse
+import heapq
+import math
+import random
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from typing import Dict, List
+
+from modelpool_trace import load_traces
+
+#--------------------------------------------------------------------------
+# 端点选择策略的离线模拟器
+# 说明：读取服务端和客户端记录的轨迹（modelpool_trace.py），按时间重放：探测得到的
+# 状态变化决定每个时刻哪些端点可用，客户端的每个请求按照被评估的策略重新选择端点。
+# 每个端点是一个有 capacity 个并发位置的排队模型（相当于 vLLM 同时处理的请求数），
+# 满了就排队。请求的服务时间取轨迹里记录的耗时，按端点的快慢换算：
+#     服务时间 = 记录的耗时 / 原端点的相对速度 * 新端点的相对速度
+# 相对速度是这个端点在轨迹里的平均耗时除以所有请求的平均耗时（--uniform-speed 不换算）。
+#    模拟是离散事件驱动的（heapq），不真正等待，几个小时的轨迹几秒钟就能跑完。
+# 输出每个策略的模拟耗时分位数、排队时间、没有可用端点的请求数和负载不均衡程度。
+#     python modelpool_simulator.py server.jsonl client-*.jsonl --policies first least_inflight p2c
+#     python modelpool_simulator.py --synthetic 100000 --rate 8
+#--------------------------------------------------------------------------
+class Endpoint:
+    def __init__(self, key, capacity: int, speed: float = 1.0):
+        self.key = key              # (base_url, model)
+        self.capacity = capacity
+        self.speed = speed          # 相对耗时，越大越慢
+        self.available = True
+        self.busy = 0               # 正在处理的请求数
+        self.queue = deque()        # 排队的请求
+        self.clients = set()        # 分配到这个端点的客户端（相当于 usage_count）
+        self.served = 0
+        self.busy_time = 0.0        # 各个并发位置的忙碌时间之和
+        self.max_queue = 0
+
+    @property
+    def inflight(self) -> int:
+        return self.busy + len(self.queue)
+
+
+#--------------------------------------------------------------------------
+# 策略：choose(candidates, sim) 从可用端点中选一个，candidates 按配置（首次出现）的顺序排列
+#--------------------------------------------------------------------------
+POLICIES: Dict[str, type] = {}
+
+
+def register_policy(name: str):
+    def decorator(cls):
+        cls.name = name
+        POLICIES[name] = cls
+        return cls
+    return decorator
+
+
+class Policy(ABC):
+    """端点选择策略，子类用 register_policy 注册名称"""
+    name = ""
+
+    @abstractmethod
+    def choose(self, candidates: List[Endpoint], sim: "Simulator") -> Endpoint:
+        """从可用的 candidates 中选择一个端点"""
+
+
+@register_policy("first")
+class FirstPolicy(Policy):
+    """总是选第一个可用的端点（load 都是 0 的时候，只按 load 排序就是这样）"""
+    def choose(self, candidates, sim):
+        return candidates[0]
+
+
+@register_policy("random")
+class RandomPolicy(Policy):
+    def choose(self, candidates, sim):
+        return sim.rng.choice(candidates)
+
+
+@register_policy("round_robin")
+class RoundRobinPolicy(Policy):
+    def __init__(self):
+        self.counter = 0
+
+    def choose(self, candidates, sim):
+        self.counter += 1
+        return candidates[self.counter % len(candidates)]
+
+
+@register_policy("fewest_clients")
+class FewestClientsPolicy(Policy):
+    """按 usage_count（使用这个端点的客户端数）最少选择"""
+    def choose(self, candidates, sim):
+        return min(candidates, key=lambda e: len(e.clients))
+
+
+@register_policy("least_inflight")
+class LeastInflightPolicy(Policy):
+    """按实时的在途请求数最少选择（相当于心跳上报没有延迟）"""
+    def choose(self, candidates, sim):
+        return min(candidates, key=lambda e: e.inflight)
+
+
+@register_policy("polled_least_inflight")
+class PolledLeastInflightPolicy(Policy):
+    """按在途请求数最少选择，但是只能看到每 poll_interval 秒刷新一次的快照（相当于客户端轮询）"""
+    def __init__(self):
+        self.snapshot = {}
+        self.snapshot_at = -math.inf
+
+    def choose(self, candidates, sim):
+        if sim.now - self.snapshot_at >= sim.poll_interval:
+            self.snapshot = {e.key: e.inflight for e in sim.endpoints.values()}
+            self.snapshot_at = sim.now
+        # 快照之后本地选过的也算上，避免同一个周期内所有请求都压到同一个端点
+        choice = min(candidates, key=lambda e: self.snapshot.get(e.key, 0))
+        self.snapshot[choice.key] = self.snapshot.get(choice.key, 0) + 1
+        return choice
+
+
+@register_policy("p2c")
+class PowerOfTwoPolicy(Policy):
+    """随机取两个，选在途请求数少的"""
+    def choose(self, candidates, sim):
+        if len(candidates) == 1:
+            return candidates[0]
+        a, b = sim.rng.sample(candidates, 2)
+        return a if a.inflight <= b.inflight else b
+
+
+#--------------------------------------------------------------------------
+# 离散事件模拟
+#--------------------------------------------------------------------------
+COMPLETION, STATUS, ARRIVAL = 0, 1, 2  # 同一时刻先完成，再改状态，最后到达
+
+
+class Simulator:
+    def __init__(self, events: List[dict], policy: Policy, capacity: int = 8,
+                 uniform_speed: bool = False, poll_interval: float = 10.0, seed: int = 0):
+        self.policy = policy
+        self.poll_interval = poll_interval
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.endpoints: Dict[tuple, Endpoint] = {}
+        self.heap = []
+        self.order = 0
+
+        speeds = {} if uniform_speed else self._estimate_speeds(events)
+        for event in events:
+            kind = event.get("e")
+            if kind not in ("req", "status", "probe"):
+                continue
+            key = (event.get("u"), event.get("m"))
+            if key not in self.endpoints:
+                self.endpoints[key] = Endpoint(key, capacity, speeds.get(key, 1.0))
+            if kind == "status":
+                # 端点一开始都认为可用，状态变化按时间重放
+                self._push(event["t"], STATUS, (key, event.get("s") == "available"))
+            elif kind == "req":
+                self._push(event["t"], ARRIVAL, event)
+
+        self.latencies = []
+        self.waits = []
+        self.rejected = 0
+        self.start = self.heap[0][0] if self.heap else 0.0
+
+    @staticmethod
+    def _estimate_speeds(events):
+        """端点的相对速度：这个端点的平均耗时 / 所有请求的平均耗时"""
+        totals = defaultdict(lambda: [0.0, 0])
+        for event in events:
+            if event.get("e") == "req" and event.get("ok", 1):
+                total = totals[(event.get("u"), event.get("m"))]
+                total[0] += event.get("d", 0.0)
+                total[1] += 1
+        count = sum(n for _, n in totals.values())
+        if not count:
+            return {}
+        mean = sum(d for d, _ in totals.values()) / count
+        if mean <= 0:
+            return {}
+        return {key: (d / n) / mean for key, (d, n) in totals.items() if n}
+
+    def _push(self, t, kind, payload):
+        self.order += 1
+        heapq.heappush(self.heap, (t, kind, self.order, payload))
+
+    def _start(self, endpoint: Endpoint, arrival: float, service: float):
+        endpoint.busy += 1
+        self.waits.append(self.now - arrival)
+        endpoint.busy_time += service
+        self._push(self.now + service, COMPLETION, (endpoint, arrival))
+
+    def run(self):
+        while self.heap:
+            self.now, kind, _, payload = heapq.heappop(self.heap)
+            if kind == COMPLETION:
+                endpoint, arrival = payload
+                endpoint.busy -= 1
+                endpoint.served += 1
+                self.latencies.append(self.now - arrival)
+                if endpoint.queue:
+                    queued_arrival, service = endpoint.queue.popleft()
+                    self._start(endpoint, queued_arrival, service)
+            elif kind == STATUS:
+                key, available = payload
+                self.endpoints[key].available = available
+            else:
+                self._arrive(payload)
+        return self
+
+    def _arrive(self, event):
+        model = event.get("m")
+        candidates = [e for e in self.endpoints.values() if e.available and e.key[1] == model]
+        if not candidates:
+            self.rejected += 1
+            return
+        endpoint = self.policy.choose(candidates, self)
+        original = self.endpoints.get((event.get("u"), model))
+        work = event.get("d", 0.0) / (original.speed if original is not None and original.speed > 0 else 1.0)
+        service = work * endpoint.speed
+        endpoint.clients.add(event.get("c"))
+        if endpoint.busy < endpoint.capacity:
+            self._start(endpoint, self.now, service)
+        else:
+            endpoint.queue.append((self.now, service))
+            endpoint.max_queue = max(endpoint.max_queue, len(endpoint.queue))
+
+    def report(self) -> dict:
+        latencies = sorted(self.latencies)
+        span = max(self.now - self.start, 1e-9)
+
+        def percentile(values, p):
+            return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+        utilizations = [e.busy_time / (e.capacity * span) for e in self.endpoints.values()]
+        mean_util = sum(utilizations) / len(utilizations) if utilizations else 0.0
+        return {
+            "policy": self.policy.name,
+            "requests": len(latencies),
+            "rejected": self.rejected,
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "mean_wait": sum(self.waits) / len(self.waits) if self.waits else 0.0,
+            "max_util": max(utilizations, default=0.0),
+            # 不均衡：最忙的端点的利用率 / 平均利用率，1 表示完全均衡
+            "imbalance": max(utilizations) / mean_util if mean_util > 0 else 0.0,
+            "max_queue": max((e.max_queue for e in self.endpoints.values()), default=0),
+            "span": span,
+        }
+
+
+#--------------------------------------------------------------------------
+# 没有真实轨迹的时候生成一份：泊松到达，端点快慢不同，中间有一个端点故障一段时间
+#--------------------------------------------------------------------------
+def synthetic_trace(num_requests: int, rate: float = 8.0, speeds=(1.0, 1.0, 1.5, 3.0),
+                    mean_service: float = 2.0, num_clients: int = 50, seed: int = 1) -> List[dict]:
+    rng = random.Random(seed)
+    keys = [(f"http://10.0.0.{i}:8000/v1", "/models/M") for i in range(len(speeds))]
+    events = []
+    t = 0.0
+    for _ in range(num_requests):
+        t += rng.expovariate(rate)
+        i = rng.randrange(len(keys))
+        service = rng.lognormvariate(math.log(mean_service), 0.5) * speeds[i]
+        events.append({"t": t, "e": "req", "c": f"client-{rng.randrange(num_clients)}",
+                       "u": keys[i][0], "m": keys[i][1], "d": service, "ok": 1})
+    # 第一个端点在 30%~40% 的时间段内不可用
+    events.append({"t": t * 0.3, "e": "status", "u": keys[0][0], "m": keys[0][1], "s": "unavailable"})
+    events.append({"t": t * 0.4, "e": "status", "u": keys[0][0], "m": keys[0][1], "s": "available"})
+    events.sort(key=lambda event: event["t"])
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay modelpool traces against endpoint selection policies")
+    parser.add_argument("traces", nargs="*", help="服务端和客户端的轨迹文件（.jsonl 或 .jsonl.gz）")
+    parser.add_argument("--policies", nargs="+", default=list(POLICIES), choices=list(POLICIES))
+    parser.add_argument("--capacity", type=int, default=8, help="每个端点同时处理的请求数")
+    parser.add_argument("--poll-interval", type=float, default=10.0, help="polled_least_inflight 的快照刷新间隔（秒）")
+    parser.add_argument("--uniform-speed", action="store_true", help="不按端点的快慢换算服务时间")
+    parser.add_argument("--synthetic", type=int, default=0, help="不读轨迹，生成这么多个请求")
+    parser.add_argument("--rate", type=float, default=8.0, help="生成轨迹的请求速率（每秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        events = synthetic_trace(args.synthetic, args.rate, seed=args.seed + 1)
+    elif args.traces:
+        events = load_traces(args.traces)
+    else:
+        parser.error("需要轨迹文件或者 --synthetic")
+
+    print(f"{'policy':<22} {'requests':>9} {'rejected':>8} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'wait':>8} {'max_util':>8} {'imbal':>6} {'max_q':>6} {'speedup':>9}")
+    for name in args.policies:
+        wall_start = time.perf_counter()
+        sim = Simulator(events, POLICIES[name](), capacity=args.capacity, uniform_speed=args.uniform_speed,
+                        poll_interval=args.poll_interval, seed=args.seed).run()
+        wall = time.perf_counter() - wall_start
+        r = sim.report()
+        print(f"{name:<22} {r['requests']:>9} {r['rejected']:>8} {r['mean']:>8.2f} {r['p50']:>8.2f} {r['p95']:>8.2f} "
+              f"{r['p99']:>8.2f} {r['mean_wait']:>8.2f} {r['max_util']:>8.2f} {r['imbalance']:>6.2f} "
+              f"{r['max_queue']:>6} {r['span'] / wall:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import select
+import signal
+import argparse
+import subprocess
+from typing import Optional
+from loguru import logger
+
+#--------------------------------------------------------------------------
+# modelpool server 的守护进程，负责零停机重启
+# 说明：以前 monitor_modeserver.sh 用 kill -9 重启服务，在处理的 RPC 全部失败，agent 也会
+# 掉进 _rebuild_all_channels 等好几秒。现在由 supervisor 拉起 modelpool_Servicer.py：
+#   1：收到 SIGHUP（发版、改了配置）的时候先启动一个新的 modelpool server，新进程完成第一轮
+#      探测之后用 SO_REUSEPORT 监听同一个端口，再通过管道（--ready-fd）通知 supervisor；
+#   2：supervisor 给旧进程发 SIGTERM，旧进程停止监听、给客户端发 GOAWAY，客户端的 channel
+#      自动重连到新进程，旧进程在处理的请求最多再等 shutdown_grace_seconds 秒；
+#   3：新进程在 ready_timeout 秒内没有就绪（配置写错了、启动失败），杀掉新进程，旧进程继续服务；
+#   4：modelpool server 意外退出的时候重新拉起；supervisor 收到 SIGTERM 的时候优雅停止服务后退出。
+# 使用：python modelpool_supervisor.py --port 50051 --config modelserver.json
+#       kill -HUP <supervisor pid>    # 零停机重启
+#--------------------------------------------------------------------------
+SERVICER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelpool_Servicer.py")
+
+
+class Supervisor:
+    RESTART_BACKOFF = 5  # 意外退出或者启动失败之后，过多久再拉起（秒）
+
+    def __init__(self, port: Optional[str] = None, config_file: str = "modelserver.json",
+                 ready_timeout: float = 120, stop_timeout: float = 60, script: str = SERVICER_SCRIPT):
+        self.port = port
+        self.config_file = config_file
+        self.ready_timeout = ready_timeout  # 新进程最多等多久就绪
+        self.stop_timeout = stop_timeout    # 旧进程收到 SIGTERM 之后最多等多久，超时 SIGKILL
+        self.script = script
+        self.current: Optional[subprocess.Popen] = None
+        self.reload_requested = False
+        self.stop_requested = False
+
+    def _spawn(self) -> Optional[subprocess.Popen]:
+        """启动一个新的 modelpool server 并等待就绪，失败返回 None"""
+        read_fd, write_fd = os.pipe()
+        command = [sys.executable, self.script, "--config", self.config_file, "--ready-fd", str(write_fd)]
+        if self.port:
+            command += ["--port", str(self.port)]
+        try:
+            process = subprocess.Popen(command, pass_fds=(write_fd,))
+        finally:
+            os.close(write_fd)
+        try:
+            # 新进程就绪的时候写入 1；启动失败退出的话管道关闭，读到空
+            readable, _, _ = select.select([read_fd], [], [], self.ready_timeout)
+            ready = bool(readable) and os.read(read_fd, 1) == b"1"
+        finally:
+            os.close(read_fd)
+        if ready:
+            logger.info(f"modelpool server {process.pid} is ready")
+            return process
+        if process.poll() is not None:
+            logger.error(f"modelpool server {process.pid} exited with code {process.returncode} before becoming ready")
+        else:
+            logger.error(f"modelpool server {process.pid} did not become ready within {self.ready_timeout}s, killing it")
+            process.kill()
+        process.wait()
+        return None
+
+    def _stop(self, process: subprocess.Popen) -> None:
+        """SIGTERM 让进程优雅停止，超时再 SIGKILL"""
+        if process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(self.stop_timeout)
+            logger.info(f"modelpool server {process.pid} stopped, exit code {process.returncode}")
+        except subprocess.TimeoutExpired:
+            logger.warning(f"modelpool server {process.pid} did not stop within {self.stop_timeout}s, killing it")
+            process.kill()
+            process.wait()
+
+    def restart(self) -> bool:
+        """零停机重启：新进程就绪之后再停掉旧进程"""
+        logger.info(f"Restarting modelpool server {self.current.pid if self.current else None}")
+        process = self._spawn()
+        if process is None:
+            logger.error("New modelpool server failed to start, keeping the old one")
+            return False
+        old, self.current = self.current, process
+        if old is not None:
+            self._stop(old)
+        return True
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.reload_requested = True
+        else:
+            self.stop_requested = True
+
+    def run(self) -> None:
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+        logger.info(f"modelpool supervisor started (pid {os.getpid()})")
+        next_start = 0.0
+        while not self.stop_requested:
+            if self.current is None or self.current.poll() is not None:
+                if self.current is not None:
+                    logger.error(f"modelpool server {self.current.pid} exited unexpectedly with code {self.current.returncode}")
+                    self.current = None
+                if time.time() >= next_start:
+                    self.current = self._spawn()
+                    if self.current is None:
+                        next_start = time.time() + self.RESTART_BACKOFF
+            elif self.reload_requested:
+                self.reload_requested = False
+                self.restart()
+            time.sleep(0.2)
+        if self.current is not None:
+            self._stop(self.current)
+        logger.info("modelpool supervisor stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="modelpool server supervisor (zero-downtime restart on SIGHUP)")
+    parser.add_argument("--port", help="监听端口，不指定使用 modelpool_Servicer.py 的默认端口")
+    parser.add_argument("--config", default="modelserver.json", help="配置文件")
+    parser.add_argument("--ready-timeout", type=float, default=120, help="新进程最多等多久就绪（秒）")
+    parser.add_argument("--stop-timeout", type=float, default=60, help="旧进程收到 SIGTERM 之后最多等多久（秒），超时 SIGKILL")
+    args = parser.parse_args()
+    Supervisor(args.port, args.config, args.ready_timeout, args.stop_timeout).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional
+from loguru import logger
+import grpc
+
+from modelpool_client import ModelPoolClient, pick_model
+
+#--------------------------------------------------------------------------
+# 同步（多线程）模型服务池客户端
+# 说明：ModelPoolClient 只能在 asyncio 里面用，线程池或者 Flask/gunicorn 的 agent
+# 要么每次调用都起一个事件循环，要么干脆不用模型池。
+#    SyncModelPoolClient 在一个后台线程里面跑事件循环和 ModelPoolClient 的轮询、心跳。
+# 每次模型列表有变化，后台线程生成一个不可变的快照（ModelSnapshot）整体替换掉
+# self.snapshot，读的线程只是拿一次引用，不加锁也不发 RPC，任意多个线程同时
+# select_model 都不会互相阻塞。
+#    会修改客户端状态的操作（登记使用的模型、在途请求计数）通过 call_soon_threadsafe
+# 交给后台线程执行；需要等结果的操作（立即刷新、申请槽位）用 run_coroutine_threadsafe。
+#    注意：gunicorn 这类 fork 出 worker 的服务，要在 worker 进程里面（post_fork 之后）创建。
+#--------------------------------------------------------------------------
+class ModelSnapshot(NamedTuple):
+    models: tuple        # 可用模型（protobuf Model），按服务端排好的顺序
+    version: int         # 服务端的模型列表版本
+    stale: bool          # 是否是过期的列表（modelpool server 不可达）
+    updated_at: float    # 生成快照的时间
+
+
+class SyncModelPoolClient:
+    def __init__(self, addresses: list[str] = ["localhost:50051", "localhost:50052"],
+                 interval: int = 10, heartbeat_interval: float = 1.0, **kwargs):
+        """kwargs 原样传给 ModelPoolClient"""
+        self.snapshot = ModelSnapshot((), 0, True, 0.0)
+        self._ready = threading.Event()   # 第一次从服务端拿到列表（或者加载了缓存）
+        self._started = threading.Event()
+        self._init_error = None
+        self.loop = asyncio.new_event_loop()
+        self.client: Optional[ModelPoolClient] = None
+        self.thread = threading.Thread(target=self._run, args=(addresses, interval, heartbeat_interval, kwargs),
+                                       name="ModelPoolSyncClient", daemon=True)
+        self.thread.start()
+        self._started.wait()
+        if self._init_error is not None:
+            raise self._init_error
+
+    @property
+    def client_id(self) -> str:
+        return self.client.client_id
+
+    #--------------------------------------------------------------------------
+    # 后台线程：事件循环、轮询和心跳都在这里
+    #--------------------------------------------------------------------------
+    def _run(self, addresses, interval, heartbeat_interval, kwargs):
+        asyncio.set_event_loop(self.loop)
+        try:
+            # grpc.aio 的 channel 要在它所属的事件循环线程里创建
+            self.client = ModelPoolClient(addresses, **kwargs)
+            self.client.add_listener(self._publish)
+            if self.client.models:
+                self._publish(self.client)  # 本地缓存加载的列表
+            self.loop.run_until_complete(self.client.start_polling(interval, heartbeat_interval))
+        except Exception as e:
+            self._init_error = e
+            self._started.set()
+            return
+        self._started.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    def _publish(self, client: ModelPoolClient) -> None:
+        """生成新的不可变快照，一次赋值替换（读的线程要么看到旧的，要么看到新的）"""
+        self.snapshot = ModelSnapshot(tuple(client.models), client.models_version, client.stale, time.time())
+        if client.models or not client.stale:
+            self._ready.set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """等待第一份模型列表，超时返回 False"""
+        return self._ready.wait(timeout)
+
+    #--------------------------------------------------------------------------
+    # 读：不加锁、不发 RPC
+    #--------------------------------------------------------------------------
+    @property
+    def stale(self) -> bool:
+        return self.snapshot.stale
+
+    def get_all_available_models(self) -> List:
+        return list(self.snapshot.models)
+
+    def select_model(self, model_type: Optional[str] = None, model: Optional[str] = None, tokens: int = 0):
+        """从当前快照中选择最空闲的模型，没有可用的返回 None；tokens 见 pick_model"""
+        distance = self.client.distance if self.client.prefer_nearby else None
+        return pick_model(self.snapshot.models, model_type, model, tokens, distance)
+
+    #--------------------------------------------------------------------------
+    # 写：交给后台线程执行，不等结果
+    #--------------------------------------------------------------------------
+    def add_model_usage(self, base_url: str, model: str) -> None:
+        self.loop.call_soon_threadsafe(self.client.add_model_usage, base_url, model)
+
+    def remove_model_usage(self, base_url: str, model: str) -> None:
+        self.loop.call_soon_threadsafe(self.client.remove_model_usage, base_url, model)
+
+    def acquire_request(self, base_url: str, model: str) -> None:
+        self.loop.call_soon_threadsafe(self.client.acquire_request, base_url, model)
+
+    def release_request(self, base_url: str, model: str) -> None:
+        self.loop.call_soon_threadsafe(self.client.release_request, base_url, model)
+
+    def record_tokens(self, base_url: str, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        self.loop.call_soon_threadsafe(self.client.record_tokens, base_url, model, prompt_tokens, completion_tokens)
+
+    @contextmanager
+    def track_request(self, base_url: str, model: str):
+        """在途请求计数，异常退出也会 release"""
+        self.acquire_request(base_url, model)
+        start = time.time()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.release_request(base_url, model)
+            # 轨迹记录是线程安全的，直接在调用线程里写
+            self.client.record_request(base_url, model, start, time.time() - start, ok)
+
+    #--------------------------------------------------------------------------
+    # 需要等结果的调用：在后台事件循环里执行，调用线程阻塞等待
+    #--------------------------------------------------------------------------
+    def _call(self, coro, timeout: Optional[float]):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def get_available_models(self, timeout: float = 10.0):
+        """立即向服务端刷新一次并返回列表"""
+        self._call(self.client.get_available_models(), timeout)
+        return self.get_all_available_models()
+
+    def acquire_slot(self, model_type: Optional[str] = None, model: Optional[str] = None,
+                     base_url: Optional[str] = None, wait_timeout: float = 30.0, lease_seconds: int = 0):
+        """申请并发槽位，见 ModelPoolClient.acquire_slot"""
+        return self._call(self.client.acquire_slot(model_type, model, base_url, wait_timeout, lease_seconds),
+                          wait_timeout + 5)
+
+    def pick_endpoint(self, model_type: Optional[str] = None, model: Optional[str] = None, prefetch: int = 1,
+                      timeout: float = 10.0):
+        """服务端分配端点，见 ModelPoolClient.pick_endpoint"""
+        return self._call(self.client.pick_endpoint(model_type, model, prefetch), timeout)
+
+    def chat_completion(self, messages, model_type: Optional[str] = None, model: Optional[str] = None,
+                        timeout: Optional[float] = None, **kwargs):
+        """在模型池上执行 chat completion（非流式），失败自动换端点重试，见 ModelPoolClient.chat_completion"""
+        return self._call(self.client.chat_completion(messages, model_type, model, **kwargs), timeout)
+
+    def release_slot(self, model, slot_id: str, timeout: float = 5.0) -> None:
+        self._call(self.client.release_slot(model, slot_id), timeout)
+
+    @contextmanager
+    def slot(self, model_type: Optional[str] = None, model: Optional[str] = None,
+             base_url: Optional[str] = None, wait_timeout: float = 30.0, lease_seconds: int = 0):
+        """申请槽位并统计在途请求，yield 分配到的 Model，见 ModelPoolClient.slot：
+            with client.slot(model_type="deepseek") as m:
+                response = openai_client.chat.completions.create(model=m.model, ...)"""
+        slot_id = None
+        try:
+            selected, slot_id = self.acquire_slot(model_type, model, base_url, wait_timeout, lease_seconds)
+        except grpc.RpcError as e:
+            logger.warning(f"Slot admission unavailable, falling back to local selection: {e}")
+            selected = self.select_model(model_type, model)
+            if selected is None:
+                raise
+        try:
+            with self.track_request(selected.base_url, selected.model):
+                yield selected
+        finally:
+            if slot_id:
+                self.release_slot(selected, slot_id)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """停止轮询、关闭通道并结束后台线程"""
+        if not self.loop.is_running():
+            return
+        try:
+            self._call(self.client.close(), timeout)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
+
+
+# 测试代码
+def main():
+    client = SyncModelPoolClient(["localhost:50051", "localhost:50052"])
+    client.add_model_usage("http://172.21.30.231:8987/v1", "/models/DeepSeek-R1-Distill-Qwen-32B")
+    client.wait_ready(15)
+    try:
+        while True:
+            m = client.select_model(model_type="deepseek")
+            logger.info(f"Selected: {m.base_url if m else None}, stale: {client.stale}")
+            time.sleep(5)
+    except KeyboardInterrupt:
+        client.close()
+
+if __name__ == "__main__":
+    main()
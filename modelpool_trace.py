@@ -0,0 +1,59 @@
+import gzip
+import json
+import time
+from threading import Lock
+from typing import Iterator, List
+
+#--------------------------------------------------------------------------
+# 轨迹记录
+# 说明：服务端和客户端都可以把关键事件按行写成 JSON（文件名以 .gz 结尾的会压缩），
+# 给 modelpool_simulator.py 离线重放，评估不同的端点选择策略。字段名都很短：
+#   服务端 {"t": 时间, "e": "probe", "u": base_url, "m": model, "ok": 1, "ms": 探测耗时}
+#          {"t": 时间, "e": "status", "u": base_url, "m": model, "s": "available"}
+#   客户端 {"t": 开始时间, "e": "req", "c": client_id, "u": base_url, "m": model, "d": 耗时秒, "ok": 1}
+# 记录是线程安全的，写文件有缓冲，每秒最多 flush 一次。
+#--------------------------------------------------------------------------
+class TraceRecorder:
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = gzip.open(path, "at", encoding="utf-8") if path.endswith(".gz") else open(path, "a", encoding="utf-8")
+        self.lock = Lock()
+        self.last_flush = time.time()
+
+    def record(self, event: str, timestamp: float = None, **fields) -> None:
+        """记录一个事件，timestamp 默认是当前时间"""
+        now = time.time()
+        line = json.dumps({"t": round(timestamp if timestamp is not None else now, 3), "e": event, **fields},
+                          separators=(",", ":"), ensure_ascii=False)
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(line + "\n")
+            if now - self.last_flush >= self.FLUSH_INTERVAL:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def read_trace(path: str) -> Iterator[dict]:
+    """逐行读取轨迹文件，跳过不完整的行（例如进程退出时写了一半）"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def load_traces(paths: List[str]) -> List[dict]:
+    """读取多个轨迹文件（服务端的和各个客户端的），按时间合并"""
+    events = [event for path in paths for event in read_trace(path)]
+    events.sort(key=lambda event: event["t"])
+    return events
@@ -0,0 +1,295 @@
+import time
+from array import array
+from threading import Lock
+from loguru import logger
+
+#--------------------------------------------------------------------------
+# 客户端模型使用信息登记表（分片加锁）
+# 说明：原来 client_usage、model_clients、client_last_active 和所有模型的 usage_count
+# 都在一把 usage_lock 后面，每个带使用信息的 GetModelList/GetAvailableModels、超时清理、
+# 每个周期的日志打印都要抢这一把锁。
+#    这里按 client_id 的 hash 分成多个分片，每个分片有自己的锁和自己的表，模型的
+# usage_count / inflight 在每个分片里各自计数，读的时候把所有分片加起来（读不加锁）。
+# 共享客户端下挂的 agent（client_id/agent_id）按所属的 client_id 分片，这样一个客户端
+# 和它的 agent 的所有操作都在同一个分片内完成。
+#    注意：默认只有 1 个分片。CPython 有 GIL，这些纯 Python 的代码同一时刻只有一个线程在执行，
+# 锁多了只会让线程切换更频繁：modelpool_bench_usage.py 在 8 个线程下 16 个分片比 1 个分片
+# 慢 20%-50%，16 个线程下吞吐从约 6.5-7.6 万次/秒降到约 3.8 万次/秒，p99 从约 8 毫秒升到约 17 毫秒。
+# 要试多个分片用 usage_shards 配置，先用压测确认。
+#    紧凑存储：短生命周期的 agent 很多的时候，原来的 defaultdict(set) 每个客户端要一个 set、
+# 36 个字符的 uuid 在 client_usage、client_last_active、client_usage_seq 里各占一个字典项，
+# 一个客户端五六百字节。现在 client_id 在分片里只存一次，映射成整数句柄，句柄是下面
+# 几个平铺数组的下标：
+#   1：masks：每个客户端 words 个 64 位字，按模型下标记录用了哪些模型（位图）；
+#   2：last_active / usage_seqs：最后活跃时间和增量上报序号；
+# 删除的客户端的句柄放进空闲列表复用，数组只增不减。
+# 没有在配置文件里的 (base_url, model) 没有下标，只打告警，不再记录。
+#--------------------------------------------------------------------------
+class UsageShard:
+    def __init__(self, model_index, model_keys=None):
+        self.lock = Lock()
+        self.model_index = model_index  # {(base_url, model): 模型下标}，所有分片共用，只读
+        self.model_keys = model_keys or sorted(model_index, key=model_index.get)  # 模型下标到 (base_url, model)
+        self.words = max(1, (len(self.model_keys) + 63) // 64)  # 每个客户端的位图占几个 64 位字
+        #---------------------------------------------------------
+        # 1：client_id 到整数句柄，句柄到 client_id（空闲的为 None）
+        #---------------------------------------------------------
+        self.handles = {}      # {client_id: 句柄}
+        self.client_ids = []   # [client_id 或 None]
+        self.free_handles = []
+        #---------------------------------------------------------
+        # 2：按句柄存放的平铺数组：使用的模型（位图）、最后活跃时间（0 表示空闲句柄）、
+        # 增量上报的序号（0 表示没有，协议里的序号从 1 开始）
+        #---------------------------------------------------------
+        self.masks = array('Q')
+        self.last_active = array('d')
+        self.usage_seqs = array('Q')
+        self.client_agents = {}  # {共享客户端的句柄: set([agent 的句柄, ...])}
+        #---------------------------------------------------------
+        # 3：在途请求数：每个客户端最后一次心跳上报的值，只保存不为 0 的
+        #---------------------------------------------------------
+        self.client_inflight = {}  # {句柄: {模型下标: count}}
+        #---------------------------------------------------------
+        # 4：本分片内每个模型的使用客户端数和在途请求数，按模型下标存放
+        #---------------------------------------------------------
+        self.usage_counts = [0] * len(self.model_keys)
+        self.inflight_counts = [0] * len(self.model_keys)
+
+    #---------------------------------------------------------
+    # 以下几个函数调用方需要持有 self.lock
+    #---------------------------------------------------------
+    def handle(self, client_id, create=True):
+        """client_id 对应的句柄，create 为 False 时不存在返回 None"""
+        handle = self.handles.get(client_id)
+        if handle is not None or not create:
+            return handle
+        if self.free_handles:
+            handle = self.free_handles.pop()
+            self.client_ids[handle] = client_id
+        else:
+            handle = len(self.client_ids)
+            self.client_ids.append(client_id)
+            self.masks.extend([0] * self.words)
+            self.last_active.append(0.0)
+            self.usage_seqs.append(0)
+        self.handles[client_id] = handle
+        self.last_active[handle] = time.time()
+        return handle
+
+    def client_models(self, handle):
+        """客户端使用的模型下标"""
+        indexes = []
+        base = handle * self.words
+        for word in range(self.words):
+            bits = self.masks[base + word]
+            while bits:
+                low = bits & -bits
+                indexes.append(word * 64 + low.bit_length() - 1)
+                bits ^= low
+        return indexes
+
+    def _set_model(self, handle, index, used):
+        """设置位图中的一位，返回是否有变化"""
+        position = handle * self.words + (index >> 6)
+        bit = 1 << (index & 63)
+        if bool(self.masks[position] & bit) == used:
+            return False
+        self.masks[position] ^= bit
+        self.usage_counts[index] += 1 if used else -1
+        return True
+
+    def add_client_model(self, client_id, model_key, handle=None):
+        """记录 client_id 开始使用 model_key"""
+        index = self.model_index.get(model_key)
+        if index is None:
+            # 如果未找到匹配的模型，记录警告
+            logger.warning(f"Client {client_id} is using an unregistered model: base_url={model_key[0]}, model={model_key[1]}")
+            return
+        if handle is None:
+            handle = self.handle(client_id)
+        if self._set_model(handle, index, True):
+            logger.info(f"===>agent client_id: {client_id} add new model: {model_key[0]}{model_key[1]}")
+
+    def remove_client_model(self, client_id, model_key, handle=None):
+        """记录 client_id 不再使用 model_key"""
+        index = self.model_index.get(model_key)
+        if handle is None:
+            handle = self.handles.get(client_id)
+        if index is None or handle is None:
+            return
+        if self._set_model(handle, index, False):
+            logger.info(f"Client {client_id} has been removed from model {model_key[0]},{model_key[1]}")
+
+    def remove_client(self, client_id):
+        """删除客户端的所有记录，共享客户端会连同它下挂的 agent 一起删除，句柄放回空闲列表"""
+        handle = self.handles.pop(client_id, None)
+        if handle is None:
+            return
+        for agent_handle in self.client_agents.pop(handle, ()):
+            self.remove_client(self.client_ids[agent_handle])
+        for index in self.client_models(handle):
+            self._set_model(handle, index, False)
+        self.set_client_inflight(client_id, {}, handle)
+        self.client_ids[handle] = None
+        self.last_active[handle] = 0.0
+        self.usage_seqs[handle] = 0
+        self.free_handles.append(handle)
+        parent_id = client_id.split("/", 1)[0]
+        parent = self.handles.get(parent_id) if parent_id != client_id else None
+        if parent is not None and parent in self.client_agents:
+            self.client_agents[parent].discard(handle)
+
+    def set_client_inflight(self, client_id, inflight, handle=None):
+        """替换客户端的在途请求数（{(base_url, model): count}），并把差值累加到对应模型的计数"""
+        if handle is None:
+            handle = self.handle(client_id)
+        new_inflight = {}
+        for model_key, count in inflight.items():
+            index = self.model_index.get(model_key)
+            if index is not None and count:
+                new_inflight[index] = count
+        old_inflight = self.client_inflight.pop(handle, {})
+        if new_inflight:
+            self.client_inflight[handle] = new_inflight
+        for index in old_inflight.keys() | new_inflight.keys():
+            self.inflight_counts[index] += new_inflight.get(index, 0) - old_inflight.get(index, 0)
+
+    def apply_usages(self, client_id, full_sync, model_usages, added_usages, removed_usages):
+        """应用一个客户端（或者 agent）的全量或增量使用信息"""
+        handle = self.handle(client_id)
+        if full_sync:
+            new_keys = {(u.base_url, u.model) for u in model_usages}
+            for index in self.client_models(handle):
+                if self.model_keys[index] not in new_keys:
+                    self.remove_client_model(client_id, self.model_keys[index], handle)
+            for model_key in new_keys:
+                self.add_client_model(client_id, model_key, handle)
+            return
+        for u in removed_usages:
+            self.remove_client_model(client_id, (u.base_url, u.model), handle)
+        for u in added_usages:
+            self.add_client_model(client_id, (u.base_url, u.model), handle)
+
+
+class UsageRegistry:
+    def __init__(self, model_keys, num_shards: int = 1):
+        # 同一个 (base_url, model) 配置了多次的，只统计到第一个
+        model_keys = list(model_keys)
+        self.model_index = {}
+        for index, model_key in enumerate(model_keys):
+            self.model_index.setdefault(model_key, index)
+        self.shards = [UsageShard(self.model_index, model_keys) for _ in range(max(1, num_shards))]
+
+    def _shard(self, client_id) -> UsageShard:
+        """按所属客户端的 client_id 分片，agent 和它的共享客户端在同一个分片"""
+        return self.shards[hash(client_id.split("/", 1)[0]) % len(self.shards)]
+
+    #---------------------------------------------------------
+    # 读：把所有分片的计数加起来，不加锁
+    #---------------------------------------------------------
+    def usage_count(self, index: int) -> int:
+        return sum(shard.usage_counts[index] for shard in self.shards)
+
+    def inflight(self, index: int) -> int:
+        return max(0, sum(shard.inflight_counts[index] for shard in self.shards))
+
+    def client_count(self) -> int:
+        return sum(len(shard.handles) for shard in self.shards)
+
+    #---------------------------------------------------------
+    # 写：只锁 client_id 所在的分片
+    #---------------------------------------------------------
+    def update_usage(self, client_id, model_usages):
+        """老客户端（usage_seq 为 0）的上报：model_usages 只增不减"""
+        shard = self._shard(client_id)
+        with shard.lock:
+            # 更新最后活跃时间
+            handle = shard.handle(client_id)
+            shard.last_active[handle] = time.time()
+            for usage in model_usages:
+                shard.add_client_model(client_id, (usage.base_url, usage.model), handle)
+
+    def apply_report(self, request) -> bool:
+        """处理增量协议（usage_seq > 0）的上报，返回是否需要客户端全量重传"""
+        client_id = request.client_id
+        shard = self._shard(client_id)
+        with shard.lock:
+            handle = shard.handle(client_id, create=request.full_sync)
+            last_seq = shard.usage_seqs[handle] if handle is not None else 0
+            if not request.full_sync and (not last_seq or request.usage_seq != last_seq + 1):
+                # 服务端不认识这个客户端（重启或已超时清理）或者中间丢了上报，增量无法应用
+                logger.warning(f"Client {client_id} usage_seq {request.usage_seq} does not follow {last_seq or None}, requesting full sync")
+                return True
+
+            now = time.time()
+            shard.last_active[handle] = now
+            shard.usage_seqs[handle] = request.usage_seq
+            shard.apply_usages(client_id, request.full_sync, request.model_usages,
+                               request.added_usages, request.removed_usages)
+
+            # 共享客户端：每个 agent 以 "client_id/agent_id" 作为独立的客户端统计，usage_count 仍然是 agent 的数量
+            reported_agents = set()
+            for agent in request.agent_usages:
+                if not agent.agent_id:
+                    continue
+                agent_client_id = f"{client_id}/{agent.agent_id}"
+                if agent.full_sync and not agent.model_usages:
+                    # 全量且为空：agent 已经注销
+                    shard.remove_client(agent_client_id)
+                    continue
+                agent_handle = shard.handle(agent_client_id)
+                reported_agents.add(agent_handle)
+                shard.last_active[agent_handle] = now
+                shard.client_agents.setdefault(handle, set()).add(agent_handle)
+                shard.apply_usages(agent_client_id, agent.full_sync, agent.model_usages,
+                                   agent.added_usages, agent.removed_usages)
+
+            if request.full_sync:
+                # 全量同步时没有带上来的 agent 都已经不存在了
+                for agent_handle in shard.client_agents.get(handle, set()) - reported_agents:
+                    shard.remove_client(shard.client_ids[agent_handle])
+            return False
+
+    def report_inflight(self, client_id, inflight):
+        """客户端心跳：替换它的在途请求数"""
+        shard = self._shard(client_id)
+        with shard.lock:
+            handle = shard.handle(client_id)
+            shard.last_active[handle] = time.time()
+            shard.set_client_inflight(client_id, inflight, handle)
+
+    def cleanup(self, timeout: float) -> int:
+        """清理超过 timeout 秒未活跃的客户端，逐个分片加锁，返回清理的数量"""
+        removed = 0
+        for shard in self.shards:
+            with shard.lock:
+                current_time = time.time()
+                # 空闲句柄的最后活跃时间是 0，不会被选中
+                inactive_clients = [
+                    shard.client_ids[handle] for handle, last_active in enumerate(shard.last_active)
+                    if last_active and current_time - last_active > timeout
+                ]
+                for client_id in inactive_clients:
+                    # 共享客户端下的 agent 跟随所属客户端的活跃状态，客户端还活着就不清理
+                    parent_id = client_id.split("/", 1)[0]
+                    parent = shard.handles.get(parent_id) if parent_id != client_id else None
+                    if parent is not None and current_time - shard.last_active[parent] <= timeout:
+                        continue
+                    if client_id in shard.handles:
+                        shard.remove_client(client_id)
+                        removed += 1
+                        logger.info(f"Cleaned up timed-out client {client_id}")
+        return removed
+
+    def snapshot(self):
+        """合并所有分片的表（还原成以 client_id 为键的字典），用于日志打印，逐个分片加锁复制"""
+        client_usage, client_last_active, client_inflight = {}, {}, {}
+        for shard in self.shards:
+            with shard.lock:
+                for client_id, handle in shard.handles.items():
+                    client_usage[client_id] = {shard.model_keys[index] for index in shard.client_models(handle)}
+                    client_last_active[client_id] = shard.last_active[handle]
+                for handle, counts in shard.client_inflight.items():
+                    client_inflight[shard.client_ids[handle]] = {
+                        shard.model_keys[index]: count for index, count in counts.items()}
+        return client_usage, client_last_active, client_inflight
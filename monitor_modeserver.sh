@@ -2,8 +2,11 @@
 
 # 脚本日志文件路径（用于记录脚本本身的运行状态）
 SCRIPT_LOG_FILE="./monitor_modelpool.log"
-# Python 脚本路径（与脚本同目录）
-PYTHON_SCRIPT="./modelpool_Servicer.py"
+# Python 脚本路径（与脚本同目录）：supervisor 负责拉起 modelpool_Servicer.py 和零停机重启
+PYTHON_SCRIPT="./modelpool_supervisor.py"
+SERVICER_SCRIPT="./modelpool_Servicer.py"
+# 优雅停止最多等多少秒，超时再 kill -9
+STOP_TIMEOUT=70
 # PID 文件路径（与脚本同目录）
 PID_FILE="./modelpool_service.pid"
 # 监控脚本自身的 PID 文件
@@ -15,6 +18,20 @@ log() {
     echo "$(date '+%Y-%m-%d %H:%M:%S') - $1"  # 同时输出到终端，便于调试
 }
 
+# 优雅停止进程：先 SIGTERM，让 modelpool server 处理完在途请求，超时再 kill -9
+stop_process() {
+    local pid=$1
+    kill -TERM "$pid" 2>/dev/null
+    for ((i = 0; i < STOP_TIMEOUT; i++)); do
+        if ! ps -p "$pid" > /dev/null 2>&1; then
+            return 0
+        fi
+        sleep 1
+    done
+    log "Process $pid did not stop within ${STOP_TIMEOUT}s, killing it"
+    kill -9 "$pid" 2>/dev/null
+}
+
 # 清理旧进程
 cleanup_old_processes() {
     log "Cleaning up old processes..."
@@ -36,20 +53,20 @@ cleanup_old_processes() {
     if [ -f "$PID_FILE" ]; then
         OLD_PID=$(cat "$PID_FILE")
         if ps -p "$OLD_PID" > /dev/null 2>&1; then
-            log "Killing old service process with PID: $OLD_PID"
-            kill -9 "$OLD_PID" 2>/dev/null
+            log "Stopping old service process with PID: $OLD_PID"
+            stop_process "$OLD_PID"
         fi
         rm -f "$PID_FILE"
     fi
 
-    # 额外的安全检查：通过进程名查找并清理残留的 modelpool_Servicer.py
-    PIDS=$(pgrep -f "$PYTHON_SCRIPT")
+    # 额外的安全检查：通过进程名查找并清理残留的 modelpool_supervisor.py 和 modelpool_Servicer.py
+    PIDS=$(pgrep -f "$PYTHON_SCRIPT|$SERVICER_SCRIPT|modelpool_Servicer.py")
     if [ -n "$PIDS" ]; then
-        log "Found residual $PYTHON_SCRIPT processes: $PIDS. Killing them..."
+        log "Found residual modelpool processes: $PIDS. Stopping them..."
         echo "$PIDS" | while read -r pid; do
             if ps -p "$pid" > /dev/null 2>&1; then
-                log "Killing residual process with PID: $pid"
-                kill -9 "$pid" 2>/dev/null
+                log "Stopping residual process with PID: $pid"
+                stop_process "$pid"
             fi
         done
     fi
@@ -57,7 +74,7 @@ cleanup_old_processes() {
 
 # 启动 Python 服务
 start_service() {
-    log "Starting modelpool_Servicer.py..."
+    log "Starting modelpool_supervisor.py..."
     python3 "$PYTHON_SCRIPT" &
     PID=$!
     echo "$PID" > "$PID_FILE"
@@ -104,4 +121,7 @@ done
 ##  ./monitor_modeserver.sh  
 ##
 ## 后台启动脚本：
-##  nohup ./monitor_modeserver.sh  &
\ No newline at end of file
+##  nohup ./monitor_modeserver.sh  &
+##
+## 零停机重启（发版、修改 modelserver.json 之后）：
+##  kill -HUP $(cat ./modelpool_service.pid)
\ No newline at end of file
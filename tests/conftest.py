@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+from concurrent import futures
+
+import grpc
+import pytest
+from loguru import logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modelpool_pb2_grpc
+from modelpool_Servicer import ModelPoolServiceServicer
+
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+
+# 测试用的端点都指向没有监听的端口，探测马上失败，需要可用的端点时测试里直接改 status
+MODEL_URLS = ["http://127.0.0.1:1/v1", "http://127.0.0.1:2/v1"]
+MODEL_PATH = "/models/M"
+
+
+@pytest.fixture
+def make_server(tmp_path):
+    """启动进程内的 modelpool server，返回 (servicer, 地址)，测试结束后停止"""
+    servers = []
+
+    def start(config=None, shared=None, worker_id=0):
+        config = config or {
+            "health_check_interval": 60,
+            "models": [
+                {"name": f"m{i}", "model_type": "m", "model": MODEL_PATH, "base_url": base_url}
+                for i, base_url in enumerate(MODEL_URLS)
+            ],
+        }
+        config_file = tmp_path / "modelserver.json"
+        config_file.write_text(json.dumps(config))
+        servicer = ModelPoolServiceServicer(str(config_file), shared=shared, worker_id=worker_id)
+        servicer.ready.wait(10)  # 第一轮探测之后测试再改端点状态，不会被探测线程覆盖
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        modelpool_pb2_grpc.add_ModelPoolServiceServicer_to_server(servicer, server)
+        port = server.add_insecure_port("127.0.0.1:0")
+        server.start()
+        servers.append(server)
+        return servicer, f"127.0.0.1:{port}"
+
+    yield start
+    for server in servers:
+        server.stop(None)
@@ -0,0 +1,54 @@
+import modelpool_pb2
+from modelpool_capacity import ThroughputEstimator
+from modelpool_client import LONG_CONTEXT_TOKENS, pick_model
+
+
+def endpoint(name, capacity=0.0, tokens_per_sec=0.0, inflight=0):
+    return modelpool_pb2.Model(name=name, model_type="m", model="/models/M", base_url=f"http://{name}/v1",
+                               inflight=inflight, weight=100, capacity_tokens_per_sec=capacity,
+                               tokens_per_sec=tokens_per_sec,
+                               headroom_tokens_per_sec=max(0.0, capacity - tokens_per_sec))
+
+
+def test_rate_drops_to_zero_after_window():
+    estimator = ThroughputEstimator(window=30)
+    estimator.add(3000, now=1000.0)
+    assert estimator.rate(now=1000.5) == 100
+    assert estimator.rate(now=1031.0) == 0
+
+
+def test_idle_endpoint_capacity_decays():
+    estimator = ThroughputEstimator()
+    estimator.observe(1000, inflight=4, now=1000.0)
+    assert estimator.capacity == 1000 and not estimator.measured
+    # 空闲的端点（没有吞吐）也会衰减，一个半衰期之后只剩一半
+    estimator.observe(0, inflight=0, now=1000.0 + ThroughputEstimator.DECAY_HALF_LIFE)
+    assert abs(estimator.capacity - 500) < 1e-6
+
+
+def test_saturation_is_learned_when_concurrency_grows_without_throughput():
+    estimator = ThroughputEstimator()
+    estimator.observe(1000, inflight=4, now=1000.0)
+    estimator.observe(1010, inflight=8, now=1010.0)
+    assert estimator.measured
+    assert 990 < estimator.capacity < 1020
+    assert estimator.headroom(600) == estimator.capacity - 600
+    assert estimator.headroom(5000) == 0
+
+
+def test_long_context_prefers_most_headroom():
+    busy = endpoint("busy", capacity=2000, tokens_per_sec=1900)
+    roomy = endpoint("roomy", capacity=2000, tokens_per_sec=200, inflight=3)
+    assert pick_model([busy, roomy], tokens=LONG_CONTEXT_TOKENS).name == "roomy"
+    # 短请求还是按在途请求数选
+    assert pick_model([busy, roomy]).name == "busy"
+
+
+def test_unknown_endpoint_uses_largest_known_capacity():
+    # 没有吞吐数据的端点按同类端点的最大容量估计，比剩余吞吐小的端点优先
+    known = endpoint("known", capacity=2000, tokens_per_sec=1500)
+    unknown = endpoint("unknown", inflight=2)
+    assert pick_model([known, unknown], tokens=LONG_CONTEXT_TOKENS).name == "unknown"
+    # 都没有容量数据的时候退回按在途请求数选择
+    idle = endpoint("idle")
+    assert pick_model([unknown, idle], tokens=LONG_CONTEXT_TOKENS).name == "idle"
@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+from conftest import MODEL_PATH, MODEL_URLS
+from modelpool_client import ModelPoolClient
+
+
+def test_concurrent_refreshes_reach_the_server_in_order(make_server):
+    servicer, address = make_server()
+    usage = servicer.pools["default"].usage
+    seen = []
+    apply_report = usage.apply_report
+
+    def slow_apply_report(request):
+        # 先发出的上报处理得慢，并发的刷新在服务端就会乱序
+        time.sleep(0.2 if request.usage_seq == 2 else 0.0)
+        seen.append(request.usage_seq)
+        return apply_report(request)
+
+    usage.apply_report = slow_apply_report
+
+    async def run():
+        client = ModelPoolClient([address], prefer_nearby=False)
+        client.add_model_usage(MODEL_URLS[0], MODEL_PATH)
+        await client.get_available_models()
+        client.add_model_usage(MODEL_URLS[1], MODEL_PATH)
+        # 轮询和心跳触发的刷新同时进行
+        await asyncio.gather(client.get_available_models(), client.get_available_models())
+        await client.close()
+        return client
+
+    client = asyncio.run(run())
+    assert seen == [1, 2, 3]
+    assert not client.need_full_sync
+    assert [m.usage_count for m in servicer.pools["default"].models] == [1, 1]
@@ -0,0 +1,37 @@
+import time
+
+from modelpool_history import ProbeHistory
+
+
+def test_read_gives_up_instead_of_returning_torn_data():
+    history = ProbeHistory(capacity=8)
+    for i in range(5):
+        history.record(1000.0 + i, True, 10.0 + i)
+    history.meta[0] += 1  # 其他进程写到一半
+    start = time.process_time()
+    assert history.downsample() == []
+    assert history.latency_trend(window=5) == (0.0, False)
+    # 重试期间睡眠而不是空转
+    assert time.process_time() - start < 0.02
+    history.meta[0] += 1  # 写完
+    assert len(history.downsample()) > 0
+
+
+def record_latencies(history, latencies, start=1000.0):
+    for i, latency in enumerate(latencies):
+        history.record(start + i, True, latency)
+
+
+def test_sub_millisecond_jitter_is_not_a_rising_trend():
+    history = ProbeHistory(capacity=64)
+    # 本机端点：耗时从 0.2 毫秒涨到 0.8 毫秒，相对增长很大但绝对值可以忽略
+    record_latencies(history, [0.2 + 0.02 * i for i in range(30)])
+    slope, rising = history.latency_trend()
+    assert slope > 0 and not rising
+
+
+def test_steady_rise_is_reported():
+    history = ProbeHistory(capacity=64)
+    record_latencies(history, [100.0 + 5 * i for i in range(30)])
+    slope, rising = history.latency_trend()
+    assert rising and abs(slope - 300.0) < 1e-3
@@ -0,0 +1,79 @@
+import asyncio
+import os
+from collections import Counter
+
+import modelpool_pb2
+from modelpool_client import ModelPoolClient
+from modelpool_local import LocalModelPublisher, LocalModelReader
+
+
+def endpoint(name, inflight=0, load=0, weight=100):
+    return modelpool_pb2.Model(name=name, model_type="m", model="/models/M", base_url=f"http://{name}/v1",
+                               status="available", inflight=inflight, load=load, weight=weight)
+
+
+def publish(path, models, capacity=4096):
+    async def run():
+        client = ModelPoolClient(["127.0.0.1:1"], prefer_nearby=False)
+        try:
+            publisher = LocalModelPublisher(client, str(path), capacity=capacity)
+            client.models_version = 1
+            client.set_all_available_models(models)
+            return publisher
+        finally:
+            await client.close()
+    return asyncio.run(run())
+
+
+def test_reader_spreads_picks_over_the_best_endpoints(tmp_path):
+    path = tmp_path / "table.bin"
+    publish(path, [endpoint("a"), endpoint("b", inflight=1), endpoint("c", inflight=2), endpoint("d", inflight=3),
+                   endpoint("busy", load=5)])
+    reader = LocalModelReader(str(path))
+    picks = Counter(reader.select_model("m").name for _ in range(3000))
+    # 在前三名里随机，第四名和负载高的端点不选
+    assert set(picks) == {"a", "b", "c"}
+    assert min(picks.values()) > 700
+    assert reader.select_model("other") is None
+
+
+def test_reader_only_uses_the_best_level(tmp_path):
+    path = tmp_path / "table.bin"
+    publish(path, [endpoint("idle"), endpoint("loaded", load=3)])
+    reader = LocalModelReader(str(path))
+    assert {reader.select_model().name for _ in range(100)} == {"idle"}
+
+
+def test_publisher_never_shrinks_the_table_file(tmp_path):
+    path = tmp_path / "table.bin"
+    publish(path, [endpoint("a")], capacity=1 << 20)
+    size = os.path.getsize(path)
+    # 读的进程还映射着大文件的时候，用更小的 capacity 重启发布进程
+    reader = LocalModelReader(str(path))
+    assert reader.select_model().name == "a"
+    publish(path, [endpoint("b")], capacity=4096)
+    assert os.path.getsize(path) == size
+    assert reader.select_model().name == "b"
+
+
+def test_reader_follows_a_publisher_restarted_with_a_larger_capacity(tmp_path):
+    path = tmp_path / "table.bin"
+    publish(path, [endpoint("a")], capacity=512)
+    reader = LocalModelReader(str(path))
+    assert reader.select_model().name == "a"
+    # 发布进程用更大的 capacity 重启，列表比读的进程映射的容量还长
+    many = [endpoint(f"e{i:02d}", inflight=i) for i in range(40)]
+    publish(path, many, capacity=8192)
+    assert reader.version == 1
+    assert len(reader.get_all_available_models()) == 40
+    assert reader.select_model().name in {"e00", "e01", "e02"}
+
+
+def test_reader_keeps_the_previous_table_on_a_corrupt_payload(tmp_path):
+    path = tmp_path / "table.bin"
+    publisher = publish(path, [endpoint("a")])
+    reader = LocalModelReader(str(path))
+    assert reader.select_model().name == "a"
+    publisher.blob.write(b"\x00\xff\xff\xff")  # 解析不了的数据
+    assert reader.select_model().name == "a"
+    assert [m.name for m in reader.get_all_available_models()] == ["a"]
@@ -0,0 +1,124 @@
+import time
+
+import grpc
+import pytest
+from loguru import logger
+
+import modelpool_pb2
+import modelpool_pb2_grpc
+from modelpool_shm import SharedModelTable
+
+
+def get_available(address, **kwargs):
+    with grpc.insecure_channel(address) as channel:
+        stub = modelpool_pb2_grpc.ModelPoolServiceStub(channel)
+        return stub.GetAvailableModels(modelpool_pb2.AvailableModelsRequest(**kwargs), timeout=5)
+
+
+@pytest.mark.parametrize("paths", [["name", "status_code"], ["status_code"], ["name"]])
+def test_field_mask_keeps_status_code(make_server, paths):
+    servicer, address = make_server()
+    servicer.pools["default"].models[0].status = "available"
+    response = get_available(address, field_mask={"paths": paths})
+    assert len(response.models) == 1
+    m = response.models[0]
+    assert m.status_code == modelpool_pb2.STATUS_AVAILABLE
+    assert m.name == ("m0" if "name" in paths else "")
+    assert m.base_url == "" and m.status == ""
+
+
+def test_unknown_field_mask_is_rejected(make_server):
+    _, address = make_server()
+    with pytest.raises(grpc.RpcError) as error:
+        get_available(address, field_mask={"paths": ["no_such_field"]})
+    assert error.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+
+def test_failure_report_does_not_block_on_reprobe(make_server):
+    import socket
+    import time
+    from concurrent import futures
+
+    # 接受连接但是不应答的端点，探测要等到 probe_timeout
+    hanging = socket.socket()
+    hanging.bind(("127.0.0.1", 0))
+    hanging.listen(64)
+    base_url = f"http://127.0.0.1:{hanging.getsockname()[1]}/v1"
+    try:
+        servicer, address = make_server({
+            "health_check_interval": 60, "probe_timeout": 1,
+            "models": [{"name": "hang", "model_type": "m", "model": "/models/M", "base_url": base_url}],
+        })
+        pool = servicer.pools["default"]
+        m = pool.models[0]
+        m.status = "available"
+        version = pool.models_version
+        report = modelpool_pb2.EndpointFailureReport(client_id="c", base_url=base_url, model="/models/M", error="timeout")
+        with grpc.insecure_channel(address) as channel:
+            stub = modelpool_pb2_grpc.ModelPoolServiceStub(channel)
+            start = time.time()
+            with futures.ThreadPoolExecutor(max_workers=20) as executor:
+                acks = list(executor.map(lambda _: stub.ReportEndpointFailure(report, timeout=5), range(20)))
+            assert time.time() - start < 0.5
+            # 同一个端点只排一次重新探测
+            assert sum(ack.reprobed for ack in acks) == 1
+            # 探测线程池里的重新探测失败之后直接标记为不可用
+            deadline = time.time() + 5
+            while m.status == "available" and time.time() < deadline:
+                time.sleep(0.05)
+            assert m.status == "unavailable"
+            assert pool.models_version != version
+    finally:
+        hanging.close()
+
+
+def test_release_on_another_worker_frees_the_shared_slot(make_server):
+    shared = SharedModelTable(num_models=2, num_workers=2)
+    owner, _ = make_server(shared=shared, worker_id=0)
+    other, _ = make_server(shared=shared, worker_id=1)
+    m = owner.pools["default"].models[0]
+    slot_id = owner._new_slot_id()
+    assert m.take_slot(slot_id, "c", time.time() + 60)
+    assert shared.slot_count(0) == 1
+
+    # 客户端重连之后释放落到了另一个 worker
+    request = modelpool_pb2.ReleaseSlotRequest(client_id="c", slot_id=slot_id, base_url=m.base_url, model=m.model)
+    assert other.ReleaseSlot(request, None).released
+    deadline = time.time() + 2
+    while shared.slot_count(0) and time.time() < deadline:
+        time.sleep(0.05)
+    assert shared.slot_count(0) == 0 and not m.slots
+    # 重复释放只转发，不会把计数减成负的或者减掉别的槽位
+    assert m.take_slot(owner._new_slot_id(), "c2", time.time() + 60)
+    assert other.ReleaseSlot(request, None).released
+    time.sleep(3 * owner.SHARED_SYNC_INTERVAL)
+    assert shared.slot_count(0) == 1
+    # 格式不对的 slot_id 不转发
+    request.slot_id = "not-a-slot"
+    assert not other.ReleaseSlot(request, None).released
+
+
+def test_rising_latency_warns_once_per_episode(make_server):
+    servicer, _ = make_server()
+    pool = servicer.pools["default"]
+    m = pool.models[0]
+    warnings = []
+    handler = logger.add(lambda message: warnings.append(message), level="WARNING",
+                         filter=lambda record: "rising" in record["message"])
+    try:
+        for i in range(30):
+            m.history.record(2000.0 + i, True, 100.0 + 5 * i)
+        servicer._check_latency_trends(pool)
+        servicer._check_latency_trends(pool)
+        assert len(warnings) == 1
+        # 恢复平稳之后再次上升，重新告警
+        for i in range(30):
+            m.history.record(2030.0 + i, True, 250.0)
+        servicer._check_latency_trends(pool)
+        assert not m.latency_rising
+        for i in range(30):
+            m.history.record(2060.0 + i, True, 250.0 + 5 * i)
+        servicer._check_latency_trends(pool)
+        assert len(warnings) == 2
+    finally:
+        logger.remove(handler)
@@ -0,0 +1,29 @@
+import asyncio
+
+from conftest import MODEL_PATH, MODEL_URLS
+from modelpool_shared_client import SharedModelPoolClient
+
+
+def test_last_agent_close_reports_unregistration(make_server):
+    servicer, address = make_server()
+    m = servicer.pools["default"].models[0]
+
+    async def run():
+        shared = SharedModelPoolClient([address], prefer_nearby=False)
+        first = shared.register_agent("agent-1")
+        second = shared.register_agent("agent-2")
+        first.add_model_usage(MODEL_URLS[0], MODEL_PATH)
+        second.add_model_usage(MODEL_URLS[0], MODEL_PATH)
+        await shared.get_available_models()
+        assert m.usage_count == 2
+
+        await first.close()
+        await shared.get_available_models()
+        assert m.usage_count == 1
+
+        # 最后一个 agent 退出：关闭共享客户端之前上报注销
+        await second.close()
+        assert m.usage_count == 0
+        assert shared.channels and not SharedModelPoolClient._instances
+
+    asyncio.run(run())
@@ -0,0 +1,26 @@
+import mmap
+import time
+
+from modelpool_shm import SeqlockBlob
+
+
+def make_blob(capacity=64):
+    return SeqlockBlob(mmap.mmap(-1, SeqlockBlob.HEADER_SIZE + capacity), 0, capacity)
+
+
+def test_read_returns_last_write():
+    blob = make_blob()
+    assert blob.read() == (0, b"")
+    blob.write(b"hello")
+    blob.write(b"hi")
+    assert blob.read() == (4, b"hi")
+
+
+def test_read_gives_up_while_writer_holds_the_lock():
+    blob = make_blob()
+    blob.write(b"hello")
+    blob.meta[0] += 1  # 写的一方写到一半
+    start = time.process_time()
+    assert blob.read(retries=20) is None
+    # 重试期间睡眠而不是空转
+    assert time.process_time() - start < 0.01
@@ -0,0 +1,152 @@
+from threading import Lock
+
+import modelpool_pb2
+from modelpool_usage import UsageRegistry
+
+MODEL_KEYS = [(f"http://10.0.0.{i}:8000/v1", f"/models/M{i}") for i in range(3)]
+
+
+def usages(*indexes):
+    return [modelpool_pb2.ModelUsage(base_url=MODEL_KEYS[i][0], model=MODEL_KEYS[i][1]) for i in indexes]
+
+
+def report(registry, client_id, seq, full=(), added=(), removed=(), full_sync=False, agents=()):
+    request = modelpool_pb2.AvailableModelsRequest(
+        client_id=client_id, usage_seq=seq, full_sync=full_sync, model_usages=usages(*full),
+        added_usages=usages(*added), removed_usages=usages(*removed))
+    for agent_id, agent_full_sync, agent_models in agents:
+        request.agent_usages.add(agent_id=agent_id, full_sync=agent_full_sync, model_usages=usages(*agent_models))
+    return registry.apply_report(request)
+
+
+def counts(registry):
+    return [registry.usage_count(i) for i in range(len(MODEL_KEYS))]
+
+
+def expire(registry, client_id):
+    """把客户端的最后活跃时间改成很久以前，然后清理"""
+    shard = registry._shard(client_id)
+    shard.last_active[shard.handles[client_id]] = 1.0
+    return registry.cleanup(60)
+
+
+def test_delta_and_full_sync():
+    registry = UsageRegistry(MODEL_KEYS)
+    assert not report(registry, "c", 1, full=(0, 1), full_sync=True)
+    assert counts(registry) == [1, 1, 0]
+    assert not report(registry, "c", 2, added=(2,), removed=(0,))
+    assert counts(registry) == [0, 1, 1]
+    # 序号不连续：不应用增量，要求全量重传
+    assert report(registry, "c", 4, added=(0,))
+    assert counts(registry) == [0, 1, 1]
+    # 全量覆盖之前的所有记录
+    assert not report(registry, "c", 5, full=(0,), full_sync=True)
+    assert counts(registry) == [1, 0, 0]
+    # 重复的新增和删除不存在的模型不影响计数
+    assert not report(registry, "c", 6, added=(0,), removed=(2,))
+    assert counts(registry) == [1, 0, 0]
+
+
+def test_unknown_client_delta_requires_full_sync():
+    registry = UsageRegistry(MODEL_KEYS)
+    assert report(registry, "new", 3, added=(0,))
+    assert counts(registry) == [0, 0, 0] and registry.client_count() == 0
+
+
+def test_handle_reuse_after_expiry_clears_stale_bits():
+    registry = UsageRegistry(MODEL_KEYS, num_shards=1)
+    report(registry, "old", 1, full=(0, 1), full_sync=True)
+    registry.report_inflight("old", {MODEL_KEYS[0]: 3})
+    shard = registry.shards[0]
+    old_handle = shard.handles["old"]
+    assert expire(registry, "old") == 1
+    # 过期之后计数归零
+    assert counts(registry) == [0, 0, 0]
+    assert registry.inflight(0) == 0 and registry.client_count() == 0
+
+    report(registry, "new", 1, full=(2,), full_sync=True)
+    assert shard.handles["new"] == old_handle
+    assert shard.client_models(old_handle) == [2]
+    assert counts(registry) == [0, 0, 1]
+    assert registry.snapshot()[0] == {"new": {MODEL_KEYS[2]}}
+
+
+def test_shared_client_agents():
+    registry = UsageRegistry(MODEL_KEYS)
+    report(registry, "shared", 1, full_sync=True, agents=[("a1", True, (0,)), ("a2", True, (0, 1))])
+    # usage_count 是 agent 的数量，共享客户端自己没有使用模型
+    assert counts(registry) == [2, 1, 0]
+    assert registry.client_count() == 3
+    # agent 注销：空的全量
+    report(registry, "shared", 2, agents=[("a1", True, ())])
+    assert counts(registry) == [1, 1, 0]
+    # 全量同步时没有带上来的 agent 删除
+    report(registry, "shared", 3, full_sync=True, agents=[("a3", True, (2,))])
+    assert counts(registry) == [0, 0, 1]
+    assert registry.client_count() == 2
+
+
+def test_agents_follow_their_shared_client_on_expiry():
+    registry = UsageRegistry(MODEL_KEYS)
+    report(registry, "shared", 1, full_sync=True, agents=[("a1", True, (0,)), ("a2", True, (1,))])
+    registry.report_inflight("shared", {MODEL_KEYS[0]: 2})
+    # 共享客户端还活着：agent 即使很久没有单独上报也不清理
+    shard = registry._shard("shared")
+    shard.last_active[shard.handles["shared/a1"]] = 1.0
+    assert registry.cleanup(60) == 0
+    # 共享客户端过期：连同它的 agent 一起删除
+    expire(registry, "shared")
+    assert counts(registry) == [0, 0, 0]
+    assert registry.inflight(0) == 0 and registry.client_count() == 0
+
+
+def test_client_and_agents_share_one_shard():
+    registry = UsageRegistry(MODEL_KEYS, num_shards=16)
+    clients = [f"shared-{i}" for i in range(64)]
+    for client_id in clients:
+        report(registry, client_id, 1, full_sync=True, agents=[("a1", True, (0,)), ("a2", True, (1,))])
+    for client_id in clients:
+        shard = registry._shard(client_id)
+        assert registry._shard(f"{client_id}/a1") is shard
+        # 客户端和它的 agent 只登记在这一个分片里
+        holders = [s for s in registry.shards if client_id in s.handles]
+        assert holders == [shard]
+        assert {f"{client_id}/a1", f"{client_id}/a2"} <= set(shard.handles)
+    # 64 个客户端确实分散到了多个分片
+    assert sum(1 for s in registry.shards if s.handles) > 1
+    assert counts(registry) == [64, 64, 0]
+
+
+class TrackedLock:
+    """记录同时持有的锁的数量"""
+
+    def __init__(self, held):
+        self.lock = Lock()
+        self.held = held
+        self.held_max = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.held.append(self)
+        self.held_max = max(self.held_max, len(self.held))
+        return self
+
+    def __exit__(self, *exc):
+        self.held.remove(self)
+        self.lock.release()
+
+
+def test_cleanup_holds_one_shard_lock_at_a_time():
+    registry = UsageRegistry(MODEL_KEYS, num_shards=16)
+    held = []
+    for shard in registry.shards:
+        shard.lock = TrackedLock(held)
+    clients = [f"c{i}" for i in range(64)]
+    for client_id in clients:
+        report(registry, client_id, 1, full=(0,), full_sync=True)
+        shard = registry._shard(client_id)
+        shard.last_active[shard.handles[client_id]] = 1.0
+    assert registry.cleanup(60) == 64
+    assert counts(registry) == [0, 0, 0]
+    assert not held
+    assert max(shard.lock.held_max for shard in registry.shards) == 1